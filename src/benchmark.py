@@ -0,0 +1,306 @@
+# benchmark.py
+
+import argparse             # For command-line options
+import os                   # For changing to the corpus root directory
+import time                 # For measuring elapsed time
+import json                 # To write machine-readable results
+import glob                 # To list the HTML files checked against the reference parser
+import tempfile             # To write the HTML edge cases of the differential check
+import platform             # To describe the machine in the results
+from bs4 import BeautifulSoup  # Reference HTML parser of the differential check
+from bs4.element import PreformattedString  # Base class of comments, CDATA and declarations
+import server               # The search functions being measured
+from cache import ExtractionCache  # To run every measurement with a cold cache
+from corpus import QUERIES, MANIFEST_FILE, generate_corpus  # Synthetic corpus and its queries
+
+def time_search(keyword, repeat):
+    """
+    Measures a full ALL search with the extraction cache disabled.
+
+    Args:
+        keyword (str): The keyword or regex pattern to search for.
+        repeat (int): How many times the search is run; the best time is kept.
+
+    Returns:
+        tuple: (best time in seconds, number of result lines).
+    """
+    best = None
+    results = []
+    for _ in range(repeat):
+        server.EXTRACTION_CACHE = ExtractionCache(0)  # A zero budget caches nothing
+        start = time.perf_counter()
+        results = server.search_all_file_types(keyword)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(results)
+
+def bench_workers(keyword, max_workers, repeat):
+    """
+    Measures how a full scan scales with the number of scan worker processes.
+
+    Args:
+        keyword (str): The keyword or regex pattern to search for.
+        max_workers (int): The largest number of workers to try (every count from 1 is measured).
+        repeat (int): How many times each measurement is repeated.
+
+    Returns:
+        list: One result dictionary per worker count.
+    """
+    server.USE_INDEX = False  # Measure the scan itself, not the index
+    rows = []
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        server.set_scan_workers(workers)
+        time_search(keyword, 1)  # Warm-up run, so starting the worker processes is not measured
+        elapsed, hits = time_search(keyword, repeat)
+        baseline = baseline or elapsed
+        rows.append({"name": f"workers/{workers}", "workers": workers, "seconds": elapsed, "hits": hits,
+                     "speedup": baseline / elapsed})
+        print(f"[Benchmark] {workers} worker(s): {elapsed:.3f}s, {hits} results, speedup x{baseline / elapsed:.2f}")
+    server.set_scan_workers(1)
+    return rows
+
+# Search function measured for each file type
+FORMAT_SEARCHES = {
+    ".txt": server.search_txt,
+    ".pdf": server.search_pdf,
+    ".html": server.search_html,
+    ".xlsx": server.search_xlsx
+}
+
+def measure(run, repeat, reset=None):
+    """
+    Times a function.
+
+    Args:
+        run (callable): The function measured; it returns the results of the search.
+        repeat (int): How many times it is run.
+        reset (callable): Called before every run (outside the measured time), or None.
+
+    Returns:
+        dict: The best and mean times in seconds and the number of matches.
+    """
+    times = []
+    results = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        results = run()
+        times.append(time.perf_counter() - start)
+    hits = sum(1 for result in results if isinstance(result, server.Hit))
+    return {"seconds": min(times), "mean_seconds": sum(times) / len(times), "hits": hits}
+
+def cold_caches():
+    """
+    Empties the extraction and result caches, so the next search reads every document again.
+    """
+    server.EXTRACTION_CACHE = ExtractionCache(0)  # A zero budget caches nothing
+    server.RESULT_CACHE.clear()
+
+def run_suite(repeat):
+    """
+    Measures every file type with every query type of corpus.QUERIES:
+    cold (documents extracted again), warm (extraction cache filled) and from the index.
+
+    Args:
+        repeat (int): Runs per measurement.
+
+    Returns:
+        list: One result dictionary per measurement, identified by its "name".
+    """
+    server.SEARCH_INDEX.index_path = None  # Do not persist an index of the benchmark corpus
+    rows = []
+
+    def record(name, measurement, files, size):
+        row = dict(measurement, name=name, files=len(files), bytes=size)
+        row["files_per_second"] = len(files) / row["seconds"] if row["seconds"] else None
+        row["mb_per_second"] = size / 1e6 / row["seconds"] if row["seconds"] else None
+        rows.append(row)
+        print(f"[Benchmark] {name:<24} {row['seconds'] * 1000:9.1f} ms  {row['hits']:7} hits  "
+              f"{row['mb_per_second'] or 0:8.2f} MB/s")
+
+    all_files = []
+    for ext, folder in server.FOLDERS.items():
+        files = sorted(glob.glob(os.path.join(folder, f"*{ext}")))
+        all_files.extend(files)
+        size = sum(os.path.getsize(path) for path in files)
+        search = FORMAT_SEARCHES[ext]
+        for query_name, query in QUERIES.items():
+            run = lambda: [hit for path in files for hit in search(path, query)]
+            server.USE_INDEX = False  # Page prefiltering would hide the extraction cost of PDFs
+            record(f"{ext[1:]}/{query_name}/cold", measure(run, repeat, cold_caches), files, size)
+            server.EXTRACTION_CACHE = ExtractionCache(server.EXTRACTION_CACHE_BYTES)
+            run()  # Fill the extraction cache
+            record(f"{ext[1:]}/{query_name}/warm", measure(run, repeat), files, size)
+
+    # handle_search over every file type, answered from the index (result cache emptied every run)
+    server.USE_INDEX = True
+    total_size = sum(os.path.getsize(path) for path in all_files)
+    def build_index():
+        server.SEARCH_INDEX.refresh()
+        return []
+    record("index/build", measure(build_index, 1, cold_caches), all_files, total_size)
+    for query_name, query in QUERIES.items():
+        run = lambda: server.handle_search("ALL", query, "")
+        record(f"all/{query_name}/index", measure(run, repeat, server.RESULT_CACHE.clear), all_files, total_size)
+    return rows
+
+def compare_results(previous_path, rows, tolerance):
+    """
+    Compares measurements with those of a previous run.
+
+    Args:
+        previous_path (str): The JSON file written by a previous run with --output.
+        rows (list): The current measurements.
+        tolerance (float): Relative slowdown tolerated before a measurement counts as a regression.
+
+    Returns:
+        int: The number of regressions.
+    """
+    with open(previous_path, 'r', encoding='utf-8') as file:
+        previous = {row["name"]: row for row in json.load(file)["results"]}
+    regressions = 0
+    for row in rows:
+        old = previous.get(row["name"])
+        if old is None or not old["seconds"]:
+            continue
+        ratio = row["seconds"] / old["seconds"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions += 1
+            flag = "  REGRESSION"
+        elif row["hits"] != old["hits"]:
+            flag = f"  (hits {old['hits']} -> {row['hits']})"
+        print(f"[Compare] {row['name']:<24} {old['seconds'] * 1000:9.1f} ms -> {row['seconds'] * 1000:9.1f} ms  x{ratio:.2f}{flag}")
+    print(f"[Compare] {regressions} regression(s) above {tolerance:.0%}")
+    return regressions
+
+# Edge cases of the differential HTML check (each one is also fed in tiny chunks)
+HTML_CASES = [
+    "<html><body><h1>ceci est un test</h1><p>this is a <b>bold</b> test</p></body></html>",
+    "<p>caf&eacute; &amp; th&#233; &lt;tag&gt; &#x41;&nbsp;B</p>",
+    "<script>var a = '<p>not text</p>'; if (a < b) {}</script><p>visible</p>",
+    "<style>p { color: red; }</style><STYLE>h1{}</STYLE><p>styled</p>",
+    "<!DOCTYPE html><!-- a comment --><p>after comment</p><?php echo 1 ?>",
+    "<p>before<!-- split -->after</p><p>left<script>1</script>right</p>",
+    "<p>unclosed<div>nested <span>deep</span> text<br>line<br/>break</div>",
+    "<![CDATA[hidden]]>plain text at the end",
+    "<title>Title &amp; more</title><textarea>raw <b>text</b></textarea>",
+    "   \n\t  <p>   </p>\n<p>\u00e9t\u00e9 \u4e2d\u6587 \U0001F600</p>",
+    "text " * 5000 + "<p>" + "long paragraph " * 5000 + "</p>",
+]
+
+def reference_html_units(file_path):
+    """
+    Extracts the text units of an HTML file with a complete BeautifulSoup tree (the former
+    extractor), leaving out script/style contents, comments and declarations.
+
+    Args:
+        file_path (str): The path to the HTML file.
+
+    Returns:
+        list: A list of (location, text) tuples, where location is an empty tuple.
+    """
+    units = []
+    with open(file_path, 'r', encoding='utf-8') as file:
+        soup = BeautifulSoup(file, 'html.parser')
+        for string in soup.find_all(string=True):
+            if isinstance(string, PreformattedString):
+                continue  # Comments, CDATA, doctypes and other declarations
+            if string.parent is not None and string.parent.name in server.HTML_SKIPPED_TAGS:
+                continue
+            text = string.strip()
+            if text:
+                units.append(((), text))
+    return units
+
+def check_html(folder):
+    """
+    Compares the streaming HTML extractor with the BeautifulSoup reference on the files of a
+    folder and on built-in edge cases, with the default chunk size and with tiny chunks.
+
+    Args:
+        folder (str): The directory containing the HTML files to check.
+
+    Returns:
+        int: The number of documents whose units differ.
+    """
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = sorted(glob.glob(os.path.join(folder, "*.html")))
+        for number, case in enumerate(HTML_CASES):
+            path = os.path.join(tmp_dir, f"case{number}.html")
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(case)
+            paths.append(path)
+
+        default_chunk_size = server.HTML_CHUNK_SIZE
+        try:
+            for path in paths:
+                expected = reference_html_units(path)
+                for chunk_size in (default_chunk_size, 7, 1):
+                    server.HTML_CHUNK_SIZE = chunk_size
+                    actual = server.extract_html_units(path)
+                    if actual != expected:
+                        failures += 1
+                        print(f"[Check] {path} (chunks of {chunk_size}): {len(actual)} units, expected {len(expected)}")
+                        for got, wanted in zip(actual, expected):
+                            if got != wanted:
+                                print(f"[Check]   first difference: {got!r} != {wanted!r}")
+                                break
+                        break
+        finally:
+            server.HTML_CHUNK_SIZE = default_chunk_size
+    print(f"[Check] {len(paths) - failures}/{len(paths)} HTML documents match the reference parser")
+    return failures
+
+def main():
+    """
+    Parses the command line and runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the search server functions.")
+    parser.add_argument("--root", default=".", help="Directory containing the data/ folders to search")
+    parser.add_argument("--keyword", default="test", help="Keyword or regex pattern to search for")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="Largest number of scan workers")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (the best is kept)")
+    parser.add_argument("--output", help="File to write the results to as JSON")
+    parser.add_argument("--check-html", action="store_true",
+                        help="Compare the HTML extractor with BeautifulSoup instead of benchmarking")
+    parser.add_argument("--suite", action="store_true",
+                        help="Measure every file type with single, AND, OR and regex queries instead of worker scaling")
+    parser.add_argument("--generate", action="store_true", help="Generate a synthetic corpus in --root first")
+    parser.add_argument("--files", type=int, default=10, help="Generated files per file type")
+    parser.add_argument("--file-size", type=int, default=100000, help="Approximate bytes of text per generated file")
+    parser.add_argument("--density", type=float, default=0.01, help="Probability that a generated line contains each query term")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    os.makedirs(args.root, exist_ok=True)
+    os.chdir(args.root)  # FOLDERS are relative paths
+    if args.check_html:
+        raise SystemExit(1 if check_html(server.FOLDERS[".html"]) else 0)
+    if args.generate:
+        generate_corpus(args.files, args.file_size, args.density, args.seed)
+
+    if args.suite:
+        rows = run_suite(args.repeat)
+    else:
+        rows = bench_workers(args.keyword, args.max_workers, args.repeat)
+    if args.output:
+        corpus = None
+        if os.path.exists(MANIFEST_FILE):
+            with open(MANIFEST_FILE, 'r', encoding='utf-8') as file:
+                corpus = json.load(file)
+        meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                "platform": platform.platform(), "cpu_count": os.cpu_count(), "repeat": args.repeat,
+                "keyword": None if args.suite else args.keyword, "corpus": corpus}
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({"meta": meta, "results": rows}, file, indent=2)
+    if args.compare and compare_results(args.compare, rows, args.tolerance):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()  # Execute the main function when the script is run directly
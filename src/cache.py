@@ -0,0 +1,441 @@
+# cache.py
+
+import os                   # For file metadata (mtime, size) and spill file paths
+import sys                  # To estimate the memory used by cached entries
+import pickle               # To spill evicted entries to disk
+import hashlib              # To derive spill file names from cache keys
+import threading            # To protect the cache against concurrent requests
+import logging              # For logging cache activities and errors
+from collections import OrderedDict  # Keeps entries in least-recently-used order
+
+UNIT_OVERHEAD = 120         # Approximate bytes used by a unit tuple besides its text
+
+def file_signature(file_path):
+    """
+    Returns the signature used to detect that a file changed.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        tuple: (mtime in nanoseconds, size in bytes).
+    """
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+def estimate_units_size(units):
+    """
+    Estimates the memory footprint of a list of (location, text) units.
+
+    Args:
+        units (list): The extracted units.
+
+    Returns:
+        int: The approximate size in bytes.
+    """
+    return sys.getsizeof(units) + sum(sys.getsizeof(text) + UNIT_OVERHEAD for location, text in units)
+
+def key_file(key):
+    """
+    Returns the file an extraction cache key belongs to.
+
+    Args:
+        key (str or tuple): A file path, or a tuple starting with one.
+
+    Returns:
+        str: The file path.
+    """
+    return key[0] if isinstance(key, tuple) else key
+
+class ExtractionCache:
+    """
+    LRU cache of extracted text units, keyed by file path and validated by mtime and size.
+
+    Entries are evicted once the memory budget is exceeded. When a spill directory is
+    configured, evicted entries are written there and reloaded on the next request instead
+    of re-parsing the document. A key is either a file path or a tuple starting with the
+    file path (such as (path, page number) for PDF pages).
+    """
+
+    def __init__(self, max_bytes, spill_dir=None):
+        """
+        Args:
+            max_bytes (int): The memory budget for cached units.
+            spill_dir (str): Directory for spilled entries, or None to disable spilling.
+        """
+        self.max_bytes = max_bytes      # Memory budget
+        self.spill_dir = spill_dir      # Optional disk spill directory
+        self.entries = OrderedDict()    # Key -> (signature, units, size), oldest first
+        self.spilled = {}               # File path -> keys of the file written to the spill directory
+        self.current_bytes = 0          # Estimated memory currently used
+        self.lock = threading.Lock()    # Serializes access to the entries and counters
+        self.hits = 0                   # Requests served from memory
+        self.disk_hits = 0              # Requests served from the spill directory
+        self.misses = 0                 # Requests that required an extraction
+        self.evictions = 0              # Entries evicted from memory
+        self.invalidations = 0          # Entries dropped because their file changed
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def lookup(self, key, signature):
+        """
+        Returns the cached units for a key without extracting anything.
+
+        Args:
+            key (hashable): The cache key (usually the file path).
+            signature (tuple): The current signature of the source; a different one invalidates the entry.
+
+        Returns:
+            list: The cached units, or None on a miss (counted as such).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    self.entries.move_to_end(key)  # Mark as most recently used
+                    self.hits += 1
+                    return entry[1]
+                self._discard(key)                 # The source changed since it was cached
+                self.invalidations += 1
+
+        units = self._load_spilled(key, signature)
+        if units is not None:
+            with self.lock:
+                self.disk_hits += 1
+            self.put(key, signature, units)        # Bring it back into memory
+            return units
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def contains(self, key, signature):
+        """
+        Tells whether valid units for a key are held in memory, without counting a lookup.
+
+        Args:
+            key (hashable): The cache key (usually the file path).
+            signature (tuple): The current signature of the source.
+
+        Returns:
+            bool: True if a lookup would be served from memory.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] == signature
+
+    def get(self, key, signature, loader):
+        """
+        Returns the cached units for a key, calling the loader on a miss.
+
+        Args:
+            key (hashable): The cache key (usually the file path).
+            signature (tuple): The current signature of the source; a different one invalidates the entry.
+            loader (callable): Called without arguments to extract the units on a miss.
+
+        Returns:
+            list: The extracted units.
+        """
+        units = self.lookup(key, signature)
+        if units is None:
+            units = loader()  # Extract outside the lock so other requests are not blocked
+            self.put(key, signature, units)
+        return units
+
+    def get_units(self, file_path, extractor):
+        """
+        Returns the units of a file, extracting them only if the file changed.
+
+        Args:
+            file_path (str): The path to the file.
+            extractor (callable): extractor(file_path) -> list of units.
+
+        Returns:
+            list: The extracted units.
+        """
+        return self.get(file_path, file_signature(file_path), lambda: extractor(file_path))
+
+    def put(self, key, signature, units):
+        """
+        Stores units in the cache and evicts the least recently used entries over budget.
+        Evicted entries are spilled once the lock is released, so other requests do not
+        wait for the disk.
+        """
+        size = estimate_units_size(units)
+        spilled = []  # (key, signature, units) to write to the spill directory
+        with self.lock:
+            if key in self.entries:
+                self._discard(key)
+            if size > self.max_bytes:
+                spilled.append((key, signature, units))  # Too large for memory, keep it on disk only
+            else:
+                self.entries[key] = (signature, units, size)
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes and self.entries:
+                    old_key, (old_signature, old_units, old_size) = self.entries.popitem(last=False)
+                    self.current_bytes -= old_size
+                    self.evictions += 1
+                    spilled.append((old_key, old_signature, old_units))
+        for spilled_key, spilled_signature, spilled_units in spilled:
+            self._spill(spilled_key, spilled_signature, spilled_units)
+
+    def invalidate(self, key):
+        """
+        Drops an entry (for example when its file was deleted).
+        """
+        with self.lock:
+            if key in self.entries:
+                self._discard(key)
+                self.invalidations += 1
+        self._remove_spilled(key)
+
+    def invalidate_file(self, file_path):
+        """
+        Drops every entry of a file: the whole file and its parts (PDF pages), in memory
+        and in the spill directory.
+
+        Args:
+            file_path (str): The path to the file.
+        """
+        with self.lock:
+            keys = [key for key in self.entries if key_file(key) == file_path]
+            for key in keys:
+                self._discard(key)
+            self.invalidations += len(keys)
+            spilled = self.spilled.get(file_path, set()) | {file_path}
+        for key in spilled:
+            self._remove_spilled(key)
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Hit, miss, eviction and size counters.
+        """
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+    def _discard(self, key):
+        """
+        Removes an entry from memory (the caller holds the lock).
+        """
+        signature, units, size = self.entries.pop(key)
+        self.current_bytes -= size
+
+    def _spill_path(self, key):
+        """
+        Returns the spill file used for a key, or None if spilling is disabled.
+        """
+        if not self.spill_dir:
+            return None
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, f"{digest}.pkl")
+
+    def _spill(self, key, signature, units):
+        """
+        Writes an evicted entry to the spill directory (without holding the lock). The file
+        is written aside and renamed, so a concurrent lookup never reads half of it.
+        """
+        spill_path = self._spill_path(key)
+        if not spill_path:
+            return
+        tmp_path = f"{spill_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as file:
+                pickle.dump((key, signature, units), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, spill_path)
+        except Exception as e:
+            logging.error(f"Error spilling cache entry {key}: {e}")
+            return
+        with self.lock:
+            self.spilled.setdefault(key_file(key), set()).add(key)
+
+    def _remove_spilled(self, key):
+        """
+        Deletes the spilled entry of a key, if any.
+        """
+        spill_path = self._spill_path(key)
+        if not spill_path:
+            return
+        with self.lock:
+            keys = self.spilled.get(key_file(key))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.spilled[key_file(key)]
+        try:
+            os.remove(spill_path)
+        except FileNotFoundError:
+            pass
+
+    def _load_spilled(self, key, signature):
+        """
+        Reloads a spilled entry if it is still valid.
+
+        Returns:
+            list: The spilled units, or None if there is no valid spilled entry.
+        """
+        spill_path = self._spill_path(key)
+        if not spill_path or not os.path.exists(spill_path):
+            return None
+        try:
+            with open(spill_path, 'rb') as file:
+                spilled_key, spilled_signature, units = pickle.load(file)
+        except Exception as e:
+            logging.error(f"Error reading spilled cache entry {key}: {e}")
+            return None
+        if spilled_key != key or spilled_signature != signature:
+            self._remove_spilled(key)  # Stale entry for an older version of the file
+            return None
+        return units
+
+def folder_version(folder, extension):
+    """
+    Derives a version of the files of one type in a folder from their names, mtimes and sizes.
+    Adding, removing, renaming or modifying a file changes the version.
+
+    Args:
+        folder (str): The directory to inspect.
+        extension (str): The file extension of the files that matter.
+
+    Returns:
+        int: The version, or None if the folder cannot be read.
+    """
+    files = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(extension) and entry.is_file():
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    except OSError:
+        return None
+    return hash(tuple(sorted(files)))
+
+class ResultCache:
+    """
+    LRU cache of search results with a time-to-live.
+
+    An entry holds either the complete results of a query or a prefix of them (the results
+    a paginated request read, and those read ahead for it), which answers later pages of the same
+    query. Every entry is stored with the corpus version it was computed from; a lookup with
+    a different version (some relevant file changed) invalidates the entry.
+    """
+
+    def __init__(self, max_entries, ttl, max_results):
+        """
+        Args:
+            max_entries (int): The number of result lists kept.
+            ttl (float): Seconds after which an entry expires.
+            max_results (int): Longest result list (or prefix) kept.
+        """
+        self.max_entries = max_entries  # Entry budget
+        self.ttl = ttl                  # Time-to-live in seconds
+        self.max_results = max_results  # Largest cacheable result list
+        self.entries = OrderedDict()    # Key -> (version, expiry time, results, complete), oldest first
+        self.lock = threading.Lock()    # Serializes access to the entries and counters
+        self.hits = 0                   # Lookups answered from the cache
+        self.prefix_hits = 0            # Hits on an entry holding only the first results
+        self.misses = 0                 # Lookups that required a search
+        self.evictions = 0              # Entries evicted to respect max_entries
+        self.expirations = 0            # Entries dropped because their TTL elapsed
+        self.invalidations = 0          # Entries dropped because the corpus changed
+
+    def get(self, key, version, now):
+        """
+        Returns the cached results for a query if they are still valid.
+
+        Args:
+            key (hashable): The normalized query.
+            version (tuple): The current version of the folders the query reads.
+            now (float): The current time (time.monotonic()).
+
+        Returns:
+            tuple: (results, complete), complete being False when results is only a prefix
+                of the results of the query, or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_version, expires, results, complete = entry
+            if cached_version != version:
+                del self.entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            if now >= expires:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)  # Mark as most recently used
+            self.hits += 1
+            if not complete:
+                self.prefix_hits += 1
+            return results, complete
+
+    def put(self, key, version, results, now, complete=True):
+        """
+        Stores the results of a query, or a prefix of them. A valid entry holding more
+        results for the same version is kept instead.
+
+        Args:
+            key (hashable): The normalized query.
+            version (tuple): The version of the folders the results were computed from.
+            results (list): The results, in search order.
+            now (float): The current time (time.monotonic()).
+            complete (bool): Whether results holds every result of the query.
+        """
+        if len(results) > self.max_results or self.max_entries <= 0 or not (results or complete):
+            return
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is not None and entry[0] == version and now < entry[1]
+                    and (entry[3] or (not complete and len(entry[2]) >= len(results)))):
+                return  # Another request of the same query read further
+            self.entries[key] = (version, now + self.ttl, results, complete)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Hit, miss, eviction and size counters.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "prefix_hits": self.prefix_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
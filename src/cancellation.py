@@ -0,0 +1,177 @@
+# cancellation.py
+
+import threading            # Per-thread current request and protection of the token state
+import time                 # For the request deadlines
+
+CHECK_INTERVAL = 1024       # Units (lines, cells, ...) matched between two checks of the token in tight loops
+MAX_EARLY_CANCELS = 1024    # Ids of not yet started requests remembered per connection
+
+class RequestCancelled(BaseException):
+    """
+    Raised inside a search when its request was cancelled or ran out of time.
+
+    It derives from BaseException, like asyncio.CancelledError, so the "except Exception"
+    blocks that skip unreadable files do not swallow it: it unwinds the whole search up to
+    the request handler, which then returns the results found so far.
+    """
+
+    def __init__(self, reason):
+        """
+        Args:
+            reason (str): "deadline", "cancelled" or "disconnected".
+        """
+        super().__init__(reason)
+        self.reason = reason
+
+class CancelToken:
+    """
+    Deadline and cancellation flag of one request, checked by the search loops between
+    files, pages, rows and lines.
+
+    Other threads (the connection reading a CANCEL frame, or noticing that the client went
+    away) call cancel(); the search notices it at its next check.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        Args:
+            timeout (float): Seconds the request may run, or None for no deadline.
+        """
+        self.deadline = None    # time.monotonic() value after which the request is cut, or None
+        self.reason = None      # Why the request was stopped, None while it may run
+        self.lock = threading.Lock()  # Keeps the first reason when several threads stop the request
+        self.set_timeout(timeout)
+
+    def set_timeout(self, timeout):
+        """
+        Starts (or replaces) the deadline, counted from now.
+
+        Args:
+            timeout (float): Seconds the request may run, or None (or 0) for no deadline.
+        """
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def cancel(self, reason="cancelled"):
+        """
+        Asks the search to stop at its next check; the first reason given is kept.
+
+        Args:
+            reason (str): "cancelled" or "disconnected".
+        """
+        with self.lock:
+            if self.reason is None:
+                self.reason = reason
+
+    def stopped(self):
+        """
+        Tells whether the request was cancelled or has passed its deadline.
+        """
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self.reason is not None
+
+    def check(self):
+        """
+        Raises RequestCancelled if the request must stop.
+        """
+        if self.stopped():
+            raise RequestCancelled(self.reason)
+
+class NullToken(CancelToken):
+    """
+    Token used outside of a request (watcher, index refresh at startup, benchmarks): never stops.
+    """
+
+    def __init__(self):
+        super().__init__(None)
+
+    def cancel(self, reason="cancelled"):
+        pass
+
+    def stopped(self):
+        return False
+
+    def check(self):
+        pass
+
+NULL_TOKEN = NullToken()
+_local = threading.local()  # .token: the token of the request handled by the current thread
+
+def current():
+    """
+    Returns the token of the request handled by the calling thread.
+
+    Returns:
+        CancelToken: The request token, or NULL_TOKEN outside of a request.
+    """
+    return getattr(_local, "token", None) or NULL_TOKEN
+
+def activate(token):
+    """
+    Makes a token the current one of the calling thread (None to clear it).
+
+    Args:
+        token (CancelToken): The token of the request about to be handled, or None.
+    """
+    _local.token = token
+
+class RequestTracker:
+    """
+    Tracks the request a connection is running, so that a CANCEL frame or a disconnection
+    seen by the reading side can stop it while another thread searches.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()    # Protects the fields below
+        self.active_id = None           # Id of the running request
+        self.token = None               # Token of the running request, None when idle
+        self.cancelled_ids = set()      # Ids cancelled before their request started
+
+    def start(self, request_id=None):
+        """
+        Creates the token of a request about to run.
+
+        Args:
+            request_id: The id of the request, if it has one.
+
+        Returns:
+            CancelToken: The new token, already cancelled if a CANCEL for this id came first.
+        """
+        token = CancelToken()
+        with self.lock:
+            if request_id is not None and request_id in self.cancelled_ids:
+                self.cancelled_ids.discard(request_id)
+                token.cancel("cancelled")
+            self.active_id = request_id
+            self.token = token
+        return token
+
+    def finish(self):
+        """
+        Forgets the running request.
+        """
+        with self.lock:
+            self.active_id = None
+            self.token = None
+
+    def cancel(self, request_id=None, reason="cancelled"):
+        """
+        Stops the running request if it has the given id (any request when request_id is None);
+        a CANCEL for a request that has not started yet is remembered until it starts.
+
+        Args:
+            request_id: The id of the request to stop, or None for the running one.
+            reason (str): "cancelled" or "disconnected".
+
+        Returns:
+            bool: True if a running request was stopped.
+        """
+        with self.lock:
+            if self.token is not None and (request_id is None or request_id == self.active_id):
+                self.token.cancel(reason)
+                return True
+            if request_id is not None:
+                if len(self.cancelled_ids) >= MAX_EARLY_CANCELS:
+                    self.cancelled_ids.clear()  # Ids of requests that never came: do not keep them forever
+                self.cancelled_ids.add(request_id)
+            return False
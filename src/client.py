@@ -1,14 +1,32 @@
 # client.py
 
 import socket                       # For network communication with the server
+import threading                    # Requests run on a worker thread so the GUI stays responsive
+import queue                        # To hand the worker's results over to the GUI thread
+import time                         # For the reconnection backoff
 import tkinter as tk                # For creating the graphical user interface (GUI)
 from tkinter import messagebox, filedialog  # For displaying dialog boxes and file selection dialogs
 import os                           # For interacting with the operating system (e.g., file paths)
+from protocol import send_message, recv_message, format_result_line, ProtocolError  # Framed wire protocol
+from connection import truncation_message  # Why a response is incomplete, worded as for legacy clients
 
 # Define server configuration constants
 HOST = '127.0.0.1'      # Server's IP address (localhost)
 PORT = 12345            # Server's port number
 ENDING_MSG = "q"        # Message to terminate the client connection (if used)
+RANK_TOP_K = 100        # Results requested by a ranked search
+
+# Connection settings
+CONNECT_TIMEOUT = 5.0       # Seconds to wait for the server to accept a connection
+RECONNECT_ATTEMPTS = 5      # Connection attempts before a request fails
+RECONNECT_DELAY = 0.2       # Seconds before the first retry, doubled after each failure
+RECONNECT_MAX_DELAY = 5.0   # Longest wait between two attempts
+POLL_INTERVAL_MS = 50       # How often the GUI picks up the results received by the worker
+
+# Result view settings
+PAGE_SIZE = 200             # Results requested at a time
+WINDOW_PAGES = 5            # Pages kept in the view; farther ones are dropped and fetched again when needed
+EDGE_FRACTION = 0.1         # Scrolling this close to either end of the loaded results fetches the next page
 
 # Mapping to assist in constructing selected extensions
 available_file_types = {
@@ -26,26 +44,419 @@ data_folders = {
     ".xlsx": "data/excel/"
 }
 
-def send_request_to_server(request):
+def build_search_request(search_target, keyword, extensions, rank=False):
     """
-    Sends a request to the server and receives the response.
+    Builds a framed search request.
     
     Args:
-        request (str): The search request to send to the server.
+        search_target (str): "ALL" or the name of a specific file.
+        keyword (str): The keyword or regex pattern to search for.
+        extensions (list): The file extensions to search.
+        rank (bool): Whether to ask for the RANK_TOP_K most relevant matches instead of every match.
         
     Returns:
-        str: The server's response or an error message.
+        dict: The request message.
+    """
+    request = {"type": "search", "target": search_target, "keyword": keyword, "extensions": extensions, "stream": True}
+    if rank:
+        request["rank"] = True
+        request["k"] = RANK_TOP_K
+    return request
+
+class ServerConnection:
+    """
+    One persistent connection to the server, shared by every request of the client.
+    The connection is opened on first use and re-opened (with exponential backoff) after
+    it was lost or aborted.
+    """
+
+    def __init__(self, host, port):
+        self.host = host                # Server address
+        self.port = port                # Server port
+        self.sock = None                # The open socket, or None
+        self.lock = threading.Lock()    # Protects sock against abort() from the GUI thread
+        self.send_lock = threading.Lock()  # Keeps the frames sent by the two threads whole
+
+    def connect(self):
+        """
+        Opens the connection, retrying up to RECONNECT_ATTEMPTS times with a growing delay.
+        """
+        delay = RECONNECT_DELAY
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+                sock.settimeout(None)  # Long scans may take a while before the first result
+                with self.lock:
+                    self.sock = sock
+                return
+            except OSError:
+                if attempt == RECONNECT_ATTEMPTS:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def send(self, message):
+        """
+        Sends a request, connecting first if needed. A connection that turns out to be
+        dead (for example after a server restart) is re-opened once.
+        """
+        for retry in (False, True):
+            if self.sock is None:
+                self.connect()
+            try:
+                with self.send_lock:
+                    send_message(self.sock, message)
+                return
+            except OSError:
+                self.close()
+                if retry:
+                    raise
+
+    def receive(self):
+        """
+        Receives the next response frame.
+        
+        Returns:
+            dict: The decoded frame.
+        """
+        sock = self.sock
+        if sock is None:
+            raise ProtocolError("Not connected")
+        response = recv_message(sock)
+        if response is None:
+            self.close()
+            raise ProtocolError("Connection closed by the server")
+        return response
+
+    def send_cancel(self, request_id):
+        """
+        Asks the server to stop a request, from any thread. The server answers the request
+        with the results found so far, so the connection stays usable.
+        
+        Returns:
+            bool: False if the connection is not open (or no longer works).
+        """
+        with self.lock:
+            sock = self.sock
+        if sock is None:
+            return False
+        try:
+            with self.send_lock:
+                send_message(sock, {"type": "cancel", "id": request_id})
+            return True
+        except OSError:
+            return False
+
+    def abort(self):
+        """
+        Interrupts a blocked receive() from another thread. The connection is dropped, which
+        also makes the server give up the request it was answering.
+        """
+        with self.lock:
+            if self.sock is not None:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self, polite=False):
+        """
+        Closes the connection.
+        
+        Args:
+            polite (bool): Whether to tell the server first that the client is leaving.
+        """
+        with self.lock:
+            sock, self.sock = self.sock, None
+        if sock is None:
+            return
+        if polite:
+            try:
+                send_message(sock, {"type": "quit"})
+            except OSError:
+                pass
+        sock.close()
+
+class SearchWorker:
+    """
+    Runs the search requests on a background thread over one persistent connection.
+    
+    Only the latest request matters: submitting a search cancels the one in progress and
+    replaces any search still waiting. Results are posted to the events queue as
+    ("batch", id, results), ("done", id, response), ("cancelled", id) or ("error", id, message)
+    tuples, which the GUI thread reads.
+    """
+
+    def __init__(self, host, port):
+        self.connection = ServerConnection(host, port)
+        self.events = queue.Queue()             # Events for the GUI thread
+        self.condition = threading.Condition()  # Protects the fields below and wakes the thread
+        self.pending = None                     # Request waiting to be sent, or None
+        self.current = None                     # Id of the request in progress, or None
+        self.cancelled = False                  # Whether the request in progress was cancelled
+        self.next_id = 1                        # Id of the next request
+        self.stopping = False                   # Set by stop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        """
+        Queues a request, superseding the request in progress (if any).
+        
+        Returns:
+            int: The id of the request, found in its events.
+        """
+        with self.condition:
+            request = dict(request, id=self.next_id)
+            self.next_id += 1
+            self.pending = request
+            self._cancel_current()
+            self.condition.notify()
+            return request["id"]
+
+    def cancel(self):
+        """
+        Cancels the request in progress and the waiting one.
+        """
+        with self.condition:
+            self.pending = None
+            self._cancel_current()
+
+    def stop(self):
+        """
+        Cancels everything and closes the connection.
+        """
+        with self.condition:
+            self.stopping = True
+            self.pending = None
+            self._cancel_current()
+            self.condition.notify()
+        self.thread.join(1.0)
+        self.connection.close(polite=True)
+
+    def _cancel_current(self):
+        """
+        Interrupts the request in progress (called with the condition held): the server is
+        asked to stop it, and the connection is dropped only if that message cannot be sent.
+        """
+        if self.current is not None and not self.cancelled:
+            self.cancelled = True
+            if not self.connection.send_cancel(self.current):
+                self.connection.abort()
+
+    def run(self):
+        """
+        Body of the worker thread: sends the requests one at a time and forwards their results.
+        """
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                request, self.pending = self.pending, None
+                self.current = request["id"]
+                self.cancelled = False
+            try:
+                self.connection.send(request)
+                if self.cancelled:
+                    self.connection.send_cancel(request["id"])  # Cancelled while the connection was being opened
+                can_resend = True  # Until a frame is received, the request can be sent again
+                while True:
+                    try:
+                        response = self.connection.receive()
+                    except (OSError, ProtocolError):
+                        if not can_resend or self.cancelled:
+                            raise
+                        # The connection died before the request was read (e.g. the server
+                        # restarted since the last request): searches are safe to send again
+                        can_resend = False
+                        self.connection.close()
+                        self.connection.send(request)
+                        continue
+                    can_resend = False
+                    if response.get("id") != request["id"]:
+                        continue  # Left over from an earlier request
+                    if self.cancelled:
+                        # The server stops the request and still ends its answer: wait for that end
+                        if response.get("type") in ("end", "results") or response.get("status") == "error":
+                            self.events.put(("cancelled", request["id"]))
+                            break
+                        continue
+                    if response.get("status") == "error":
+                        # The server rejected the request; the connection remains usable
+                        self.events.put(("error", request["id"], f"Server error: {response.get('error')}"))
+                        break
+                    if response.get("results"):
+                        self.events.put(("batch", request["id"], response["results"]))
+                    if response.get("type") in ("end", "results"):
+                        self.events.put(("done", request["id"], response))
+                        break
+            except (OSError, ProtocolError) as e:
+                with self.condition:
+                    cancelled = self.cancelled
+                if cancelled:
+                    self.events.put(("cancelled", request["id"]))
+                else:
+                    self.events.put(("error", request["id"], f"Error communicating with the server: {e}"))
+                self.connection.close()  # The stream may be cut in the middle of a frame
+            finally:
+                with self.condition:
+                    self.current = None
+
+class ResultView:
+    """
+    Scrollable view of the results of the current search, loading them one page at a time.
+    
+    At most WINDOW_PAGES * PAGE_SIZE results are kept in the text widget, whatever the
+    number of matches: the first page is shown as it streams in, scrolling near the end of
+    the loaded results requests the next page (offset/limit), and the pages left far behind
+    are dropped, then fetched again if the user scrolls back to them.
+    
+    Every page repeats the same request with another offset/limit, so the server answers
+    it from the results it cached for the previous pages (the first RESULT_CACHE_MAX_RESULTS
+    ones) instead of running the search again from the start.
     """
-    try:
-        # Create a TCP/IP socket
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
-            client.connect((HOST, PORT))               # Connect to the server
-            client.send(request.encode('utf-8'))       # Send the request encoded in UTF-8
-            response = client.recv(4096).decode('utf-8')  # Receive the response (max 4096 bytes)
-        return response  # Return the decoded response
-    except Exception as e:
-        # Return an error message if communication fails
-        return f"Error communicating with the server: {e}"
+
+    def __init__(self, text, scrollbar, submit, on_status):
+        """
+        Args:
+            text (tk.Text): The widget displaying the results, one per line.
+            scrollbar (tk.Scrollbar): Its vertical scrollbar.
+            submit (callable): submit(request) sends a request and returns its id (SearchWorker.submit).
+            on_status (callable): on_status(str) displays the state of the view.
+        """
+        self.text = text
+        self.scrollbar = scrollbar
+        self.submit = submit
+        self.on_status = on_status
+        self.request = None         # The search request displayed, without offset/limit
+        self.first = 0              # Offset of the first loaded result
+        self.count = 0              # Results loaded in the widget
+        self.more = False           # Whether results exist after the loaded ones
+        self.loading = None         # (request id, offset, "append" or "prepend") of the page being fetched
+        self.pending_lines = []     # Lines of a page fetched for the top, inserted once it is complete
+        text.configure(yscrollcommand=self._on_view)
+        scrollbar.configure(command=text.yview)
+
+    def start(self, request):
+        """
+        Displays the results of a new search, replacing the current ones.
+        
+        Args:
+            request (dict): The search request.
+        """
+        self.request = request
+        self.text.delete("1.0", tk.END)
+        self.first = self.count = 0
+        self.more = False
+        self._fetch(0, PAGE_SIZE, "append")
+
+    def handle(self, event):
+        """
+        Applies an event of the worker thread (see SearchWorker) to the view.
+        """
+        kind, request_id = event[0], event[1]
+        if self.loading is None or request_id != self.loading[0]:
+            return  # Results of a superseded search
+        offset, where = self.loading[1], self.loading[2]
+        if kind == "batch":
+            lines = [format_result_line(result) for result in event[2]]
+            if where == "append":
+                # Shown right away, so the first results appear while the server is still searching
+                self.text.insert(tk.END, "".join(line + "\n" for line in lines))
+                self.count += len(lines)
+                self._trim_top()
+            else:
+                self.pending_lines.extend(lines)
+            self._status("Searching...")
+            return
+        self.loading = None
+        if kind == "done":
+            if where == "append":
+                self.more = bool(event[2].get("more"))
+            else:
+                self._insert_top(offset)
+            # A search stopped early (time limit, cancel, or search servers of a coordinator
+            # that did not answer) returns what it found until then
+            self._status(truncation_message(event[2].get("reason")) if event[2].get("truncated") else None)
+            self._on_view(*self.text.yview())  # The user may already be waiting at an end of the view
+        elif kind == "cancelled":
+            self._status("Cancelled.")
+        else:
+            self._status(event[2])
+
+    def _fetch(self, offset, limit, where):
+        """
+        Requests limit results from offset, to be added at the end or at the top of the view.
+        Only offset/limit may differ from the search request, which keeps the pages of a
+        search on the same entry of the server's result cache.
+        """
+        request_id = self.submit(dict(self.request, offset=offset, limit=limit))
+        self.loading = (request_id, offset, where)
+        self.pending_lines = []
+        self._status("Searching...")
+
+    def _top_line(self):
+        """
+        Returns the number of the first visible line.
+        """
+        return int(self.text.index("@0,0").split(".")[0])
+
+    def _trim_top(self):
+        """
+        Drops the oldest results once the view holds more than WINDOW_PAGES pages,
+        keeping the visible lines in place.
+        """
+        excess = self.count - WINDOW_PAGES * PAGE_SIZE
+        if excess <= 0:
+            return
+        top_line = self._top_line()
+        self.text.delete("1.0", f"{excess + 1}.0")
+        self.text.yview(f"{max(1, top_line - excess)}.0")
+        self.first += excess
+        self.count -= excess
+
+    def _insert_top(self, offset):
+        """
+        Inserts the page fetched for the top of the view, then drops the results at the end
+        beyond WINDOW_PAGES pages (they are fetched again when the user scrolls down).
+        """
+        top_line = self._top_line()
+        self.text.insert("1.0", "".join(line + "\n" for line in self.pending_lines))
+        self.text.yview(f"{top_line + len(self.pending_lines)}.0")  # Keep the same lines visible
+        self.first = offset
+        self.count += len(self.pending_lines)
+        self.pending_lines = []
+        limit = WINDOW_PAGES * PAGE_SIZE
+        if self.count > limit:
+            self.text.delete(f"{limit + 1}.0", tk.END)
+            self.count = limit
+            self.more = True
+
+    def _on_view(self, top, bottom):
+        """
+        Called by the text widget whenever the visible part changes: updates the scrollbar
+        and fetches a page when the view gets close to either end of the loaded results.
+        """
+        self.scrollbar.set(top, bottom)
+        if self.loading is not None or self.request is None:
+            return
+        if float(bottom) >= 1 - EDGE_FRACTION and self.more:
+            self._fetch(self.first + self.count, PAGE_SIZE, "append")
+        elif float(top) <= EDGE_FRACTION and self.first > 0:
+            offset = max(0, self.first - PAGE_SIZE)
+            self._fetch(offset, self.first - offset, "prepend")
+
+    def _status(self, activity=None):
+        """
+        Displays which results are loaded, prefixed by the current activity.
+        """
+        if self.count:
+            shown = f"Results {self.first + 1}-{self.first + self.count}" + (" (more below)" if self.more else "")
+        else:
+            shown = "No results loaded"
+        self.on_status(f"{activity} {shown}" if activity else shown)
 
 def get_selected_extensions():
     """
@@ -78,7 +489,6 @@ def perform_search():
         return  # Exit the function if validation fails
 
     selected_extensions = get_selected_extensions()  # Get the list of selected file extensions
-    extension_str = ",".join(selected_extensions)    # Convert the list to a comma-separated string
 
     if search_mode == "Specific File":
         # If the user selected to search within a specific file
@@ -98,7 +508,7 @@ def perform_search():
             if not file_name:
                 return  # If no file is selected, exit the function
             file_name_only = os.path.basename(file_name)  # Extract the file name without the path
-            request = f"{file_name_only}|{keyword}|{ext}"  # Format the search request
+            request = build_search_request(file_name_only, keyword, [ext], var_rank.get())  # Format the search request
         else:
             # If no file type is selected, allow the user to choose any file
             file_name = filedialog.askopenfilename(
@@ -110,28 +520,43 @@ def perform_search():
                 return  # If no file is selected, exit the function
             chosen_ext = os.path.splitext(file_name)[1]  # Extract the file extension
             file_name_only = os.path.basename(file_name)  # Extract the file name without the path
-            request = f"{file_name_only}|{keyword}|{chosen_ext}"  # Format the search request
+            request = build_search_request(file_name_only, keyword, [chosen_ext], var_rank.get())  # Format the search request
     else:
         # If the user selected to search across all files
-        request = f"ALL|{keyword}|{extension_str}"  # Format the search request
+        request = build_search_request("ALL", keyword, selected_extensions, var_rank.get())  # Format the search request
 
-    if not request.strip():
-        return  # If the request is empty, do nothing
+    # Show the new search; its first page supersedes any request still in progress
+    result_view.start(request)
 
-    # Send the search request to the server and get the results
-    results = send_request_to_server(request)
-    # Clear any existing text in the results display area
-    results_text.delete(1.0, tk.END)
-    # Insert the new search results into the text area
-    results_text.insert(tk.END, results)
+def cancel_search():
+    """
+    Cancels the search in progress.
+    """
+    worker.cancel()
+
+def poll_worker():
+    """
+    Displays the results received by the worker thread, then schedules the next check.
+    Runs on the GUI thread (Tkinter widgets must not be touched from other threads).
+    """
+    try:
+        while True:
+            result_view.handle(worker.events.get_nowait())
+    except queue.Empty:
+        pass
+    root.after(POLL_INTERVAL_MS, poll_worker)
 
 def quit_application():
     """
     Exits the application after confirming with the user.
     """
     if messagebox.askokcancel("Quit", "Do you really want to quit?"):
+        worker.stop()   # Cancel the search in progress and close the connection
         root.destroy()  # Close the main window, effectively exiting the application
 
+# Worker thread sending the requests over one persistent connection
+worker = SearchWorker(HOST, PORT)
+
 # Create the main application window
 root = tk.Tk()
 root.title("Client Search Application")  # Set the window title
@@ -191,26 +616,49 @@ keyword_label.pack(side=tk.LEFT, padx=5)  # Position to the left with horizontal
 # Entry widget for the user to input keywords
 keyword_entry = tk.Entry(keyword_frame, width=50)
 keyword_entry.pack(side=tk.LEFT, padx=5)  # Position to the left with horizontal padding
+keyword_entry.bind("<Return>", lambda event: perform_search())  # Enter starts (or supersedes) a search
 
 # Frame for the search button
 search_button_frame = tk.Frame(root)
 search_button_frame.pack(pady=10)  # Add vertical padding
 
+# Checkbox asking for the most relevant matches first instead of every match in file order
+var_rank = tk.BooleanVar()
+chk_rank = tk.Checkbutton(search_button_frame, text=f"Rank by relevance (top {RANK_TOP_K})", variable=var_rank)
+chk_rank.pack(side=tk.LEFT, padx=10)
+
 # Search button that triggers the search operation
 search_button = tk.Button(search_button_frame, text="Search", command=perform_search)
 search_button.pack(side=tk.LEFT, padx=10)  # Position to the left with horizontal padding
 
+# Cancel button that stops the search in progress
+cancel_button = tk.Button(search_button_frame, text="Cancel", command=cancel_search)
+cancel_button.pack(side=tk.LEFT, padx=10)
+
 # Label for the results display area
 results_label = tk.Label(root, text="Results:")
 results_label.pack(pady=5)  # Add vertical padding
 
-# Text widget to display search results
-results_text = tk.Text(root, height=30, width=90)
-results_text.pack(pady=10)  # Add vertical padding
+# Status of the current search (progress, result count, errors)
+status_var = tk.StringVar(value="Ready")
+status_label = tk.Label(root, textvariable=status_var)
+status_label.pack()
+
+# Text widget to display search results, with its scrollbar
+results_frame = tk.Frame(root)
+results_frame.pack(pady=10)  # Add vertical padding
+results_text = tk.Text(results_frame, height=30, width=90, wrap=tk.NONE)  # One result per line
+results_scrollbar = tk.Scrollbar(results_frame, orient=tk.VERTICAL)
+results_text.pack(side=tk.LEFT)
+results_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+# View loading the results page by page into the text widget
+result_view = ResultView(results_text, results_scrollbar, worker.submit, status_var.set)
 
 # Quit button to exit the application
 quit_button = tk.Button(root, text="Quit", command=quit_application, bg="red", fg="white")
 quit_button.pack(pady=20)  # Add vertical padding
 
-# Start the Tkinter event loop to make the GUI responsive
+# Start picking up the worker's results, then the Tkinter event loop to make the GUI responsive
+root.after(POLL_INTERVAL_MS, poll_worker)
 root.mainloop()
@@ -0,0 +1,191 @@
+# connection.py
+
+import asyncio              # For the connection loop of the asyncio servers
+import logging              # For logging connection activities and errors
+from protocol import AsyncRequestReader, ProtocolError  # Framed wire protocol shared with the client
+
+# Special legacy messages, understood by server.py and coordinator.py alike
+ENDING_MSG = "q"        # Special message indicating client wants to terminate the connection
+STATS_MSG = "STATS"     # Special message asking for the statistics
+CANCEL_MSG = "CANCEL"   # Special message stopping the request in progress on the connection
+
+# Answers to malformed legacy requests
+LEGACY_FORMAT_ERROR = "Invalid format. Use: <search_target>|<keyword>|<file_extension>"
+LEGACY_ENCODING_ERROR = "Invalid request: the text must be encoded in UTF-8."
+
+# Last line of a legacy response cut short, per reason
+TRUNCATION_MESSAGES = {
+    "deadline": "Search stopped: time limit reached, results are incomplete.",
+    "cancelled": "Search cancelled: results are incomplete.",
+    "shards": "Some search servers did not answer: results are incomplete."
+}
+
+def truncation_message(reason):
+    """
+    Returns the last line of a legacy response cut short for a reason.
+    """
+    return TRUNCATION_MESSAGES.get(reason, "Search stopped: results are incomplete.")
+
+def get_page_bounds(message):
+    """
+    Reads and validates the offset/limit of a framed search request.
+
+    Args:
+        message (dict): The decoded request.
+
+    Returns:
+        tuple: (offset, limit), where limit is None when the request is not paginated.
+    """
+    offset = message.get("offset")
+    if offset is None:
+        offset = 0
+    limit = message.get("limit")
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise ValueError("offset must be a non-negative integer")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+        raise ValueError("limit must be a non-negative integer")
+    return offset, limit
+
+def get_target(message):
+    """
+    Reads the target and file types of a framed search or batch request.
+
+    Returns:
+        tuple: (target, extensions), extensions being a list of stripped extensions.
+    """
+    target = str(message.get("target", "ALL")).strip() or "ALL"
+    extensions = message.get("extensions") or []
+    if isinstance(extensions, str):
+        extensions = extensions.split(",")  # Also accept the legacy comma-separated form
+    return target, [str(ext).strip() for ext in extensions if str(ext).strip()]
+
+def parse_legacy(client_msg):
+    """
+    Parses an unframed "<search_target>|<keyword>|<file_extension>" request.
+
+    Args:
+        client_msg (str): The request text.
+
+    Returns:
+        tuple: (search_target, keyword, file_extension), stripped.
+    """
+    parts = client_msg.split("|")
+    if len(parts) != 3:
+        raise ValueError(LEGACY_FORMAT_ERROR)
+    return tuple(part.strip() for part in parts)
+
+def parse_cancel(request):
+    """
+    Recognizes a CANCEL: {"type": "cancel", "id": ...} or the legacy text "CANCEL".
+
+    Args:
+        request (tuple): (framed, message) as returned by AsyncRequestReader.read_request.
+
+    Returns:
+        tuple: (True, id) for a CANCEL (id None for the running request), (False, None) otherwise.
+    """
+    framed, message = request
+    if framed:
+        if message.get("type") == "cancel":
+            return True, message.get("id")
+        return False, None
+    return message is not None and message.strip() == CANCEL_MSG, None
+
+async def serve_connection(reader, writer, answer, cancel):
+    """
+    Reads and answers the requests of a client connection, one at a time. While a request
+    is answered the connection keeps being read: a CANCEL is applied at once, the client
+    closing the connection cancels the answer (nobody would read it), and other requests
+    received meanwhile are answered afterwards.
+
+    Args:
+        reader (asyncio.StreamReader): The client stream.
+        writer (asyncio.StreamWriter): The client stream writer.
+        answer (callable): answer(framed, message) -> coroutine answering one request
+            (framed or legacy) and writing the response; it returns False to close the connection.
+        cancel (callable): cancel(request_id) applies a CANCEL (request_id None for the
+            running request), whether a request is running or not.
+    """
+    requests = AsyncRequestReader(reader)
+    queued = []         # Requests received while another one was answered
+    reading = None      # Pending read of the next request, kept across requests
+    closed = False      # Whether the client closed the connection
+
+    async def run(work):
+        """
+        Runs the answer to a request, reading the connection meanwhile.
+
+        Returns:
+            bool: The result of the answer, or False if the client went away.
+        """
+        nonlocal reading, closed
+        work = asyncio.ensure_future(work)
+        while not work.done():
+            if reading is None:
+                reading = asyncio.ensure_future(requests.read_request())
+            await asyncio.wait([work, reading], return_when=asyncio.FIRST_COMPLETED)
+            if not reading.done():
+                continue
+            try:
+                request = reading.result()
+            except (ProtocolError, ConnectionError, asyncio.IncompleteReadError) as e:
+                logging.debug(f"Client connection lost during a request: {e}")
+                request = None
+            reading = None
+            if request is None:
+                closed = True
+                work.cancel()  # Nobody will read the answer
+                await asyncio.wait([work])
+                return False
+            is_cancel, cancel_id = parse_cancel(request)
+            if is_cancel:
+                cancel(cancel_id)
+            else:
+                queued.append(request)
+        return work.result()
+
+    try:
+        while not closed:
+            # Take the next request, framed or in the legacy text form
+            if queued:
+                request = queued.pop(0)
+            else:
+                if reading is None:
+                    reading = asyncio.ensure_future(requests.read_request())
+                try:
+                    request = await reading
+                finally:
+                    reading = None
+            if request is None:
+                logging.debug("Client closed the connection.")
+                break
+            is_cancel, cancel_id = parse_cancel(request)
+            if is_cancel:
+                cancel(cancel_id)  # Nothing is running
+                continue
+            framed, client_msg = request
+            logging.debug(f"Received message: {client_msg}")
+            if not framed and client_msg == ENDING_MSG:
+                logging.debug("Termination message received. Closing connection.")
+                break
+            if not await run(answer(framed, client_msg)):
+                if not closed:
+                    logging.debug("Termination message received. Closing connection.")
+                break
+    except ProtocolError as e:
+        # Malformed frames cannot be resynchronized, so the connection is closed
+        logging.error(f"Protocol error from client: {e}")
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        logging.debug(f"Client connection lost: {e}")
+    except Exception as e:
+        # Log any unexpected errors while handling the client
+        logging.error(f"Error handling client: {e}")
+    finally:
+        if reading is not None:
+            reading.cancel()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass  # The peer may already be gone
+        logging.debug("Client connection closed.")
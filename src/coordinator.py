@@ -0,0 +1,628 @@
+# coordinator.py
+
+import asyncio              # Shards are queried concurrently from one event loop
+import argparse             # For command-line options
+import signal               # To stop the coordinator on SIGINT/SIGTERM
+import logging              # For logging coordinator activities and errors
+import itertools            # For the ids of the requests sent to the shards
+import json                 # To serialize the statistics returned by the STATS command
+import os                   # To find the file type of a result
+from protocol import (encode_frame, recv_message_async, format_result_line,  # Framed wire protocol shared with the
+                      ProtocolError)                                         # client and the shard servers
+from connection import (STATS_MSG, LEGACY_ENCODING_ERROR, truncation_message, get_page_bounds,  # Request parsing and connection
+                        get_target, parse_legacy, serve_connection)                             # loop shared with server.py
+from sharding import shard_of, SHARD_MODES  # Same split of the files as the shard servers
+
+# Configure logging to output debug information to 'coordinator.log'
+logging.basicConfig(
+    filename='coordinator.log',         # Log file name
+    level=logging.DEBUG,                # Logging level set to DEBUG for detailed output
+    format='%(asctime)s - %(levelname)s - %(message)s'  # Log message format
+)
+
+# Define coordinator constants (clients connect to it exactly as they would to server.py)
+HOST = '127.0.0.1'      # Coordinator's IP address (localhost)
+PORT = 12345            # Port number where the coordinator listens for connections
+
+# Connection handling settings
+ACCEPT_BACKLOG = 128        # Pending connections queued by the operating system
+MAX_CONNECTIONS = 1000      # Connections served at once; extra ones are refused
+SHUTDOWN_GRACE = 5.0        # Seconds given to in-flight requests when the coordinator stops
+
+# Shard settings
+SHARDS = ["127.0.0.1:12346", "127.0.0.1:12347"]  # Shard servers, in the order of their --shard index
+SHARD_BY = "hash"           # Must match the --shard-by of the shard servers
+SHARD_TIMEOUT = 35.0        # Seconds to wait for a shard when the request sets no "timeout" (above the servers' REQUEST_TIMEOUT)
+SHARD_GRACE = 2.0           # Seconds a shard gets beyond the request "timeout" to send the results it found
+CONNECT_TIMEOUT = 2.0       # Seconds to open a connection to a shard
+MAX_IDLE_CONNECTIONS = 8    # Open connections kept per shard for the next requests
+
+# File types in the order of FOLDERS in server.py: results are grouped by type in this order
+EXTENSIONS = (".txt", ".pdf", ".html", ".xlsx")
+RANK_TOP_K = 100            # Results of a ranked search without "k" (same default as server.py)
+STREAM_BATCH_SIZE = 200     # Results per streamed batch frame
+
+def result_extension(result):
+    """
+    Returns the file type of a structured match, or None for a message.
+    """
+    if "file" not in result:
+        return None
+    return os.path.splitext(result["file"])[1]
+
+def split_by_type(results, extensions):
+    """
+    Cuts the results of one shard into one group per searched file type. A server answers
+    every type with its matches, in scan order, or with a single message when it has none
+    (or does not support the type).
+
+    Args:
+        results (list): The structured results of the shard.
+        extensions (sequence): The searched file types, in search order.
+
+    Returns:
+        tuple: (groups, rest): one (matches, message) pair per type, message being None
+            when there are matches, then the results that fit no group.
+    """
+    groups = []
+    position = 0
+    for ext in extensions:
+        hits = []
+        while position < len(results) and result_extension(results[position]) == ext:
+            hits.append(results[position])
+            position += 1
+        message = None
+        if not hits and position < len(results) and "message" in results[position]:
+            message = results[position]
+            position += 1
+        groups.append((hits, message))
+    return groups, results[position:]
+
+def renumber(results):
+    """
+    Numbers the matches of every file from 1, in merged order.
+
+    Args:
+        results (list): Structured results.
+
+    Returns:
+        list: Copies of the matches with their new number, and the messages.
+    """
+    counts = {}
+    numbered = []
+    for result in results:
+        if "file" in result:
+            counts[result["file"]] = counts.get(result["file"], 0) + 1
+            result = dict(result, number=counts[result["file"]])
+        numbered.append(result)
+    return numbered
+
+def merge_results(result_lists, extensions):
+    """
+    Merges the results of several shards as one server would have returned them: the
+    matches of each file type (shards in index order, each in its scan order), or the
+    "No matches" message of a type when no shard found anything.
+
+    A shard that stopped at its limit returns a prefix of its results; the merged list is
+    still exact for as many results as each shard was asked for, which covers the page.
+
+    Args:
+        result_lists (list): The structured results of each shard, in shard order.
+        extensions (sequence): The searched file types, in search order.
+
+    Returns:
+        list: The merged and renumbered results.
+    """
+    if len(result_lists) == 1:
+        return renumber(result_lists[0])
+    split = [split_by_type(results, extensions) for results in result_lists]
+    merged = []
+    for position in range(len(extensions)):
+        hits = [hit for groups, rest in split for hit in groups[position][0]]
+        if hits:
+            merged.extend(hits)
+            continue
+        message = next((groups[position][1] for groups, rest in split if groups[position][1]), None)
+        if message is not None:
+            merged.append(message)
+    for groups, rest in split:
+        merged.extend(rest)
+    return renumber(merged)
+
+def merge_ranked(result_lists, k):
+    """
+    Merges the results of a ranked search: the k best matches of all the shards, best
+    first, then the messages.
+
+    Every shard scores its matches with the statistics of its own share of the files, which
+    is close to the global statistics when the files are spread by hash.
+
+    Args:
+        result_lists (list): The structured results of each shard (its best matches, then its
+            messages), in shard order.
+        k (int): The number of matches kept.
+
+    Returns:
+        list: The merged results.
+    """
+    hits = []
+    for shard, results in enumerate(result_lists):
+        for position, result in enumerate(results):
+            if "score" in result:
+                hits.append((-result["score"], shard, position, result))
+    hits.sort(key=lambda entry: entry[:3])  # Equal scores keep the shard and scan order
+    merged = [result for _, _, _, result in hits[:k]]
+    messages = [result for result in result_lists[0] if "message" in result]  # Every shard reports the same
+    if merged:
+        # Matches were found after all: drop the notices of the file types without matches
+        messages = [result for result in messages if not result["message"].startswith("No matches found")]
+    return merged + messages
+
+class Shard:
+    """
+    One backend search server, with a pool of open connections reused by the next requests.
+    """
+
+    def __init__(self, index, address):
+        """
+        Args:
+            index (int): The --shard index of the server.
+            address (str): "host:port" of the server.
+        """
+        host, _, port = address.rpartition(":")
+        self.index = index          # Files of this shard are those shard_of() assigns to index
+        self.address = address      # As given on the command line, for the reports
+        self.host = host or HOST
+        self.port = int(port)
+        self.idle = []              # Connections waiting for the next request: (reader, writer)
+        self.requests = 0           # Requests sent
+        self.failures = 0           # Requests without an answer (refused, lost or too slow)
+
+    async def request(self, message, calls=None):
+        """
+        Sends one request and waits for its answer, a single frame (the coordinator never
+        asks the shards to stream).
+
+        Args:
+            message (dict): The request, with an "id" unique on this coordinator.
+            calls (list): Receives (writer, id) while the request runs, so that a CANCEL can be
+                forwarded on the same connection; None when it cannot be cancelled.
+
+        Returns:
+            dict: The answer of the shard.
+        """
+        self.requests += 1
+        for attempt in range(2):
+            reused = bool(self.idle)
+            if reused:
+                reader, writer = self.idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                        CONNECT_TIMEOUT)
+            call = (writer, message.get("id"))
+            if calls is not None:
+                calls.append(call)
+            try:
+                writer.write(encode_frame(message))
+                await writer.drain()
+                answer = await recv_message_async(reader)
+                if answer is None:
+                    raise ConnectionResetError("Connection closed by the shard")
+            except (OSError, ProtocolError):
+                writer.close()
+                if reused and attempt == 0:
+                    continue  # The shard may have dropped an idle connection (e.g. it restarted): retry once
+                raise
+            except BaseException:
+                # Timed out or cancelled: closing the connection stops the search on the shard
+                writer.close()
+                raise
+            finally:
+                if calls is not None:
+                    calls.remove(call)
+            if len(self.idle) < MAX_IDLE_CONNECTIONS:
+                self.idle.append((reader, writer))
+            else:
+                writer.close()
+            return answer
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+class Coordinator:
+    """
+    Answers the clients on behalf of several shard servers, each searching a share of the
+    files (server.py --shard index/count): every request is sent to the shards at once and
+    their answers are merged into the answer a single server would have given.
+
+    A shard that is down or does not answer in time is left out: the response then holds
+    the results of the others, marked "truncated" with the reason "shards" and the list of
+    "failed_shards".
+    """
+
+    def __init__(self, addresses, by=SHARD_BY, timeout=SHARD_TIMEOUT):
+        """
+        Args:
+            addresses (list): "host:port" of every shard server, in shard index order.
+            by (str): How the shards split the files ("hash" or "format").
+            timeout (float): Seconds to wait for a shard when the request sets no "timeout".
+        """
+        self.shards = [Shard(index, address) for index, address in enumerate(addresses)]
+        self.by = by
+        self.timeout = timeout
+        self.ids = itertools.count(1)  # Ids of the requests sent to the shards
+
+    def route(self, target, extensions):
+        """
+        Chooses the shards a search must be sent to.
+
+        Args:
+            target (str): "ALL" or the name of a specific file.
+            extensions (list): The requested file types.
+
+        Returns:
+            list: Every shard for ALL searches, the owner of the file otherwise.
+        """
+        if target.upper() == "ALL":
+            return self.shards
+        if len(extensions) == 1 and extensions[0] in EXTENSIONS:
+            return [self.shards[shard_of(target, extensions[0], len(self.shards), self.by, EXTENSIONS)]]
+        return self.shards[:1]  # Invalid request: any shard answers with the error message
+
+    async def ask(self, shard, message, wait, calls=None):
+        """
+        Sends a request to one shard.
+
+        Returns:
+            tuple: (answer, None), or (None, error) if the shard did not answer within wait seconds.
+        """
+        try:
+            return await asyncio.wait_for(shard.request(message, calls), wait), None
+        except asyncio.TimeoutError:
+            error = f"No answer within {wait:g}s"
+        except (OSError, ProtocolError) as e:
+            error = str(e) or type(e).__name__
+        shard.failures += 1
+        logging.warning(f"Shard {shard.address} failed: {error}")
+        return None, error
+
+    async def fan_out(self, message, shards, calls=None):
+        """
+        Sends a request to several shards at once and waits for all of them; a shard gets the
+        request "timeout" plus SHARD_GRACE seconds to answer (SHARD_TIMEOUT without one).
+
+        Args:
+            message (dict): The request.
+            shards (list): The shards to ask.
+            calls (list): Receives the requests in progress, for cancel().
+
+        Returns:
+            tuple: (answers, failed, errors): the answers in shard order, the shards that did
+                not answer as {"shard", "error"} dicts, and the errors returned by shards.
+        """
+        timeout = message.get("timeout")
+        if isinstance(timeout, (int, float)) and not isinstance(timeout, bool) and timeout > 0:
+            wait = timeout + SHARD_GRACE
+        else:
+            wait = self.timeout
+        replies = await asyncio.gather(*(self.ask(shard, dict(message, id=next(self.ids)), wait, calls)
+                                         for shard in shards))
+        answers, failed, errors = [], [], []
+        for shard, (answer, error) in zip(shards, replies):
+            if answer is None:
+                failed.append({"shard": shard.address, "error": error})
+            elif answer.get("type") == "error":
+                errors.append(answer.get("error", "Unknown error"))
+            else:
+                answers.append(answer)
+        return answers, failed, errors
+
+    def cancel(self, calls):
+        """
+        Forwards a CANCEL to the shards still searching for a request; they answer with the
+        results found so far, which are merged as usual.
+        """
+        for writer, request_id in list(calls):
+            try:
+                writer.write(encode_frame({"type": "cancel", "id": request_id}))
+            except Exception:
+                pass  # The connection is already gone
+
+    @staticmethod
+    def error_frame(response, errors, failed):
+        """
+        Builds the answer to a request no shard could answer.
+        """
+        if errors:
+            return dict(response, type="error", status="error", error=errors[0])
+        return dict(response, type="error", status="error", error="No search server answered", failed_shards=failed)
+
+    @staticmethod
+    def mark_partial(response, answers, failed):
+        """
+        Adds the "truncated" marker to the last frame of a response if a shard did not answer
+        or stopped early itself (deadline, cancel).
+        """
+        if failed:
+            return dict(response, truncated=True, reason="shards", failed_shards=failed)
+        for answer in answers:
+            if answer.get("truncated"):
+                return dict(response, truncated=True, reason=answer.get("reason"))
+        return response
+
+    async def search(self, message, response, calls):
+        """
+        Answers a search request: each shard returns the first offset + limit results of its
+        share, and the merged list is cut to the requested page.
+
+        Returns:
+            list: The response frames.
+        """
+        try:
+            offset, limit = get_page_bounds(message)
+        except ValueError as e:
+            return [dict(response, type="error", status="error", error=str(e))]
+        target, extensions = get_target(message)
+        end = None if limit is None else offset + limit
+        forwarded = dict(message, stream=False, offset=0, limit=end)
+        answers, failed, errors = await self.fan_out(forwarded, self.route(target, extensions), calls)
+        if errors or not answers:
+            return [self.error_frame(response, errors, failed)]
+
+        result_lists = [answer.get("results", []) for answer in answers]
+        if message.get("rank"):
+            merged = merge_ranked(result_lists, message.get("k", RANK_TOP_K))
+        else:
+            merged = merge_results(result_lists, extensions or EXTENSIONS)
+        page = merged[offset:end]
+        more = limit is not None and (len(merged) > end or any(answer.get("more") for answer in answers))
+        if failed:
+            logging.info(f"Search for {message.get('keyword')!r} answered without {len(failed)} shard(s)")
+        final = self.mark_partial(response, answers, failed)
+        if message.get("stream"):
+            frames = [dict(response, type="batch", results=page[start:start + STREAM_BATCH_SIZE])
+                      for start in range(0, len(page), STREAM_BATCH_SIZE)]
+            return frames + [dict(final, type="end", status="ok", count=len(page), offset=offset, more=more)]
+        return [dict(final, type="results", status="ok", count=len(page), offset=offset, more=more, results=page)]
+
+    async def batch(self, message, response, calls):
+        """
+        Answers a batch request: every shard evaluates all the queries over its share, and
+        the results of each query are merged and cut to its limit.
+
+        Returns:
+            list: The response frames.
+        """
+        try:
+            default_limit = get_page_bounds(message)[1]
+        except ValueError as e:
+            return [dict(response, type="error", status="error", error=str(e))]
+        target, extensions = get_target(message)
+        answers, failed, errors = await self.fan_out(message, self.route(target, extensions), calls)
+        if errors or not answers:
+            return [self.error_frame(response, errors, failed)]
+
+        queries = []
+        for number, query in enumerate(message["queries"]):
+            limit = query.get("limit") if isinstance(query, dict) else None
+            limit = default_limit if limit is None else limit
+            parts = [answer["queries"][number] for answer in answers]
+            results = merge_results([part["results"] for part in parts], extensions or EXTENSIONS)
+            if limit is not None:
+                results = results[:limit]
+            total = sum(part["total"] for part in parts)
+            hits = sum(1 for result in results if "message" not in result)
+            queries.append({"keyword": parts[0]["keyword"], "count": len(results), "total": total,
+                            "more": limit is not None and total > hits, "results": results})
+        final = self.mark_partial(response, answers, failed)
+        return [dict(final, type="batch_results", status="ok", queries=queries)]
+
+    async def get_stats(self):
+        """
+        Collects the statistics of every shard.
+
+        Returns:
+            dict: The coordinator counters and the statistics of each shard (or why they are missing).
+        """
+        replies = await asyncio.gather(*(self.ask(shard, {"type": "stats", "id": next(self.ids)}, self.timeout)
+                                         for shard in self.shards))
+        shards = {}
+        for shard, (answer, error) in zip(self.shards, replies):
+            shards[shard.address] = answer.get("stats") if answer else {"error": error}
+        return {"coordinator": {"by": self.by, "shards": [{"address": shard.address, "requests": shard.requests,
+                                                           "failures": shard.failures} for shard in self.shards]},
+                "shards": shards}
+
+    async def handle_message(self, message, calls):
+        """
+        Answers a framed request, with the same request types as server.py.
+
+        Args:
+            message (dict): The decoded request.
+            calls (list): Receives the shard requests in progress, for cancel().
+
+        Returns:
+            list: The response frames, or None if the client asked to close the connection.
+        """
+        request_type = message.get("type", "search")
+        response = {}
+        if "id" in message:
+            response["id"] = message["id"]  # Lets the client match responses to requests
+        if request_type == "quit":
+            return None
+        if request_type == "cancel":
+            return []  # Nothing is running
+        if request_type == "stats":
+            return [dict(response, type="stats", status="ok", stats=await self.get_stats())]
+        if request_type == "batch":
+            return await self.batch(message, response, calls)
+        if request_type != "search":
+            return [dict(response, type="error", status="error", error=f"Unknown request type: {request_type}")]
+        return await self.search(message, response, calls)
+
+    async def handle_legacy(self, client_msg, calls):
+        """
+        Answers an unframed "<search_target>|<keyword>|<file_extension>" request.
+
+        Returns:
+            str: The response text.
+        """
+        if client_msg is None:
+            return LEGACY_ENCODING_ERROR
+        if client_msg.strip() == STATS_MSG:
+            return json.dumps(await self.get_stats(), indent=2)
+        try:
+            search_target, keyword, file_extension = parse_legacy(client_msg)
+        except ValueError as e:
+            return str(e)
+        message = {"type": "search", "target": search_target, "keyword": keyword, "extensions": file_extension}
+        frame = (await self.search(message, {}, calls))[-1]
+        if frame["type"] == "error":
+            return f"Error: {frame['error']}"
+        lines = [format_result_line(result) for result in frame["results"]]
+        if frame.get("truncated"):
+            lines.append(truncation_message(frame["reason"]))
+        return "\n".join(lines)
+
+    async def handle_client(self, reader, writer):
+        """
+        Handles communication with a connected client. While a request is answered the
+        connection keeps being read: a CANCEL is forwarded to the shards, and the client
+        closing the connection drops the request (closing the shard connections stops their
+        searches); other requests received meanwhile are answered afterwards.
+
+        Args:
+            reader (asyncio.StreamReader): The client stream.
+            writer (asyncio.StreamWriter): The client stream writer.
+        """
+        current = {"id": None, "calls": []}  # The request being answered and its shard requests
+
+        async def answer(framed, client_msg):
+            """
+            Answers one request and writes the response.
+            """
+            calls = current["calls"] = []
+            current["id"] = client_msg.get("id") if framed else None
+            try:
+                if framed:
+                    frames = await self.handle_message(client_msg, calls)
+                    if frames is None:
+                        return False
+                    for frame in frames:
+                        writer.write(encode_frame(frame))
+                else:
+                    writer.write((await self.handle_legacy(client_msg, calls)).encode('utf-8'))
+            finally:
+                current["calls"] = []  # A later CANCEL must not reach the shards of a finished request
+            await writer.drain()  # Apply back-pressure when the client reads slowly
+            return True
+
+        def cancel(request_id):
+            """
+            Forwards a CANCEL for the running request to its shards.
+            """
+            if request_id is None or request_id == current["id"]:
+                logging.debug(f"Cancel received for request {request_id}: forwarding it to the shards")
+                self.cancel(current["calls"])
+
+        await serve_connection(reader, writer, answer, cancel)
+
+    def close(self):
+        """
+        Closes the idle shard connections.
+        """
+        for shard in self.shards:
+            shard.close()
+
+async def serve(coordinator, host, port, backlog, max_connections):
+    """
+    Runs the coordinator until SIGINT/SIGTERM.
+
+    Args:
+        coordinator (Coordinator): The coordinator answering the requests.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        backlog (int): The accept backlog.
+        max_connections (int): Connections served at once; extra ones are closed immediately.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()  # Set when the coordinator is asked to stop
+    clients = set()         # Tasks of the connected clients
+
+    async def on_connect(reader, writer):
+        """
+        Accepts a connection if the connection limit allows it.
+        """
+        addr = writer.get_extra_info("peername")
+        if len(clients) >= max_connections:
+            logging.warning(f"Refused connection from {addr}: {max_connections} connections already open")
+            writer.close()
+            return
+        logging.info(f"Accepted connection from {addr}")
+        task = asyncio.current_task()
+        clients.add(task)
+        try:
+            await coordinator.handle_client(reader, writer)
+        finally:
+            clients.discard(task)
+
+    for sig_name in ("SIGINT", "SIGTERM"):
+        try:
+            loop.add_signal_handler(getattr(signal, sig_name), stop.set)
+        except (NotImplementedError, AttributeError):
+            pass  # Not available on this platform: Ctrl+C interrupts the event loop instead
+
+    server = await asyncio.start_server(on_connect, host, port, backlog=backlog, reuse_address=True)
+    shards = ", ".join(shard.address for shard in coordinator.shards)
+    print(f"[Coordinator] Running on {host}:{port} in front of {shards}. Press Ctrl+C to stop.")
+    logging.info(f"Coordinator started on {host}:{port} with shards {shards} (split by {coordinator.by})")
+
+    async with server:
+        await stop.wait()
+        server.close()  # Stop accepting new connections
+        if clients:
+            # Let in-flight requests finish, then drop whatever is left
+            done, pending = await asyncio.wait(set(clients), timeout=SHUTDOWN_GRACE)
+            for task in pending:
+                task.cancel()
+    coordinator.close()
+    logging.info("Coordinator stopped.")
+
+def main():
+    """
+    Starts the coordinator in front of the shard servers given on the command line.
+    """
+    parser = argparse.ArgumentParser(description="Coordinator spreading searches over several search servers.")
+    parser.add_argument("--host", default=HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on")
+    parser.add_argument("--shards", default=",".join(SHARDS),
+                        help="Comma-separated host:port of the shard servers, in the order of their --shard index")
+    parser.add_argument("--shard-by", choices=SHARD_MODES, default=SHARD_BY,
+                        help="How the shard servers split the files (same as their --shard-by)")
+    parser.add_argument("--shard-timeout", type=float, default=SHARD_TIMEOUT,
+                        help="Seconds to wait for a shard when a request sets no timeout")
+    parser.add_argument("--backlog", type=int, default=ACCEPT_BACKLOG, help="Accept backlog")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS, help="Connections served at once")
+    args = parser.parse_args()
+
+    addresses = [address.strip() for address in args.shards.split(",") if address.strip()]
+    if not addresses or not all(address.rpartition(":")[2].isdigit() for address in addresses):
+        parser.error("--shards must list host:port addresses")
+    coordinator = Coordinator(addresses, args.shard_by, args.shard_timeout)
+    try:
+        asyncio.run(serve(coordinator, args.host, args.port, args.backlog, args.max_connections))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        # Log any errors that occur during setup or execution
+        logging.error(f"Coordinator error: {e}")
+        print(f"[Coordinator] Error: {e}")
+    print("[Coordinator] Stopped.")
+
+if __name__ == "__main__":
+    main()  # Execute the main function when the script is run directly
@@ -0,0 +1,188 @@
+# corpus.py
+
+import argparse             # For command-line options
+import os                   # For creating the corpus folders
+import glob                 # To remove the files of a previous corpus
+import json                 # To write the corpus manifest
+import random               # Seeded generator, so a corpus can be reproduced exactly
+import openpyxl             # To write the Excel (.xlsx) files
+from server import FOLDERS  # The corpus is written in the layout searched by the server
+
+FILE_PREFIX = "synthetic_"              # Generated files start with this prefix (and only they are replaced)
+MANIFEST_FILE = "synthetic_corpus.json" # Parameters of the last generated corpus
+PDF_LINES_PER_PAGE = 40                 # Lines written on each PDF page
+HTML_SCRIPT_EVERY = 50                  # A script block is inserted every this many paragraphs
+
+# Filler vocabulary; the query terms below never appear in it
+WORDS = ("data", "analysis", "server", "client", "report", "value", "system", "network", "file",
+         "search", "result", "table", "index", "query", "record", "page", "line", "text", "model",
+         "process", "memory", "worker", "cache", "storage", "format", "document", "sample",
+         "output", "input", "request", "response", "error", "status", "module", "version", "update")
+NEEDLE = "needle"           # Planted term matched by every benchmark query
+COMPANION = "haystack"      # Second planted term, used by the AND/OR queries
+
+# Benchmark queries matching the planted terms, by query type
+QUERIES = {
+    "single": NEEDLE,
+    "and": f"{NEEDLE} AND {COMPANION}",
+    "or": f"{NEEDLE} OR {COMPANION}",
+    "regex": NEEDLE + r"-\d{3}"
+}
+
+def make_line(rng, density):
+    """
+    Generates one line of text.
+
+    Args:
+        rng (random.Random): The seeded generator.
+        density (float): Probability that the line contains each planted term.
+
+    Returns:
+        str: The line.
+    """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 14))]
+    if rng.random() < density:
+        words.insert(rng.randrange(len(words) + 1), f"{NEEDLE}-{rng.randrange(1000):03d}")
+    if rng.random() < density:
+        words.insert(rng.randrange(len(words) + 1), COMPANION)
+    return " ".join(words)
+
+def make_lines(rng, size, density):
+    """
+    Generates lines until they add up to about size bytes of text.
+
+    Returns:
+        list: The lines.
+    """
+    lines = []
+    total = 0
+    while total < size:
+        line = make_line(rng, density)
+        lines.append(line)
+        total += len(line) + 1
+    return lines
+
+def write_txt(file_path, lines):
+    """
+    Writes lines as a UTF-8 text file.
+    """
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write("\n".join(lines) + "\n")
+
+def write_pdf(file_path, lines):
+    """
+    Writes lines as a minimal PDF (Helvetica text, PDF_LINES_PER_PAGE lines per page).
+    The file is written by hand so that no PDF library is needed to build a corpus.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for start in range(0, max(len(lines), 1), PDF_LINES_PER_PAGE):
+        page_lines = lines[start:start + PDF_LINES_PER_PAGE]
+        # Backslashes and parentheses are the only characters to escape in a PDF string
+        shown = " ".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T*"
+                         for line in page_lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 760 Td {shown} ET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    data += b"".join(f"{offset:010d} 00000 n \n".encode('latin-1') for offset in offsets)
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    with open(file_path, 'wb') as file:
+        file.write(data)
+
+def write_html(file_path, lines):
+    """
+    Writes lines as HTML paragraphs, with style and script blocks that must not be searched.
+    """
+    parts = ["<!DOCTYPE html>\n<html>\n<head>\n<title>Synthetic document</title>\n",
+             "<style>p { margin: 0; }</style>\n</head>\n<body>\n"]
+    for number, line in enumerate(lines, start=1):
+        parts.append(f"<p>{line}</p>\n")
+        if number % HTML_SCRIPT_EVERY == 0:
+            parts.append(f"<script>var counter = {number};</script>\n")
+    parts.append("</body>\n</html>\n")
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write("".join(parts))
+
+def write_xlsx(file_path, lines):
+    """
+    Writes lines as the rows of a workbook: row number, text and text length.
+    """
+    workbook = openpyxl.Workbook(write_only=True)  # Streams rows to disk
+    sheet = workbook.create_sheet("Data")
+    for number, line in enumerate(lines, start=1):
+        sheet.append([number, line, len(line)])
+    workbook.save(file_path)
+
+# Writer of each file type
+WRITERS = {
+    ".txt": write_txt,
+    ".pdf": write_pdf,
+    ".html": write_html,
+    ".xlsx": write_xlsx
+}
+
+def generate_corpus(files, file_size, density, seed, extensions=None):
+    """
+    Generates a reproducible corpus in the FOLDERS layout of the current directory.
+    Files from a previous corpus are replaced; other files are left untouched.
+
+    Args:
+        files (int): The number of files per file type.
+        file_size (int): The approximate amount of text per file, in bytes.
+        density (float): Probability that a line contains each planted term.
+        seed (int): The seed of the generator (same parameters and seed, same corpus).
+        extensions (list): The file types to generate, or None for all of them.
+
+    Returns:
+        dict: The corpus parameters (also written to MANIFEST_FILE).
+    """
+    extensions = extensions or list(FOLDERS)
+    for ext in extensions:
+        folder = FOLDERS[ext]
+        os.makedirs(folder, exist_ok=True)
+        for old_path in glob.glob(os.path.join(folder, f"{FILE_PREFIX}*{ext}")):
+            os.remove(old_path)
+        rng = random.Random(f"{seed}{ext}")  # One stream per type, so types can be generated separately
+        for number in range(files):
+            file_path = os.path.join(folder, f"{FILE_PREFIX}{number:04d}{ext}")
+            WRITERS[ext](file_path, make_lines(rng, file_size, density))
+        print(f"[Corpus] {files} {ext} file(s) written to {folder}")
+
+    manifest = {"files": files, "file_size": file_size, "density": density, "seed": seed,
+                "extensions": extensions, "queries": QUERIES}
+    with open(MANIFEST_FILE, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+def main():
+    """
+    Parses the command line and generates the corpus.
+    """
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus for the search server.")
+    parser.add_argument("--root", default=".", help="Directory in which the data/ folders are created")
+    parser.add_argument("--files", type=int, default=10, help="Files per file type")
+    parser.add_argument("--file-size", type=int, default=100000, help="Approximate bytes of text per file")
+    parser.add_argument("--density", type=float, default=0.01, help="Probability that a line contains each planted term")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    parser.add_argument("--extensions", help="Comma-separated file types to generate (default: all)")
+    args = parser.parse_args()
+
+    os.makedirs(args.root, exist_ok=True)
+    os.chdir(args.root)  # FOLDERS are relative paths
+    extensions = [ext.strip() for ext in args.extensions.split(",")] if args.extensions else None
+    generate_corpus(args.files, args.file_size, args.density, args.seed, extensions)
+
+if __name__ == "__main__":
+    main()  # Execute the main function when the script is run directly
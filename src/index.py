@@ -0,0 +1,892 @@
+# index.py
+
+import os                   # For file paths and file metadata (mtime, size)
+import bisect               # To find the indexed terms starting with a prefix
+import glob                 # To list the files of every indexed folder
+import pickle               # To persist the index between server runs
+import re                   # For tokenizing text into terms
+import threading            # To protect the index against concurrent refreshes
+import logging              # For logging index activities and errors
+try:
+    from re import _parser as sre_parse  # To find the literal parts a regex requires (Python 3.11+)
+except ImportError:
+    try:
+        import sre_parse        # Same parser, before it became private in Python 3.11
+    except ImportError:
+        sre_parse = None        # Regex queries are then always answered by a full scan
+from cancellation import CHECK_INTERVAL, current as current_token  # Lets a cut request stop its search
+
+INDEX_VERSION = 4                       # Bumped whenever the on-disk layout changes
+FETCH_BATCH = 16                        # Files whose units a search fetches at once (extracted in parallel if needed)
+TOKEN_RE = re.compile(r"\w+")           # A term is a run of word characters
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")  # Characters that give a pattern regex semantics
+MAX_EXACT_STRINGS = 16                  # Alternative strings followed through a regex before giving up on them
+MAX_TRIGRAM_CLAUSES = 8                 # Most selective trigram requirements intersected per regex
+TRIGRAM_DENSE_FRACTION = 0.5            # Regexes whose rarest requirement holds in more of the units scan them all
+TRIGRAM_INTERSECT_RATIO = 4             # A requirement is only intersected if at most this many times more common than the candidates left
+# Repetition opcodes of the regex parser (possessive repeats only exist from Python 3.11)
+REPEAT_OPCODES = tuple(getattr(sre_parse, name) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+                       if hasattr(sre_parse, name))
+
+def tokenize(text):
+    """
+    Splits a text into the terms stored in the index.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list: The list of terms (case is preserved because matching is case-sensitive).
+    """
+    return TOKEN_RE.findall(text)
+
+def is_literal(pattern):
+    """
+    Checks whether a pattern behaves like a plain substring when used with re.search.
+
+    Args:
+        pattern (str): The keyword or regex pattern.
+
+    Returns:
+        bool: True if the pattern contains no regex metacharacters.
+    """
+    return not any(char in REGEX_METACHARACTERS for char in pattern)
+
+def trigrams(text):
+    """
+    Lists the distinct three-character substrings of a text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        set: The trigrams (case is preserved, like the matching).
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def string_clauses(strings):
+    """
+    Turns "the match contains one of these strings" into trigram requirements.
+
+    Args:
+        strings (set): The alternative strings.
+
+    Returns:
+        list: Sets of trigrams; a match contains at least one trigram of every set.
+    """
+    if not strings or any(len(string) < 3 for string in strings):
+        return []  # A string without trigrams could be the one that matches
+    shortest = min(len(string) for string in strings)
+    # Position k of every alternative gives one requirement: whichever string matches has its trigram k
+    return [{string[k:k + 3] for string in strings} for k in range(shortest - 2)]
+
+def analyze_regex(items):
+    """
+    Finds what a parsed regex (or part of it) requires from the text it matches.
+
+    Args:
+        items: A parsed pattern (sre_parse.SubPattern or a list of its items).
+
+    Returns:
+        tuple: (exact, clauses), where exact is the set of strings the part can match (None
+            when there are too many or they are unknown) and clauses the trigram
+            requirements of the part (see string_clauses) not already implied by exact.
+    """
+    current = {""}  # Strings matched by the items seen since the last flush
+    clauses = []
+    exact = True    # Whether current still describes every item seen
+    for op, av in items:
+        item_exact, item_clauses = analyze_regex_item(op, av)
+        if item_exact is not None and len(current) * len(item_exact) <= MAX_EXACT_STRINGS:
+            current = {a + b for a in current for b in item_exact}
+        else:
+            # The strings seen so far end here: keep what they require and start again
+            clauses.extend(string_clauses(current))
+            exact = False
+            current = item_exact if item_exact is not None else {""}
+        clauses.extend(item_clauses)
+    if exact:
+        return current, clauses
+    clauses.extend(string_clauses(current))
+    return None, clauses
+
+def analyze_regex_item(op, av):
+    """
+    Analyzes one item of a parsed regex (see analyze_regex).
+    """
+    if op is sre_parse.LITERAL:
+        return {chr(av)}, []
+    if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return {""}, []  # Zero-width: requires nothing from the matched text
+    if op is sre_parse.IN:
+        chars = set()
+        for member_op, member in av:
+            if member_op is sre_parse.LITERAL:
+                chars.add(chr(member))
+            elif member_op is sre_parse.RANGE and member[1] - member[0] < MAX_EXACT_STRINGS:
+                chars.update(chr(code) for code in range(member[0], member[1] + 1))
+            else:
+                return None, []  # Negated sets, categories (\d, \w) and wide ranges
+        return (chars if len(chars) <= MAX_EXACT_STRINGS else None), []
+    if op is sre_parse.SUBPATTERN:
+        group, add_flags, del_flags, pattern = av
+        if add_flags or del_flags:
+            return None, []  # Inline flags such as (?i:...) change what matches
+        return analyze_regex(pattern)
+    if op is sre_parse.BRANCH:
+        alternatives = [analyze_regex(pattern) for pattern in av[1]]
+        if all(alt_exact is not None for alt_exact, alt_clauses in alternatives):
+            strings = set().union(*(alt_exact for alt_exact, alt_clauses in alternatives))
+            if len(strings) <= MAX_EXACT_STRINGS:
+                return strings, []
+        # One requirement of each alternative, merged: whichever alternative matches satisfies it
+        merged = set()
+        for alt_exact, alt_clauses in alternatives:
+            alt_clauses = alt_clauses or (string_clauses(alt_exact) if alt_exact is not None else [])
+            if not alt_clauses:
+                return None, []  # This alternative requires nothing
+            merged |= min(alt_clauses, key=len)
+        return None, [merged]
+    if op in REPEAT_OPCODES:
+        low, high, pattern = av
+        if low == 0:
+            return None, []  # The part may be absent
+        item_exact, item_clauses = analyze_regex(pattern)
+        if low == high and item_exact is not None and len(item_exact) ** low <= MAX_EXACT_STRINGS:
+            strings = {""}
+            for _ in range(low):
+                strings = {a + b for a in strings for b in item_exact}
+            return strings, []
+        # At least one occurrence: its requirements hold, but the neighbours are unknown
+        return None, item_clauses + (string_clauses(item_exact) if item_exact is not None else [])
+    return None, []  # Any character, back references, conditionals, ...
+
+def regex_clauses(pattern):
+    """
+    Derives the trigram requirements of a compiled regex: every text it can match contains
+    at least one trigram of each returned set.
+
+    Args:
+        pattern (re.Pattern): The compiled regex.
+
+    Returns:
+        list: Sets of trigrams; empty when the pattern has no usable literal (e.g. "\\d+")
+            or the regex parser is not available.
+    """
+    if sre_parse is None or not isinstance(pattern.pattern, str) or pattern.flags & re.IGNORECASE:
+        return []
+    try:
+        exact, clauses = analyze_regex(sre_parse.parse(pattern.pattern, pattern.flags))
+    except Exception:
+        return []  # Unknown syntax: a full scan is always correct
+    if exact is not None:
+        clauses = clauses + string_clauses(exact)
+    unique = []
+    for clause in clauses:
+        if clause not in unique:
+            unique.append(clause)
+    return unique
+
+class TrigramIndex:
+    """
+    Maps every trigram of the indexed text units to the units containing it, so that regex
+    queries only run on the units that contain the literal parts the pattern requires.
+    """
+
+    def __init__(self):
+        self.postings = {}  # Trigram -> {path: set of unit ids}
+
+    def add(self, path, found):
+        """
+        Adds the units of a file.
+
+        Args:
+            path (str): The path to the file.
+            found (dict): Trigram -> ids of the units of the file containing it (see collect()).
+
+        Returns:
+            list: The trigrams of the file, to be passed to remove().
+        """
+        for trigram, unit_ids in found.items():
+            files = self.postings.get(trigram)
+            if files is None:
+                self.postings[trigram] = {path: set(unit_ids)}
+            else:
+                files[path] = set(unit_ids)
+        return list(found)
+
+    @staticmethod
+    def collect(found, unit_id, text):
+        """
+        Records the trigrams of one unit of a file in found (trigram -> unit ids), as the
+        units are read one after the other.
+        """
+        for trigram in trigrams(text):
+            unit_ids = found.get(trigram)
+            if unit_ids is None:
+                found[trigram] = [unit_id]
+            else:
+                unit_ids.append(unit_id)
+
+    def remove(self, path, file_trigrams):
+        """
+        Removes the units of a file.
+
+        Args:
+            path (str): The path to the file.
+            file_trigrams (list): The trigrams add() returned for the file.
+        """
+        for trigram in file_trigrams:
+            files = self.postings.get(trigram)
+            if files is None:
+                continue
+            files.pop(path, None)
+            if not files:
+                del self.postings[trigram]
+
+    def _lookup(self, clause):
+        """
+        Returns path -> set of unit ids containing at least one trigram of a clause.
+        """
+        found = {}
+        for trigram in clause:
+            for path, unit_ids in self.postings.get(trigram, {}).items():
+                found.setdefault(path, set()).update(unit_ids)
+        return found
+
+    def _intersect(self, clauses, total_units=None):
+        """
+        Intersects the units satisfying every clause, most selective clauses first.
+
+        Args:
+            clauses (list): Sets of trigrams (see string_clauses).
+            total_units (int): The number of indexed units, or None if unknown.
+
+        Returns:
+            dict: Path -> set of candidate unit ids, or None if every unit should be checked
+                (no clause, or too little to gain from the clauses).
+        """
+        if not clauses:
+            return None
+        sized = sorted(((sum(len(unit_ids) for trigram in clause for unit_ids in self.postings.get(trigram, {}).values()), clause)
+                        for clause in clauses), key=lambda item: item[0])
+        if total_units and sized[0][0] > total_units * TRIGRAM_DENSE_FRACTION:
+            return None  # Most units would be candidates anyway: checking them all is cheaper
+        # The rarest requirements narrow the candidates most; common ones barely help and cost a lot
+        candidates = None
+        remaining = 0  # Candidate units left
+        for size, clause in sized[:MAX_TRIGRAM_CLAUSES]:
+            if candidates is not None and size > remaining * TRIGRAM_INTERSECT_RATIO:
+                break  # Running the regex on the candidates left is cheaper than this intersection
+            found = self._lookup(clause)
+            if candidates is None:
+                candidates = found
+            else:
+                candidates = {path: candidates[path] & found[path] for path in candidates.keys() & found.keys()}
+            remaining = sum(len(unit_ids) for unit_ids in candidates.values())
+            if not remaining:
+                break
+        return candidates
+
+    def regex_candidates(self, pattern, total_units=None):
+        """
+        Looks up the units that may match a regex.
+
+        Args:
+            pattern (re.Pattern): The compiled regex.
+            total_units (int): The number of indexed units, or None if unknown.
+
+        Returns:
+            dict: Path -> set of candidate unit ids, or None if every unit must be checked.
+        """
+        return self._intersect(regex_clauses(pattern), total_units)
+
+    def literal_candidates(self, keyword, total_units=None):
+        """
+        Looks up the units that may contain a literal string.
+
+        Returns:
+            dict: Path -> set of candidate unit ids, or None if every unit must be checked
+                (e.g. the string is shorter than a trigram).
+        """
+        return self._intersect([{trigram} for trigram in trigrams(keyword)], total_units)
+
+class InvertedIndex:
+    """
+    Maps every term of the searched folders to the text units containing it.
+
+    The index keeps the postings, not the text: a query looks up its candidate units, then
+    fetches the units of the files holding some through extract_many (the server's
+    extraction cache or snapshot) and confirms them. Only files whose mtime or size changed
+    are re-extracted on refresh. A trigram index kept alongside the word postings narrows
+    down the units a regex query has to run on.
+    """
+
+    def __init__(self, folders, extract_many, index_path=None, max_file_size=None, large_file_scanners=None,
+                 use_trigrams=True, accept=None):
+        """
+        Args:
+            folders (dict): Mapping of file extensions to their directories.
+            extract_many (callable): extract_many([(path, extension), ...]) -> one (units, error)
+                tuple per file, where units is a sequence of (location, text) tuples. It
+                extracts the files to index, and gives searches the text of candidate units.
+            index_path (str): Where to persist the index, or None to keep it in memory only.
+            max_file_size (int): Files larger than this are not indexed if their type has a large file scanner.
+            large_file_scanners (dict): Extension -> scanner(path, plan) yielding the matching
+                (location, text) units of a file that is too large to be indexed.
+            use_trigrams (bool): Whether to maintain the trigram index used by regex queries.
+            accept (callable): accept(path, extension) -> bool, the files of the folders this
+                index covers (e.g. the share of a shard server), or None for all of them.
+        """
+        self.folders = folders              # Extension -> folder to index
+        self.extract_many = extract_many    # Extractor returning (location, text) units
+        self.max_file_size = max_file_size  # Size above which scannable files are left out
+        self.large_file_scanners = large_file_scanners or {}  # Extension -> scanner of large files
+        self.accept = accept                # Filter of the indexed files, None to index every file
+        self.index_path = index_path        # Persistence file
+        self.files = {}                     # Path -> {"ext", "mtime", "size", "count", "tokens", "terms", "trigrams"[, "pages"]}
+        self.postings = {}                  # Term -> {path: set of unit ids}
+        self.sorted_terms = None            # The terms of the postings in order, built when a prefix is looked up
+        self.trigrams = TrigramIndex() if use_trigrams else None  # Trigram postings for regex queries
+        self.order = {}                     # Extension -> paths in glob order (the scan order)
+        self.unit_count = 0                 # Indexed units, for the relevance statistics
+        self.token_count = 0                # Terms in the indexed units, for the relevance statistics
+        self.generations = {}               # Extension -> number of changes to its indexed files
+        self.lock = threading.RLock()       # Serializes refreshes and searches
+
+    def load(self):
+        """
+        Loads the persisted index, if any. A missing or outdated file leaves the index empty.
+
+        Returns:
+            bool: True if an index was loaded.
+        """
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, 'rb') as file:
+                data = pickle.load(file)
+            if data.get("version") != INDEX_VERSION:
+                logging.info(f"Ignoring index {self.index_path} with version {data.get('version')}")
+                return False
+            if (data.get("trigrams") is None) != (self.trigrams is None):
+                logging.info(f"Ignoring index {self.index_path} built with a different trigram setting")
+                return False
+            with self.lock:
+                self.files = data["files"]
+                self.postings = data["postings"]
+                self.order = data["order"]
+                if self.trigrams is not None:
+                    self.trigrams.postings = data["trigrams"]
+                self.sorted_terms = None
+                self.unit_count = sum(entry["count"] for entry in self.files.values())
+                self.token_count = sum(entry.get("tokens", 0) for entry in self.files.values())
+                for ext in self.folders:
+                    self._changed(ext)
+            logging.info(f"Loaded index {self.index_path} with {len(self.files)} files")
+            return True
+        except Exception as e:
+            # A corrupt index is simply rebuilt by the next refresh
+            logging.error(f"Error loading index {self.index_path}: {e}")
+            return False
+
+    def save(self):
+        """
+        Writes the index to disk atomically (temporary file + rename).
+        """
+        if not self.index_path:
+            return
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with self.lock:
+                data = {"version": INDEX_VERSION, "files": self.files,
+                        "postings": self.postings, "order": self.order,
+                        "trigrams": self.trigrams.postings if self.trigrams is not None else None}
+                with open(tmp_path, 'wb') as file:
+                    pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logging.error(f"Error saving index {self.index_path}: {e}")
+
+    def refresh(self, extensions=None):
+        """
+        Brings the index up to date with the folders, re-extracting only changed files.
+
+        Args:
+            extensions (list): The file extensions to refresh, or None for all of them.
+
+        Returns:
+            int: The number of files added, updated or removed.
+        """
+        changed = 0
+        with self.lock:
+            for ext in extensions or list(self.folders):
+                folder = self.folders.get(ext)
+                if not folder:
+                    continue
+                paths = self._list_files(folder, ext)
+                seen = set(paths)
+                stale = []  # (path, stat) of the new or modified files
+                for path in paths:
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue  # The file vanished between glob and stat
+                    entry = self.files.get(path)
+                    if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                        continue  # Unchanged since it was indexed
+                    if self._is_large(ext, stat):
+                        # Too large to keep in memory: remember it and scan it at query time
+                        self._remove_file(path)
+                        self.files[path] = {"ext": ext, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+                                            "count": 0, "large": True}
+                        self._changed(ext)
+                        changed += 1
+                        continue
+                    stale.append((path, stat))
+                # Extract all the stale files in one batch so they can be processed in parallel
+                extracted = self.extract_many([(path, ext) for path, stat in stale])
+                for (path, stat), (units, error) in zip(stale, extracted):
+                    if error is not None:
+                        # Keep an empty entry so the file is not re-read until it changes
+                        logging.error(f"Error indexing file {path}: {error}")
+                    self._remove_file(path)
+                    self._add_file(path, ext, stat, units)
+                    changed += 1
+                # Drop the files of this type that no longer exist
+                for path in [p for p, entry in self.files.items() if entry["ext"] == ext and p not in seen]:
+                    self._remove_file(path)
+                    changed += 1
+                self.order[ext] = paths
+            if changed:
+                logging.info(f"Index refreshed: {changed} file(s) changed")
+                self.save()
+        return changed
+
+    def update_file(self, path, ext):
+        """
+        Brings one file up to date, for callers that know which file changed (the folder
+        watcher). Unlike refresh(), the extraction runs outside the lock, so searches keep
+        being answered from the previous version of the file meanwhile. The index is not
+        saved; call save() once a batch of updates is done.
+
+        Args:
+            path (str): The path to the file.
+            ext (str): The file extension.
+
+        Returns:
+            bool: True if the file was added, updated or removed.
+        """
+        if self.accept is not None and not self.accept(path, ext):
+            return self.remove_file(path)  # Not ours (another shard indexes it)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return self.remove_file(path)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                return False  # Already indexed, e.g. by a refresh
+            large = self._is_large(ext, stat)
+        units = []
+        if not large:
+            units, error = self.extract_many([(path, ext)])[0]
+            if error is not None:
+                logging.error(f"Error indexing file {path}: {error}")
+        with self.lock:
+            self._remove_file(path)
+            if large:
+                self.files[path] = {"ext": ext, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+                                    "count": 0, "large": True}
+                self._changed(ext)
+            else:
+                self._add_file(path, ext, stat, units)
+            self._reorder(ext)
+        return True
+
+    def remove_file(self, path):
+        """
+        Removes a deleted file from the index.
+
+        Returns:
+            bool: True if the file was indexed.
+        """
+        with self.lock:
+            entry = self.files.get(path)
+            if not entry:
+                return False
+            self._remove_file(path)
+            self._reorder(entry["ext"])
+        return True
+
+    def generation(self, ext):
+        """
+        Returns the number of changes made so far to the indexed files of one type. Results
+        computed from the index stay valid as long as this number does not change.
+
+        Args:
+            ext (str): The file extension.
+
+        Returns:
+            int: The generation of the files of this type.
+        """
+        return self.generations.get(ext, 0)  # A single dict read needs no lock
+
+    def _changed(self, ext):
+        """
+        Records a change to the indexed files of one type.
+        """
+        self.generations[ext] = self.generations.get(ext, 0) + 1
+
+    def _reorder(self, ext):
+        """
+        Recomputes the scan order of one file type after single-file updates.
+        """
+        folder = self.folders.get(ext)
+        if folder:
+            self.order[ext] = [p for p in self._list_files(folder, ext) if p in self.files]
+
+    def _list_files(self, folder, ext):
+        """
+        Lists the files of one type covered by the index, in glob order.
+        """
+        paths = glob.glob(os.path.join(folder, f"*{ext}"))
+        if self.accept is not None:
+            paths = [path for path in paths if self.accept(path, ext)]
+        return paths
+
+    def _is_large(self, ext, stat):
+        """
+        Tells whether a file is left out of the index and scanned at query time instead.
+        """
+        return (self.max_file_size is not None and ext in self.large_file_scanners
+                and stat.st_size >= self.max_file_size)
+
+    def _add_file(self, path, ext, stat, units):
+        """
+        Adds the extracted units of a file to the postings. The text itself is not kept,
+        and the units are read in a single pass, so snapshot units (decoded from the mapping
+        as they are iterated) are decoded once and never all held in memory.
+        """
+        tokens = 0
+        count = 0
+        terms = {}                  # Term -> ids of the units of this file containing it
+        found = {}                  # Trigram -> ids of the units of this file containing it
+        pages = []                  # Page of every unit, while every location is (page, line)
+        for unit_id, (location, text) in enumerate(units):
+            count += 1
+            unit_terms = tokenize(text)
+            tokens += len(unit_terms)
+            for term in unit_terms:
+                unit_ids = terms.get(term)
+                if unit_ids is None:
+                    terms[term] = {unit_id}
+                else:
+                    unit_ids.add(unit_id)
+            if self.trigrams is not None:
+                TrigramIndex.collect(found, unit_id, text)
+            if pages is not None:
+                if len(location) == 2:
+                    pages.append(location[0])
+                else:
+                    pages = None  # Not a PDF
+        for term, unit_ids in terms.items():
+            files = self.postings.get(term)
+            if files is None:
+                self.postings[term] = {path: unit_ids}
+                self.sorted_terms = None  # Sorted again by the next prefix lookup
+            else:
+                files[path] = unit_ids
+        entry = {"ext": ext, "mtime": stat.st_mtime_ns, "size": stat.st_size, "count": count,
+                 "tokens": tokens, "terms": list(terms),
+                 "trigrams": self.trigrams.add(path, found) if self.trigrams is not None else []}
+        if pages:
+            entry["pages"] = pages  # For candidate_pages
+        self.files[path] = entry
+        self._changed(ext)
+        self.unit_count += count
+        self.token_count += tokens
+
+    def _remove_file(self, path):
+        """
+        Removes a file and its units from the postings.
+        """
+        entry = self.files.pop(path, None)
+        if not entry:
+            return
+        self._changed(entry["ext"])
+        self.unit_count -= entry["count"]
+        self.token_count -= entry.get("tokens", 0)
+        for term in entry.get("terms", ()):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(path, None)
+            if not postings:
+                del self.postings[term]
+                self.sorted_terms = None
+        if self.trigrams is not None:
+            self.trigrams.remove(path, entry.get("trigrams", ()))
+
+    def _terms_starting_with(self, prefix):
+        """
+        Lists the indexed terms starting with a prefix, by bisecting the sorted terms.
+        """
+        if self.sorted_terms is None:
+            self.sorted_terms = sorted(self.postings)
+        terms = self.sorted_terms
+        start = end = bisect.bisect_left(terms, prefix)
+        while end < len(terms) and terms[end].startswith(prefix):
+            end += 1
+        return terms[start:end]
+
+    def _keyword_candidates(self, keyword):
+        """
+        Looks up the units that may contain a literal keyword.
+
+        Terms inside the keyword must match whole indexed terms; the first and last ones
+        may be the end or the start of a longer term, since the keyword can cut a word.
+        Such open-ended terms are looked up by bisecting the sorted terms (prefixes) or from
+        the trigram index (suffixes and substrings: the units holding all their trigrams),
+        rather than by walking every indexed term.
+        Keywords without terms (punctuation only) are looked up by their trigrams.
+
+        Args:
+            keyword (str): A literal keyword.
+
+        Returns:
+            dict: Path -> set of candidate unit ids, or None if the keyword has neither terms nor trigrams.
+        """
+        candidates = None
+        for match in TOKEN_RE.finditer(keyword):
+            term = match.group()
+            open_left = match.start() == 0              # The keyword may start inside a word
+            open_right = match.end() == len(keyword)    # The keyword may end inside a word
+            if open_left and len(term) >= 3 and self.trigrams is not None:
+                # Suffix or substring of indexed terms: the units holding all its trigrams
+                found = self.trigrams.literal_candidates(term, self.unit_count)
+                if found is None:
+                    continue  # Too common to narrow the candidates down
+            else:
+                if not open_left and not open_right:
+                    matching_terms = [term] if term in self.postings else []
+                elif not open_left:
+                    matching_terms = self._terms_starting_with(term)
+                else:
+                    # Too short for trigrams; such fragments are found in a large part of the terms anyway
+                    matching_terms = [t for t in self.postings if (term in t if open_right else t.endswith(term))]
+                found = {}
+                for indexed_term in matching_terms:
+                    for path, unit_ids in self.postings[indexed_term].items():
+                        found.setdefault(path, set()).update(unit_ids)
+            if candidates is None:
+                candidates = found
+            else:
+                candidates = {path: candidates[path] & found[path] for path in candidates.keys() & found.keys()}
+        if candidates is None and self.trigrams is not None:
+            return self.trigrams.literal_candidates(keyword, self.unit_count)
+        return candidates
+
+    def _candidates(self, plan):
+        """
+        Combines the candidates of every keyword of a query plan according to its operator.
+
+        Returns:
+            dict: Path -> set of candidate unit ids, or None if every unit must be checked.
+        """
+        if not plan.literal:
+            # Real regex patterns cannot be answered from word postings, only from the
+            # trigrams of their literal parts
+            return self.trigrams.regex_candidates(plan.pattern, self.unit_count) if self.trigrams is not None else None
+        per_keyword = [self._keyword_candidates(kw) for kw in plan.keywords]
+        if plan.operator == "AND":
+            known = [c for c in per_keyword if c is not None]
+            if not known:
+                return None
+            result = known[0]
+            for candidates in known[1:]:
+                result = {path: result[path] & candidates[path] for path in result.keys() & candidates.keys()}
+            return result
+        if any(c is None for c in per_keyword):
+            return None  # One alternative has no terms, so it could match anywhere
+        result = {}
+        for candidates in per_keyword:
+            for path, unit_ids in candidates.items():
+                result.setdefault(path, set()).update(unit_ids)
+        return result
+
+    def candidate_pages(self, path, plan):
+        """
+        Lists the pages of an indexed document that may match a compiled query, so that a
+        search of that document alone can skip the other pages.
+
+        Args:
+            path (str): The path to the document (units located by (page, line), as PDF pages).
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+            list: The candidate page numbers in order, or None if every page must be read
+                (the file is not indexed, changed since it was indexed, or the query has no
+                usable literal).
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.files.get(path)
+            if (not entry or "pages" not in entry or entry["mtime"] != stat.st_mtime_ns
+                    or entry["size"] != stat.st_size):
+                return None
+            candidates = self._candidates(plan)
+            if candidates is None:
+                return None
+            pages = entry["pages"]
+            return sorted({pages[unit_id] for unit_id in candidates.get(path, ())})
+
+    def corpus_stats(self, plan):
+        """
+        Returns the corpus statistics used to rank the results of a query (BM25).
+
+        Args:
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+            dict: "units" (indexed units), "average_length" (terms per unit) and "frequencies"
+                (keyword -> number of units that may contain it; regex keywords are left out).
+        """
+        with self.lock:
+            frequencies = {}
+            if plan.literal:
+                for keyword in plan.keywords:
+                    candidates = self._keyword_candidates(keyword)
+                    if candidates is not None:
+                        frequencies[keyword] = sum(len(unit_ids) for unit_ids in candidates.values())
+            return {"units": self.unit_count,
+                    "average_length": self.token_count / self.unit_count if self.unit_count else 0.0,
+                    "frequencies": frequencies}
+
+    def iter_search(self, extension, plan):
+        """
+        Finds the units of one file type matching a compiled query, lazily.
+
+        The candidate units are selected under the lock; their text is fetched and matched
+        while the caller iterates, so a consumer that stops early does not pay for the
+        remaining files. The token of the calling request is checked between files and every
+        CHECK_INTERVAL units.
+
+        Args:
+            extension (str): The file extension to search.
+            plan (QueryPlan): The compiled query; plan.accepts(location) and plan.matches(text)
+                confirm every candidate unit.
+
+        Yields:
+            tuple: (path, location, text) in file scan order, then unit order.
+        """
+        with self.lock:
+            candidates = self._candidates(plan)
+            selected = []  # (path, large, unit ids) snapshot, unit ids None for every unit
+            for path in self.order.get(extension, []):
+                entry = self.files.get(path)
+                if not entry:
+                    continue
+                unit_ids = None if candidates is None else sorted(candidates.get(path, ()))
+                selected.append((path, entry.get("large", False), unit_ids))  # Large files are scanned directly below
+        token = current_token()
+        for path, units, unit_ids in self._with_units(extension, selected):
+            token.check()
+            if units is None:
+                try:
+                    for location, text in self.large_file_scanners[extension](path, plan):
+                        yield path, location, text
+                except Exception as e:
+                    logging.error(f"Error scanning large file {path}: {e}")
+                continue
+            countdown = CHECK_INTERVAL
+            for unit_id in unit_ids:
+                countdown -= 1
+                if not countdown:
+                    countdown = CHECK_INTERVAL
+                    token.check()
+                location, text = units[unit_id]
+                if plan.accepts(location) and plan.matches(text):
+                    yield path, location, text
+
+    def iter_files(self, extension, plans):
+        """
+        Lists the indexed files of one type with their units, for callers evaluating several
+        queries in a single pass over each file.
+
+        Args:
+            extension (str): The file extension.
+            plans (list): The compiled queries; units that none of them can match are left out.
+
+        Yields:
+            tuple: (path, units, unit_ids, plan_unit_ids) in file scan order, where units is
+                None for large files (to be scanned directly), unit_ids the sorted ids of the
+                units that may match at least one query, and plan_unit_ids the candidate ids of
+                each query (None when every unit must be checked for that query).
+        """
+        with self.lock:
+            per_plan = [self._candidates(plan) for plan in plans]
+            every_unit = not per_plan or any(c is None for c in per_plan)
+            selected = []  # (path, large, unit ids, plan unit ids) snapshot
+            for path in self.order.get(extension, []):
+                entry = self.files.get(path)
+                if not entry:
+                    continue
+                if entry.get("large"):
+                    selected.append((path, True, None, None))
+                    continue
+                plan_unit_ids = [None if c is None else c.get(path, set()) for c in per_plan]
+                unit_ids = None if every_unit else sorted(set().union(*plan_unit_ids))
+                selected.append((path, False, unit_ids, plan_unit_ids))
+        yield from self._with_units(extension, selected)
+
+    def _with_units(self, extension, selected):
+        """
+        Fetches the units of the selected files through extract_many, FETCH_BATCH files at a
+        time as the caller reaches them. Large files and files without candidate units are
+        not fetched.
+
+        Args:
+            extension (str): The file extension of the selected files.
+            selected (list): (path, large, unit_ids, ...) tuples in scan order, unit_ids being
+                the sorted candidate ids, or None for every unit of the file.
+
+        Yields:
+            tuple: (path, units, unit_ids, ...), units being None for large files.
+        """
+        for start in range(0, len(selected), FETCH_BATCH):
+            batch = selected[start:start + FETCH_BATCH]
+            fetched = iter(self.extract_many([(path, extension) for path, large, unit_ids, *rest in batch
+                                              if not large and unit_ids != []]))
+            for path, large, unit_ids, *rest in batch:
+                if large:
+                    yield (path, None, None, *rest)
+                    continue
+                if unit_ids == []:
+                    yield (path, [], unit_ids, *rest)
+                    continue
+                units, error = next(fetched)
+                if error is not None:
+                    logging.error(f"Error reading indexed file {path}: {error}")
+                if unit_ids is None:
+                    unit_ids = range(len(units))
+                elif unit_ids[-1] >= len(units):
+                    # The file changed since it was indexed (the watcher has not caught up yet)
+                    unit_ids = [unit_id for unit_id in unit_ids if unit_id < len(units)]
+                yield (path, units, unit_ids, *rest)
+
+    def search(self, extension, plan):
+        """
+        Finds the units of one file type matching a compiled query.
+
+        Args:
+            extension (str): The file extension to search.
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+            list: (path, location, text) tuples in file scan order, then unit order.
+        """
+        return list(self.iter_search(extension, plan))
@@ -0,0 +1,322 @@
+# loadtest.py
+
+import argparse             # For command-line options
+import socket               # For the client connections
+import threading            # One thread per simulated client
+import subprocess           # To start a local server instance
+import signal               # To stop the local server instance
+import random               # To draw queries from the mix
+import time                 # For latencies, rates and memory samples
+import json                 # To write machine-readable results
+import os                   # For the server script path and /proc
+import math                 # For percentile ranks
+import sys                  # For the Python interpreter running the server
+from protocol import send_message, recv_message, ProtocolError  # Framed wire protocol of the server
+from corpus import QUERIES  # Query types matching the synthetic corpus
+
+HOST = '127.0.0.1'          # Address of the server under test
+PORT = 12345                # Port of the server under test
+CONNECT_TIMEOUT = 30.0      # Seconds to wait for a started server to accept connections
+REQUEST_TIMEOUT = 60.0      # Seconds after which a request counts as failed
+
+def parse_mix(mix):
+    """
+    Parses a query mix such as "single=4,and=1,regex=1".
+
+    Args:
+        mix (str): Comma-separated name=weight pairs; names are keys of corpus.QUERIES.
+
+    Returns:
+        list: (name, keyword, weight) tuples.
+    """
+    entries = []
+    for item in mix.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in QUERIES:
+            raise ValueError(f"Unknown query type: {name} (expected one of {', '.join(QUERIES)})")
+        entries.append((name, QUERIES[name], float(weight or 1)))
+    return entries
+
+def percentile(values, fraction):
+    """
+    Returns a percentile of a list of values (nearest rank).
+
+    Args:
+        values (list): The sorted values.
+        fraction (float): The percentile, between 0 and 1.
+
+    Returns:
+        float: The value, or None if the list is empty.
+    """
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[rank]
+
+def read_rss(pid):
+    """
+    Reads the resident memory of a process from /proc (Linux only).
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        float: The resident memory in MB, or None if it cannot be read.
+    """
+    try:
+        with open(f"/proc/{pid}/status", 'r') as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024  # The value is in kB
+    except (OSError, ValueError):
+        pass
+    return None
+
+class LoadStats:
+    """
+    Measurements shared by every client thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()    # Serializes updates from the client threads
+        self.latencies = []             # Seconds per successful request
+        self.per_query = {}             # Query name -> latencies
+        self.errors = 0                 # Failed requests (error frame, timeout, connection error)
+        self.error_messages = {}        # Error message -> count
+        self.truncated = 0              # Responses announcing that results were left out
+        self.results = 0                # Results received in total
+
+    def success(self, name, latency, results, truncated):
+        with self.lock:
+            self.latencies.append(latency)
+            self.per_query.setdefault(name, []).append(latency)
+            self.results += results
+            if truncated:
+                self.truncated += 1
+
+    def failure(self, message):
+        with self.lock:
+            self.errors += 1
+            self.error_messages[message] = self.error_messages.get(message, 0) + 1
+
+def run_request(sock, request):
+    """
+    Sends one search request and reads its whole response.
+
+    Args:
+        sock (socket.socket): The connection.
+        request (dict): The request.
+
+    Returns:
+        tuple: (number of results, truncated flag).
+    """
+    send_message(sock, request)
+    count = 0
+    while True:
+        response = recv_message(sock)
+        if response is None:
+            raise ProtocolError("Connection closed by the server")
+        if response.get("type") == "error":
+            raise ProtocolError(response.get("error", "error"))
+        if response.get("type") == "batch":
+            count += len(response.get("results", []))
+            continue
+        count += len(response.get("results", []))
+        # "more" means the page was full, "truncated" that the server cut the results short
+        return count, bool(response.get("more") or response.get("truncated"))
+
+def client_loop(number, args, mix, stats, deadline):
+    """
+    Body of one simulated client: sends requests back to back over one connection until
+    the deadline (or its request budget) is reached, reconnecting after errors.
+    """
+    rng = random.Random(args.seed + number)  # Each client draws its own reproducible sequence
+    names = [name for name, keyword, weight in mix]
+    weights = [weight for name, keyword, weight in mix]
+    keywords = {name: keyword for name, keyword, weight in mix}
+    sock = None
+    sent = 0
+    while time.monotonic() < deadline and (not args.requests or sent < args.requests):
+        name = rng.choices(names, weights)[0]
+        request = {"type": "search", "id": sent, "target": "ALL", "keyword": keywords[name],
+                   "extensions": args.extensions.split(",") if args.extensions else [],
+                   "stream": args.stream}
+        if args.limit is not None:
+            request["limit"] = args.limit
+        sent += 1
+        start = time.perf_counter()
+        try:
+            if sock is None:
+                sock = socket.create_connection((args.host, args.port), timeout=REQUEST_TIMEOUT)
+            results, truncated = run_request(sock, request)
+            stats.success(name, time.perf_counter() - start, results, truncated)
+        except (OSError, ProtocolError) as e:
+            stats.failure(str(e) or type(e).__name__)
+            if sock is not None:
+                sock.close()
+                sock = None
+    if sock is not None:
+        try:
+            send_message(sock, {"type": "quit"})
+        except OSError:
+            pass
+        sock.close()
+
+def sample_memory(pid, interval, samples, done, started):
+    """
+    Records the resident memory of the server every interval seconds until done is set.
+    """
+    while True:
+        rss = read_rss(pid)
+        if rss is not None:
+            samples.append((time.monotonic() - started, rss))
+        if done.wait(interval):
+            return
+
+def start_server(args):
+    """
+    Starts a local server instance on args.port and waits until it accepts connections.
+
+    Returns:
+        subprocess.Popen: The server process.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    command = [sys.executable, script, "--host", args.host, "--port", str(args.port), "--mode", args.mode]
+    process = subprocess.Popen(command, cwd=args.root, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with status {process.returncode}")
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("The server did not start in time")
+
+def summarize(latencies):
+    """
+    Computes the latency percentiles of a list of request durations.
+
+    Returns:
+        dict: Count, mean, p50, p95, p99 and max in milliseconds.
+    """
+    values = sorted(latencies)
+    to_ms = lambda value: None if value is None else value * 1000
+    return {
+        "count": len(values),
+        "mean_ms": to_ms(sum(values) / len(values)) if values else None,
+        "p50_ms": to_ms(percentile(values, 0.50)),
+        "p95_ms": to_ms(percentile(values, 0.95)),
+        "p99_ms": to_ms(percentile(values, 0.99)),
+        "max_ms": to_ms(values[-1]) if values else None
+    }
+
+def run_load(args):
+    """
+    Runs the load test described by the command-line options.
+
+    Returns:
+        dict: The report.
+    """
+    mix = parse_mix(args.mix)
+    process = start_server(args) if args.spawn else None
+    pid = process.pid if process else args.server_pid
+    stats = LoadStats()
+    samples = []
+    done = threading.Event()
+    started = time.monotonic()
+    sampler = None
+    if pid:
+        sampler = threading.Thread(target=sample_memory, args=(pid, args.sample_interval, samples, done, started), daemon=True)
+        sampler.start()
+
+    try:
+        deadline = started + args.duration
+        clients = [threading.Thread(target=client_loop, args=(number, args, mix, stats, deadline), daemon=True)
+                   for number in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - started
+    finally:
+        done.set()
+        if sampler:
+            sampler.join()
+        if process:
+            process.send_signal(signal.SIGINT)  # Graceful shutdown, like Ctrl+C
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    requests = len(stats.latencies) + stats.errors
+    report = {
+        "clients": args.clients,
+        "duration_s": elapsed,
+        "mix": {name: weight for name, keyword, weight in mix},
+        "requests": requests,
+        "requests_per_second": requests / elapsed if elapsed else None,
+        "results": stats.results,
+        "error_rate": stats.errors / requests if requests else 0.0,
+        "errors": stats.error_messages,
+        "truncation_rate": stats.truncated / len(stats.latencies) if stats.latencies else 0.0,
+        "latency": summarize(stats.latencies),
+        "per_query": {name: summarize(values) for name, values in stats.per_query.items()},
+        "memory_mb": [{"t": round(t, 3), "rss": round(rss, 1)} for t, rss in samples]
+    }
+    return report
+
+def print_report(report):
+    """
+    Prints the main figures of a report.
+    """
+    latency = report["latency"]
+    fmt = lambda value: "-" if value is None else f"{value:.1f}"
+    print(f"[Load] {report['clients']} clients, {report['requests']} requests in {report['duration_s']:.1f}s "
+          f"({report['requests_per_second']:.1f} req/s)")
+    print(f"[Load] latency p50 {fmt(latency['p50_ms'])} ms, p95 {fmt(latency['p95_ms'])} ms, "
+          f"p99 {fmt(latency['p99_ms'])} ms, max {fmt(latency['max_ms'])} ms")
+    for name, summary in report["per_query"].items():
+        print(f"[Load]   {name:<8} {summary['count']:6} requests, p50 {fmt(summary['p50_ms'])} ms, "
+              f"p99 {fmt(summary['p99_ms'])} ms")
+    print(f"[Load] error rate {report['error_rate']:.2%}, truncation rate {report['truncation_rate']:.2%}")
+    for message, count in report["errors"].items():
+        print(f"[Load]   {count} x {message}")
+    memory = [sample["rss"] for sample in report["memory_mb"]]
+    if memory:
+        print(f"[Load] server memory: start {memory[0]:.1f} MB, peak {max(memory):.1f} MB, end {memory[-1]:.1f} MB")
+
+def main():
+    """
+    Parses the command line and runs the load test.
+    """
+    parser = argparse.ArgumentParser(description="Load-test the search server over its wire protocol.")
+    parser.add_argument("--host", default=HOST, help="Address of the server")
+    parser.add_argument("--port", type=int, default=PORT, help="Port of the server")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds the test runs")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per client (0: until the duration elapses)")
+    parser.add_argument("--mix", default=",".join(QUERIES), help="Query mix as name=weight pairs, e.g. single=4,regex=1")
+    parser.add_argument("--extensions", help="Comma-separated file types searched (default: all)")
+    parser.add_argument("--limit", type=int, help="Results per request (the rest counts as truncated)")
+    parser.add_argument("--stream", action="store_true", help="Receive the results in streamed batches")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the query draws")
+    parser.add_argument("--spawn", action="store_true", help="Start a local server instance for the test")
+    parser.add_argument("--root", default=".", help="Directory the spawned server runs in (containing data/)")
+    parser.add_argument("--mode", choices=["asyncio", "threaded"], default="asyncio", help="Mode of the spawned server")
+    parser.add_argument("--server-pid", type=int, help="Process id of an already running server, to sample its memory")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between memory samples")
+    parser.add_argument("--output", help="File to write the report to as JSON")
+    args = parser.parse_args()
+
+    report = run_load(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == "__main__":
+    main()  # Execute the main function when the script is run directly
@@ -0,0 +1,241 @@
+# metrics.py
+
+import threading            # Per-thread current request and protection of the shared counters
+import time                 # For stage timings
+import json                 # To write the periodic metrics dumps
+import logging              # For logging request summaries and dump errors
+from collections import deque  # Bounded window of recent request latencies
+
+# Stages of a request, in processing order
+STAGES = ("parse", "glob", "extract", "match", "serialize")
+LATENCY_WINDOW = 10000      # Recent requests kept to compute latency percentiles
+
+class RequestMetrics:
+    """
+    Timings and counters of one request.
+
+    Stage timings are exclusive: when a stage starts inside another one (for example an
+    extraction triggered while matching), the outer stage is paused, so the stage times
+    add up to at most the duration of the request.
+    """
+
+    def __init__(self, kind):
+        """
+        Args:
+            kind (str): The request type ("search", "stats", "legacy", ...).
+        """
+        self.kind = kind                            # Request type
+        self.started = time.perf_counter()          # Start of the request
+        self.stages = dict.fromkeys(STAGES, 0.0)    # Stage -> seconds
+        self.stack = []                             # Stages currently open, innermost last
+        self.stage_started = None                   # When the innermost stage was (re)started
+        self.bytes_sent = 0                         # Bytes written to the client
+        self.results = 0                            # Results returned
+        self.formats = {}                           # Extension -> {"files", "matches", "extracted", "snapshot"}
+        self.error = False                          # Whether the request failed
+
+    def enter(self, stage):
+        """
+        Starts a stage, pausing the current one.
+        """
+        now = time.perf_counter()
+        if self.stack:
+            self.stages[self.stack[-1]] += now - self.stage_started
+        self.stack.append(stage)
+        self.stage_started = now
+
+    def leave(self):
+        """
+        Ends the innermost stage and resumes the enclosing one.
+        """
+        now = time.perf_counter()
+        self.stages[self.stack.pop()] += now - self.stage_started
+        self.stage_started = now
+
+    def stage(self, name):
+        """
+        Returns a context manager timing a stage.
+
+        Args:
+            name (str): One of STAGES.
+        """
+        return _Stage(self, name)
+
+    def count(self, extension, field, amount=1):
+        """
+        Increments a per-format counter ("files", "matches", "extracted" or "snapshot").
+        """
+        counters = self.formats.get(extension)
+        if counters is None:
+            counters = self.formats[extension] = {"files": 0, "matches": 0, "extracted": 0, "snapshot": 0}
+        counters[field] += amount
+
+    def to_dict(self):
+        """
+        Returns the metrics of the request.
+
+        Returns:
+            dict: Duration, stage timings in milliseconds, bytes sent and counters.
+        """
+        return {
+            "kind": self.kind,
+            "ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            "bytes_sent": self.bytes_sent,
+            "results": self.results,
+            "formats": self.formats,
+            "error": self.error
+        }
+
+class _Stage:
+    """
+    Context manager opening and closing a stage of a RequestMetrics.
+    """
+
+    __slots__ = ("metrics", "name")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.leave()
+        return False
+
+class NullMetrics(RequestMetrics):
+    """
+    Metrics object used outside of a request (benchmarks, direct calls): records nothing.
+    """
+
+    def __init__(self):
+        super().__init__("none")
+
+    def enter(self, stage):
+        pass
+
+    def leave(self):
+        pass
+
+    def count(self, extension, field, amount=1):
+        pass
+
+NULL_METRICS = NullMetrics()
+_local = threading.local()  # .metrics: the request handled by the current thread
+
+def current():
+    """
+    Returns the metrics of the request handled by the calling thread.
+
+    Returns:
+        RequestMetrics: The request metrics, or NULL_METRICS outside of a request.
+    """
+    return getattr(_local, "metrics", None) or NULL_METRICS
+
+class MetricsRegistry:
+    """
+    Server-wide aggregation of the request metrics, returned by the STATS command.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()                # Serializes updates from the request threads
+        self.started = time.time()                  # When the server started
+        self.requests = {}                          # Request type -> count
+        self.errors = 0                             # Failed requests
+        self.bytes_sent = 0                         # Bytes written to clients
+        self.results = 0                            # Results returned
+        self.stages = dict.fromkeys(STAGES, 0.0)    # Stage -> total seconds
+        self.formats = {}                           # Extension -> counters summed over all requests
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # Durations of the recent requests
+
+    def begin(self, kind):
+        """
+        Starts measuring a request handled by the calling thread.
+
+        Args:
+            kind (str): The request type.
+
+        Returns:
+            RequestMetrics: The metrics of the new request.
+        """
+        metrics = RequestMetrics(kind)
+        _local.metrics = metrics
+        return metrics
+
+    def finish(self, metrics):
+        """
+        Adds the metrics of a finished request to the totals.
+
+        Args:
+            metrics (RequestMetrics): The request metrics returned by begin().
+        """
+        _local.metrics = None
+        duration = time.perf_counter() - metrics.started
+        with self.lock:
+            self.requests[metrics.kind] = self.requests.get(metrics.kind, 0) + 1
+            self.errors += metrics.error
+            self.bytes_sent += metrics.bytes_sent
+            self.results += metrics.results
+            for stage, seconds in metrics.stages.items():
+                self.stages[stage] += seconds
+            for extension, counters in metrics.formats.items():
+                totals = self.formats.setdefault(extension, {"files": 0, "matches": 0, "extracted": 0, "snapshot": 0})
+                for field, value in counters.items():
+                    totals[field] += value
+            self.latencies.append(duration)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # One aggregated record per request instead of one per match
+            logging.debug(f"Request metrics: {json.dumps(metrics.to_dict())}")
+
+    def snapshot(self):
+        """
+        Returns the aggregated metrics.
+
+        Returns:
+            dict: Request counts, latency percentiles, stage totals, bytes sent and per-format counters.
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            total = sum(self.requests.values())
+            percentile = lambda fraction: round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3) if latencies else None
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "requests": dict(self.requests),
+                "total_requests": total,
+                "errors": self.errors,
+                "bytes_sent": self.bytes_sent,
+                "results": self.results,
+                "latency_ms": {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99),
+                               "window": len(latencies)},
+                "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+                "formats": {extension: dict(counters) for extension, counters in self.formats.items()}
+            }
+
+def start_dump_thread(collect, path, interval, stopped):
+    """
+    Appends a snapshot of the server statistics to a JSON-lines file every interval seconds.
+
+    Args:
+        collect (callable): Returns the statistics to dump (a JSON-serializable dict).
+        path (str): The file the snapshots are appended to.
+        interval (float): Seconds between two dumps.
+        stopped (threading.Event): Ends the thread when set.
+
+    Returns:
+        threading.Thread: The started daemon thread.
+    """
+    def dump():
+        while not stopped.wait(interval):
+            try:
+                snapshot = dict(collect(), time=time.strftime("%Y-%m-%dT%H:%M:%S"))
+                with open(path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(snapshot) + "\n")
+            except Exception as e:
+                logging.error(f"Error writing metrics to {path}: {e}")
+
+    thread = threading.Thread(target=dump, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,50 @@
+# pack.py
+
+import argparse             # For command-line options
+import os                   # For the corpus root
+import glob                 # To list the files of the searched folders
+import time                 # To report how long packing took
+import server               # The folders, extractors and snapshot location of the server
+from snapshot import write_snapshot  # Writer of the packed snapshot format
+
+def list_files():
+    """
+    Lists the files packed into the snapshot: every file of the searched folders, except the
+    large TXT files that the server scans in place anyway.
+
+    Returns:
+        list: (file_path, extension) tuples, sorted by type then path.
+    """
+    files = []
+    for extension, folder in server.FOLDERS.items():
+        for file_path in sorted(glob.glob(os.path.join(folder, f"*{extension}"))):
+            if not server.is_large_txt(file_path, extension):
+                files.append((file_path, extension))
+    return files
+
+def main():
+    """
+    Parses the command line, extracts the searched folders and writes the snapshot.
+    """
+    parser = argparse.ArgumentParser(description="Pack the text of the searched folders into a snapshot for the server.")
+    parser.add_argument("--root", default=".", help="Directory containing the data/ folders")
+    parser.add_argument("--output", default=server.SNAPSHOT_FILE, help="Snapshot file to write (relative to --root)")
+    parser.add_argument("--workers", type=int, default=server.SCAN_WORKERS, help="Extraction worker processes")
+    args = parser.parse_args()
+
+    os.chdir(args.root)  # FOLDERS are relative paths, and the snapshot is keyed by them
+    server.set_scan_workers(args.workers)
+    started = time.perf_counter()
+    files = list_files()
+    try:
+        packed, errors = write_snapshot(args.output, files, server.get_units_many,
+                                        batch_size=max(16, 2 * args.workers))
+    finally:
+        server.set_scan_workers(1)  # Stops the worker processes
+    for file_path, error in errors:
+        print(f"[Pack] Skipped {file_path}: {error}")
+    print(f"[Pack] {packed} of {len(files)} files, {os.path.getsize(args.output)} bytes "
+          f"written to {args.output} in {time.perf_counter() - started:.2f} s")
+
+if __name__ == "__main__":
+    main()  # Execute the main function when the script is run directly
@@ -0,0 +1,276 @@
+# protocol.py
+
+import asyncio              # For reading requests in the asyncio server
+import json                 # Frame payloads are JSON documents
+import select               # To wait briefly for the rest of an ambiguous request prefix
+import socket               # For the MSG_PEEK flag
+import struct               # To pack and unpack the frame header
+
+# Every frame starts with MAGIC, the protocol version and the payload length (big-endian).
+# 0xFF never occurs in UTF-8 text, so no legacy "target|keyword|ext" request can start like a frame
+MAGIC = b"\xffSAE"
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct("!4sBI")
+
+MAX_REQUEST_SIZE = 16 * 1024 * 1024     # Largest frame the server accepts from a client
+MAX_RESPONSE_SIZE = 1024 * 1024 * 1024  # Largest frame the client accepts from the server
+LEGACY_MAX_SIZE = 65536                 # Largest unframed "target|keyword|ext" request read at once
+PREFIX_WAIT = 0.2                       # Seconds to wait when a request starts like MAGIC but is shorter
+
+class ProtocolError(Exception):
+    """
+    Raised when a peer sends a malformed or unsupported frame.
+    """
+
+def encode_frame(message):
+    """
+    Serializes a message into a frame.
+
+    Args:
+        message (dict): The message to send.
+
+    Returns:
+        bytes: The header followed by the JSON payload.
+    """
+    payload = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, len(payload)) + payload
+
+def decode_header(header, max_size):
+    """
+    Validates a frame header.
+
+    Args:
+        header (bytes): The HEADER.size bytes of the header.
+        max_size (int): The largest payload accepted.
+
+    Returns:
+        int: The length of the payload that follows.
+    """
+    magic, version, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("Invalid frame header")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    if length > max_size:
+        raise ProtocolError(f"Frame too large: {length} bytes")
+    return length
+
+def decode_payload(payload):
+    """
+    Deserializes a frame payload.
+
+    Args:
+        payload (bytes): The JSON payload.
+
+    Returns:
+        dict: The decoded message.
+    """
+    try:
+        message = json.loads(payload.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ProtocolError(f"Invalid frame payload: {e}")
+    if not isinstance(message, dict):
+        raise ProtocolError("Frame payload must be a JSON object")
+    return message
+
+def recv_exactly(sock, size):
+    """
+    Reads exactly size bytes from a socket.
+
+    Args:
+        sock (socket.socket): The socket to read from.
+        size (int): The number of bytes to read.
+
+    Returns:
+        bytes: The data, or None if the connection was closed before the first byte.
+    """
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            if remaining == size:
+                return None  # Clean end of stream
+            raise ProtocolError("Connection closed in the middle of a frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def send_message(sock, message):
+    """
+    Sends a message as a single frame.
+
+    Args:
+        sock (socket.socket): The socket to write to.
+        message (dict): The message to send.
+
+    Returns:
+        int: The number of bytes sent.
+    """
+    frame = encode_frame(message)
+    sock.sendall(frame)
+    return len(frame)
+
+def recv_message(sock, max_size=MAX_RESPONSE_SIZE):
+    """
+    Receives one framed message.
+
+    Args:
+        sock (socket.socket): The socket to read from.
+        max_size (int): The largest payload accepted.
+
+    Returns:
+        dict: The decoded message, or None if the connection was closed.
+    """
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    payload = recv_exactly(sock, decode_header(header, max_size))
+    if payload is None:
+        raise ProtocolError("Connection closed in the middle of a frame")
+    return decode_payload(payload)
+
+async def recv_message_async(reader, max_size=MAX_RESPONSE_SIZE):
+    """
+    Receives one framed message from an asyncio StreamReader (e.g. a server's answer to the
+    coordinator).
+
+    Args:
+        reader (asyncio.StreamReader): The stream to read from.
+        max_size (int): The largest payload accepted.
+
+    Returns:
+        dict: The decoded message, or None if the connection was closed.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None  # Clean end of stream
+        raise ProtocolError("Connection closed in the middle of a frame")
+    try:
+        payload = await reader.readexactly(decode_header(header, max_size))
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Connection closed in the middle of a frame")
+    return decode_payload(payload)
+
+def decode_legacy(data):
+    """
+    Decodes an unframed request.
+
+    Args:
+        data (bytes): The request as received.
+
+    Returns:
+        str: The request text, or None if it is not valid UTF-8 (the server answers it with
+            an error, and the connection stays usable since legacy requests are not framed).
+    """
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+def recv_request(sock):
+    """
+    Receives a client request, accepting both frames and legacy unframed text.
+
+    Args:
+        sock (socket.socket): The client socket.
+
+    Returns:
+        tuple: (True, dict) for a framed request, (False, str) for a legacy request (None
+               instead of the text if it is not valid UTF-8), or None if the connection was closed.
+    """
+    head = sock.recv(len(MAGIC), socket.MSG_PEEK)
+    if not head:
+        return None
+    if len(head) < len(MAGIC) and MAGIC.startswith(head):
+        # Could be the start of a frame still in transit: give it a moment to arrive
+        readable, _, _ = select.select([sock], [], [], PREFIX_WAIT)
+        if readable:
+            head = sock.recv(len(MAGIC), socket.MSG_PEEK)
+    if head == MAGIC:
+        return True, recv_message(sock, MAX_REQUEST_SIZE)
+    return False, decode_legacy(sock.recv(LEGACY_MAX_SIZE))
+
+def format_result_line(result):
+    """
+    Formats a structured result the same way the legacy protocol does.
+
+    Args:
+        result (dict): A result from a "results" message.
+
+    Returns:
+        str: The formatted result line.
+    """
+    if "message" in result:
+        return result["message"]
+    if result.get("location"):
+        line = f"{result['number']} - {result['file']} - {result['location']}: {result['text']}"
+    else:
+        line = f"{result['number']} - {result['file']} - {result['text']}"
+    if "score" in result:
+        return f"{line} (score {result['score']:.3f})"  # Results of a ranked search
+    return line
+
+class AsyncRequestReader:
+    """
+    Reads client requests (framed or legacy) from an asyncio StreamReader.
+
+    Bytes received after the current request are kept in an internal buffer, so pipelined
+    frames are not lost.
+    """
+
+    def __init__(self, reader):
+        """
+        Args:
+            reader (asyncio.StreamReader): The client stream.
+        """
+        self.reader = reader    # Underlying stream
+        self.buffer = b""       # Bytes received but not consumed yet
+
+    async def _fill(self):
+        """
+        Reads more data into the buffer.
+
+        Returns:
+            bool: False if the connection was closed.
+        """
+        data = await self.reader.read(65536)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    async def _take(self, size):
+        """
+        Consumes exactly size bytes from the stream.
+        """
+        while len(self.buffer) < size:
+            if not await self._fill():
+                raise ProtocolError("Connection closed in the middle of a frame")
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    async def read_request(self):
+        """
+        Receives the next request.
+
+        Returns:
+            tuple: (True, dict) for a framed request, (False, str) for a legacy request (None
+                   instead of the text if it is not valid UTF-8), or None if the connection was closed.
+        """
+        if not self.buffer and not await self._fill():
+            return None
+        if len(self.buffer) < len(MAGIC) and MAGIC.startswith(self.buffer):
+            # Could be the start of a frame still in transit: give it a moment to arrive
+            try:
+                await asyncio.wait_for(self._fill(), PREFIX_WAIT)
+            except asyncio.TimeoutError:
+                pass
+        if self.buffer.startswith(MAGIC):
+            length = decode_header(await self._take(HEADER.size), MAX_REQUEST_SIZE)
+            return True, decode_payload(await self._take(length))
+        # Legacy clients send each request in a single write and wait for the answer
+        data, self.buffer = self.buffer[:LEGACY_MAX_SIZE], self.buffer[LEGACY_MAX_SIZE:]
+        return False, decode_legacy(data)
@@ -0,0 +1,131 @@
+# ranking.py
+
+import math                 # For the BM25 inverse document frequency
+import heapq                # To keep only the best results while scanning
+from index import tokenize  # Units are measured in index terms
+
+# BM25 parameters
+BM25_K1 = 1.2               # Term frequency saturation
+BM25_B = 0.75               # Strength of the unit length normalization
+PARTIAL_MATCH_WEIGHT = 0.5  # Weight of an occurrence inside a longer word (a whole-word occurrence counts 1)
+
+def is_word_char(char):
+    """
+    Tells whether a character belongs to an index term (same definition as \\w).
+    """
+    return char.isalnum() or char == "_"
+
+def occurrence_weight(text, start, end):
+    """
+    Weighs one occurrence of a keyword: whole words count fully, parts of longer words less.
+
+    Args:
+        text (str): The text containing the occurrence.
+        start (int): The start offset of the occurrence.
+        end (int): The end offset of the occurrence.
+
+    Returns:
+        float: 1.0 or PARTIAL_MATCH_WEIGHT.
+    """
+    inside = (start > 0 and is_word_char(text[start - 1]) and is_word_char(text[start])) or \
+             (end < len(text) and end > start and is_word_char(text[end]) and is_word_char(text[end - 1]))
+    return PARTIAL_MATCH_WEIGHT if inside else 1.0
+
+def keyword_frequency(text, keyword, pattern=None):
+    """
+    Counts the weighted occurrences of a keyword in a text.
+
+    Args:
+        text (str): The text of the unit.
+        keyword (str): A literal keyword (ignored when pattern is given).
+        pattern (re.Pattern): A regex to count instead of the literal keyword, or None.
+
+    Returns:
+        float: The sum of the occurrence weights.
+    """
+    frequency = 0.0
+    if pattern is not None:
+        for match in pattern.finditer(text):
+            frequency += occurrence_weight(text, match.start(), match.end())
+        return frequency
+    if not keyword:
+        return frequency
+    start = text.find(keyword)
+    while start != -1:
+        frequency += occurrence_weight(text, start, start + len(keyword))
+        start = text.find(keyword, start + len(keyword))
+    return frequency
+
+class Scorer:
+    """
+    BM25 relevance of the units matching a query, every text unit (line, cell, ...) being
+    one document.
+
+    Corpus statistics come from the inverted index; without them (index disabled or empty)
+    every keyword gets the same weight and units are not normalized by length. Regex
+    keywords cannot be looked up in the index and always get an inverse document frequency of 1.
+    """
+
+    def __init__(self, plan, stats=None):
+        """
+        Args:
+            plan (QueryPlan): The compiled query.
+            stats (dict): Corpus statistics from InvertedIndex.corpus_stats, or None.
+        """
+        self.plan = plan
+        stats = stats or {}
+        self.average_length = stats.get("average_length") or 0.0  # Average unit length in terms
+        units = stats.get("units") or 0
+        frequencies = stats.get("frequencies") or {}
+        self.weights = []  # (keyword, pattern, idf) for every keyword of the query
+        for keyword in plan.keywords:
+            frequency = frequencies.get(keyword)
+            if units and frequency is not None:
+                idf = math.log(1 + (units - frequency + 0.5) / (frequency + 0.5))
+            else:
+                idf = 1.0
+            pattern = plan.pattern if not plan.literal else None  # Only single regex queries are non-literal
+            self.weights.append((keyword, pattern, idf))
+
+    def score(self, text):
+        """
+        Scores the text of a matching unit.
+
+        Args:
+            text (str): The text of the unit.
+
+        Returns:
+            float: The BM25 score (higher is more relevant).
+        """
+        if self.average_length:
+            length = len(tokenize(text)) or 1
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.average_length)
+        else:
+            norm = BM25_K1
+        score = 0.0
+        for keyword, pattern, idf in self.weights:
+            frequency = keyword_frequency(text, keyword, pattern)
+            if frequency:
+                score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return score
+
+def top_k(items, k, score):
+    """
+    Keeps the k best items of a stream in a heap, so memory stays O(k) whatever its length.
+
+    Args:
+        items (iterable): The items to rank.
+        k (int): The number of items kept.
+        score (callable): score(item) -> float, higher is better.
+
+    Returns:
+        list: (score, item) tuples, best first; equal scores keep the stream order.
+    """
+    heap = []  # Min-heap of (score, -sequence, item): the root is the worst item kept
+    for sequence, item in enumerate(items):
+        entry = (score(item), -sequence, item)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+    return [(item_score, item) for item_score, _, item in sorted(heap, key=lambda entry: entry[:2], reverse=True)]
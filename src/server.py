@@ -1,14 +1,38 @@
 # server.py
 
 import socket               # For network communication between client and server
+import asyncio              # For the event-loop server mode
+import argparse             # For command-line options
+import signal               # To stop the server on SIGINT/SIGTERM
+import select               # To poll the console without blocking shutdown
+import sys                  # For the console input stream
 import threading            # To handle multiple clients concurrently
+import queue                # Requests read ahead while the current one is answered
 import os                   # For interacting with the operating system (e.g., file paths)
 import glob                 # To find all the pathnames matching a specified pattern
-import PyPDF2               # To read and extract text from PDF files
-import openpyxl             # To read and manipulate Excel (.xlsx) files
+import mmap                 # To scan large text files without loading them into memory
 import re                   # For regular expression operations
-from bs4 import BeautifulSoup  # To parse and extract data from HTML files
+import codecs               # To check the encoding of large text files in chunks
+from html.parser import HTMLParser  # To extract the text of HTML files while reading them
 import logging              # For logging server activities and errors
+import itertools            # To cut result streams into pages
+import time                 # To flush streamed result batches regularly
+import multiprocessing      # For the start method of the scan worker processes
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor  # Worker pools for scans and searches
+from collections import namedtuple  # For the immutable compiled query plan
+import json                 # To serialize the statistics returned by the STATS command
+from protocol import recv_request, send_message, encode_frame, ProtocolError  # Framed wire protocol shared with the client
+from connection import (ENDING_MSG, STATS_MSG, LEGACY_ENCODING_ERROR, LEGACY_FORMAT_ERROR, truncation_message,  # Request parsing and connection
+                        get_page_bounds, get_target, parse_legacy, parse_cancel, serve_connection)              # loop shared with coordinator.py
+from index import InvertedIndex, is_literal  # Persistent inverted index over the searched folders
+from cache import ExtractionCache, ResultCache, file_signature, folder_version  # Extraction and result caches
+from metrics import MetricsRegistry, current as current_metrics, start_dump_thread  # Per-request stage timings and counters
+from watcher import FolderWatcher  # Background detection of new, changed and deleted files
+from ranking import Scorer, top_k  # BM25 relevance ranking of the results
+from sharding import shard_of, parse_shard, SHARD_MODES  # Split of the files between shard servers
+from snapshot import Snapshot, SnapshotUnits  # Packed, memory-mapped text units of the searched folders (see pack.py)
+from cancellation import (CancelToken, RequestCancelled, RequestTracker, CHECK_INTERVAL,  # Request deadlines and cancellation
+                          activate as activate_token, current as current_token)
 
 # Configure logging to output debug information to 'server.log'
 logging.basicConfig(
@@ -20,7 +44,21 @@ logging.basicConfig(
 # Define server constants
 HOST = '127.0.0.1'      # Server's IP address (localhost)
 PORT = 12345            # Port number where the server listens for connections
-ENDING_MSG = "q"        # Special message indicating client wants to terminate the connection
+
+# Connection handling settings
+SERVER_MODE = "asyncio"     # "asyncio" (one event loop) or "threaded" (one thread per connection)
+ACCEPT_BACKLOG = 128        # Pending connections queued by the operating system
+MAX_CONNECTIONS = 1000      # Connections served at once in asyncio mode; extra ones are refused
+SEARCH_THREADS = 8          # Searches running at once in asyncio mode (the rest wait for a thread)
+SHUTDOWN_GRACE = 5.0        # Seconds given to in-flight requests when the server stops
+
+# Deadline settings
+REQUEST_TIMEOUT = 30.0      # Seconds a search may run before it returns what it found so far (0 for no limit)
+REQUEST_MAX_TIMEOUT = 600.0 # Largest "timeout" a request may ask for
+
+# Result streaming settings
+STREAM_BATCH_SIZE = 200     # Results per streamed batch frame
+STREAM_BATCH_DELAY = 0.1    # Seconds after which a partial batch is sent anyway
 
 # Mapping of file extensions to their corresponding directories
 FOLDERS = {
@@ -30,6 +68,63 @@ FOLDERS = {
     ".xlsx": "data/excel/"
 }
 
+# Inverted index settings
+USE_INDEX = True                        # Answer ALL searches from the index instead of scanning every file
+INDEX_FILE = "data/search_index.pkl"    # Where the index is persisted between server runs
+TRIGRAM_INDEX = True                    # Also index the trigrams of every unit, so regex queries skip the units lacking their literals
+
+# Sharding settings (several servers behind coordinator.py, each searching a share of the files)
+SHARD = None                # (index, count) when this server is one shard, None to search every file
+SHARD_BY = "hash"           # "hash" (files spread by name) or "format" (each file type on one shard)
+
+# Snapshot settings (written offline by pack.py)
+USE_SNAPSHOT = True                     # Read the units of unchanged files from the snapshot instead of extracting them
+SNAPSHOT_FILE = "data/corpus.snapshot"  # Where pack.py writes the snapshot and the server maps it from
+
+# Folder watcher settings
+WATCH_FOLDERS = True        # Keep the index and caches up to date from a background thread instead of on every query
+WATCH_BACKEND = "auto"      # "inotify", "poll" (mtime/size scans) or "auto" (inotify when available)
+WATCH_RATE = 5.0            # Changed files re-extracted per second at most, so ingestion leaves CPU to the searches
+WATCH_SETTLE = 0.5          # Seconds a file must stay unchanged before it is re-extracted (e.g. while it is copied)
+WATCH_POLL_INTERVAL = 2.0   # Seconds between two folder scans with the polling backend
+
+# Ranked search settings
+RANK_TOP_K = 100            # Results returned by a ranked search unless the request sets "k"
+RANK_MAX_K = 10000          # Largest "k" accepted (memory held by a ranked search is proportional to it)
+
+# Batch request settings
+BATCH_MAX_QUERIES = 100     # Largest number of queries in one batch request
+
+# Extraction cache settings
+EXTRACTION_CACHE_BYTES = 256 * 1024 * 1024  # Memory budget for cached text units
+EXTRACTION_SPILL_DIR = None                 # Directory for evicted entries (e.g. "data/.cache"), None to disable
+
+# Result cache settings
+RESULT_CACHE_ENTRIES = 256          # Result lists (or their first pages) kept for repeated queries
+RESULT_CACHE_TTL = 300.0            # Seconds before a cached result list expires
+RESULT_CACHE_MAX_RESULTS = 10000    # Only the first results of larger result lists are cached
+
+# Large text file settings
+MMAP_THRESHOLD = 16 * 1024 * 1024   # TXT files from this size are memory-mapped and scanned in place
+NEWLINE_COUNT_CHUNK = 16 * 1024 * 1024  # Bytes copied at a time when counting lines up to a hit
+ENCODING_CHECK_CHUNK = 16 * 1024 * 1024 # Bytes read at a time when checking that a large TXT file is valid UTF-8
+LINE_BREAK_RE = re.compile(rb"\r\n|\r|\n")  # Line breaks as universal newlines (text mode) reads them
+
+# HTML extraction settings
+HTML_CHUNK_SIZE = 64 * 1024                 # Characters fed to the HTML parser at a time
+HTML_SKIPPED_TAGS = {"script", "style"}     # Elements whose content is not searchable text
+
+# Metrics settings
+METRICS_DUMP_INTERVAL = 60.0            # Seconds between two dumps of the statistics (0 disables the dumps)
+METRICS_DUMP_FILE = "server_metrics.jsonl"  # File the periodic dumps are appended to (one JSON object per line)
+
+# Parallel scan settings
+SCAN_WORKERS = os.cpu_count() or 1  # Worker processes used to extract files (1 keeps extraction in the request thread)
+PDF_PAGES_PER_TASK = 20     # Largest number of PDF pages extracted by one worker task
+# Bytes of a file type left to extract in one batch from which the workers are used; smaller
+# batches, and TXT files (cheaper to read than to send back from a worker), stay in the request thread
+SCAN_POOL_MIN_BYTES = {".pdf": 16 * 1024, ".xlsx": 16 * 1024, ".html": 256 * 1024}
+
 def parse_keywords(keyword):
     """
     Parses the input keyword string to identify logical operators (AND/OR) or regex patterns.
@@ -84,318 +179,2647 @@ def matches_with_operator(line, keywords, operator, is_regex):
         return re.search(keywords[0], line) if is_regex else keywords[0] in line
     return False  # Default to False if operator is unrecognized
 
-def search_txt(file_path, keyword):
+class QueryPlan(namedtuple("QueryPlan", ["query", "keywords", "operator", "is_regex", "literal", "pattern",
+                                         "sheets", "columns"], defaults=(None, None))):
     """
-    Searches for keywords within a TXT file.
+    Immutable, compiled form of a search query, built once per request and shared by every
+    file and file type searched for that request.
+    
+    Fields:
+        query (str): The original keyword string.
+        keywords (tuple): The parsed keywords (AND keywords are ordered most selective first).
+        operator (str): The logical operator ('OR', 'AND', or 'SINGLE').
+        is_regex (bool): Whether the keywords are regex patterns.
+        literal (bool): Whether every keyword behaves as a plain substring.
+        pattern (re.Pattern): The single compiled matcher, or None when substring tests are used.
+        sheets (frozenset): The Excel sheet names to search, or None for every sheet.
+        columns (frozenset): The Excel column numbers (from 1) to search, or None for every column.
+    """
+    __slots__ = ()
+
+    def matches(self, text):
+        """
+        Determines if a text unit matches the plan (same semantics as matches_with_operator).
+        
+        Args:
+            text (str): The text to be evaluated.
+            
+        Returns:
+            bool: True if the text matches the query, False otherwise.
+        """
+        if self.pattern is not None:
+            # Regex and OR queries are answered by a single precompiled search
+            return self.pattern.search(text) is not None
+        if self.operator == "AND":
+            # Keywords are ordered so the one most likely to fail is tested first
+            for kw in self.keywords:
+                if kw not in text:
+                    return False
+            return True
+        return self.keywords[0] in text
+
+    def accepts(self, location):
+        """
+        Applies the sheet/column filters to the location of a unit.
+        Only Excel locations (sheet, row, column) are filtered.
+        
+        Args:
+            location (tuple): The location of the unit.
+            
+        Returns:
+            bool: True if the unit must be searched.
+        """
+        if len(location) != 3:
+            return True
+        if self.sheets is not None and location[0] not in self.sheets:
+            return False
+        return self.columns is None or location[2] in self.columns
+
+    def has_filters(self):
+        """
+        Tells whether the plan restricts the Excel cells searched.
+        """
+        return self.sheets is not None or self.columns is not None
+
+    def cache_key(self):
+        """
+        Returns a normalized key identifying what the plan matches.
+        
+        Returns:
+            tuple: Equal for plans that match exactly the same units.
+        """
+        filters = (tuple(sorted(self.sheets)) if self.sheets is not None else None,
+                   tuple(sorted(self.columns)) if self.columns is not None else None)
+        if self.operator in ("AND", "OR"):
+            # The order of AND/OR keywords does not change which units match
+            return self.operator, self.is_regex, tuple(sorted(set(self.keywords))), filters
+        return self.operator, self.is_regex, self.keywords, filters
+
+def column_number(column):
+    """
+    Converts an Excel column reference to its number.
     
     Args:
-        file_path (str): The path to the TXT file.
-        keyword (str): The keyword or regex pattern to search for.
+        column (int or str): A column number (from 1) or letters such as "A" or "AB".
         
     Returns:
-        list: A list of formatted strings indicating where matches were found.
+        int: The column number.
     """
-    results = []              # Initialize an empty list to store search results
-    count = 1                 # Initialize a counter for numbering results
-    keywords, operator, is_regex = parse_keywords(keyword)  # Parse the keyword string
+    if isinstance(column, int) and not isinstance(column, bool) and column >= 1:
+        return column
+    if isinstance(column, str):
+        column = column.strip()
+        if column.isdigit() and int(column) >= 1:
+            return int(column)
+        if column.isalpha() and column.isascii():
+            number = 0
+            for letter in column.upper():
+                number = number * 26 + ord(letter) - ord("A") + 1
+            return number
+    raise ValueError(f"Invalid column: {column!r}")
+
+def compile_query(keyword, sheets=None, columns=None):
+    """
+    Compiles a keyword string into a QueryPlan.
+    
+    Args:
+        keyword (str): The keyword string input by the user.
+        sheets (list): Excel sheet names to restrict the search to, or None for every sheet.
+        columns (list): Excel columns (numbers or letters) to restrict the search to, or None for every column.
+        
+    Returns:
+        QueryPlan: The compiled plan.
+    """
+    if sheets is not None or columns is not None:
+        plan = compile_query(keyword)
+        return plan._replace(sheets=frozenset(str(sheet) for sheet in sheets) if sheets is not None else None,
+                             columns=frozenset(column_number(c) for c in columns) if columns is not None else None)
+    if " OR " in keyword:
+        keywords = tuple(kw.strip() for kw in keyword.split(" OR "))
+        # All alternatives are folded into one alternation, so each line is scanned once
+        pattern = re.compile("|".join(re.escape(kw) for kw in keywords))
+        return QueryPlan(keyword, keywords, "OR", False, True, pattern)
+    elif " AND " in keyword:
+        # Longer keywords are rarer, so testing them first rejects most lines early
+        keywords = tuple(sorted((kw.strip() for kw in keyword.split(" AND ")), key=len, reverse=True))
+        return QueryPlan(keyword, keywords, "AND", False, True, None)
 
-    logging.debug(f"Searching in file: {file_path} with keywords={keywords}, operator={operator}, is_regex={is_regex}")
+    keywords = (keyword.strip(),)
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()  # Read all lines from the TXT file
-            for line_num, line in enumerate(lines, start=1):
-                if matches_with_operator(line, keywords, operator, is_regex):
-                    # If the line matches the search criteria, log the match and add to results
-                    logging.debug(f"Match found in {file_path} on line {line_num}: {line.strip()}")
-                    results.append(f"{count} - {os.path.basename(file_path)} - Line {line_num}: {line.strip()}")
-                    count += 1
-    except Exception as e:
-        # Log any errors encountered while reading the TXT file
-        logging.error(f"Error reading TXT file {file_path}: {e}")
+        pattern = re.compile(keywords[0])  # Compiled once and reused for every line
+    except re.error:
+        # Not a valid regex: fall back to a plain substring test
+        return QueryPlan(keyword, keywords, "SINGLE", False, True, None)
+    if is_literal(keywords[0]):
+        # A pattern without metacharacters matches exactly like a substring test, which is faster
+        return QueryPlan(keyword, keywords, "SINGLE", True, True, None)
+    return QueryPlan(keyword, keywords, "SINGLE", True, False, pattern)
 
-    if not results:
-        # Log if no matches were found in the file
-        logging.debug(f"No matches found in file: {file_path}")
-    return results  # Return the list of results
+def get_plan(keyword):
+    """
+    Returns the compiled plan of a keyword, compiling it only if needed.
+    
+    Args:
+        keyword (str or QueryPlan): The keyword string or an already compiled plan.
+        
+    Returns:
+        QueryPlan: The compiled plan.
+    """
+    return keyword if isinstance(keyword, QueryPlan) else compile_query(keyword)
 
-def search_pdf(file_path, keyword):
+def extract_txt_units(file_path):
     """
-    Searches for keywords within a PDF file.
+    Extracts the searchable text units (lines) of a TXT file.
     
     Args:
-        file_path (str): The path to the PDF file.
-        keyword (str): The keyword or regex pattern to search for.
+        file_path (str): The path to the TXT file.
         
     Returns:
-        list: A list of formatted strings indicating where matches were found.
+        list: A list of (location, text) tuples, where location is (line_num,).
     """
-    results = []              # Initialize an empty list to store search results
-    count = 1                 # Initialize a counter for numbering results
-    keywords, operator, is_regex = parse_keywords(keyword)  # Parse the keyword string
+    units = []  # Initialize an empty list to store the extracted units
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line_num, line in enumerate(file, start=1):
+            units.append(((line_num,), line))  # Keep the raw line so matching is unchanged
+    return units
 
-    try:
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)  # Create a PDF reader object
-            for page_num, page in enumerate(reader.pages, start=1):
-                text = page.extract_text()    # Extract text from the current page
-                if not text:
-                    continue  # Skip if no text is found on the page
-                lines = text.split('\n')       # Split the extracted text into lines
-                for line_num, line in enumerate(lines, start=1):
-                    if matches_with_operator(line, keywords, operator, is_regex):
-                        # If the line matches the search criteria, add to results
-                        results.append(f"{count} - {os.path.basename(file_path)} - Page {page_num}, Line {line_num}: {line.strip()}")
-                        count += 1
-    except Exception as e:
-        # Log any errors encountered while reading the PDF file
-        logging.error(f"Error reading PDF file {file_path}: {e}")
+def count_newlines(buffer, start, end, carriage_returns=True):
+    """
+    Counts the line breaks of a memory-mapped file between two offsets, in bounded chunks.
+    Like universal newlines, b"\r\n", b"\r" and b"\n" each end a line.
+    
+    Args:
+        buffer (mmap.mmap): The mapped file.
+        start (int): The first offset (inclusive), at the start of a line.
+        end (int): The last offset (exclusive), at the start of a line.
+        carriage_returns (bool): False if the file is known to contain no b"\r".
+        
+    Returns:
+        int: The number of line breaks in the range.
+    """
+    count = 0
+    for chunk_start in range(start, end, NEWLINE_COUNT_CHUNK):
+        chunk_end = min(chunk_start + NEWLINE_COUNT_CHUNK, end)
+        chunk = buffer[chunk_start:chunk_end]
+        count += chunk.count(b"\n")
+        chunk_returns = chunk.count(b"\r") if carriage_returns else 0
+        if chunk_returns:
+            count += chunk_returns - chunk.count(b"\r\n")
+            if chunk.endswith(b"\r") and chunk_end < end and buffer[chunk_end:chunk_end + 1] == b"\n":
+                count -= 1  # A b"\r\n" split between two chunks
+    return count
 
-    return results  # Return the list of results
+_valid_large_txt = {}                   # Path -> (signature, contains b"\r") of the large TXT files found to be valid UTF-8
+_valid_large_txt_lock = threading.Lock()  # Protects the checked files
 
-def search_html(file_path, keyword):
+def check_txt_encoding(file_path):
     """
-    Searches for keywords within an HTML file.
+    Checks that a large TXT file is valid UTF-8, reading it in bounded chunks. Extracting
+    a smaller file fails on invalid bytes, so a scanned one must fail the same way instead
+    of returning partial or mangled lines. The outcome is kept until the file changes.
     
     Args:
-        file_path (str): The path to the HTML file.
-        keyword (str): The keyword or regex pattern to search for.
+        file_path (str): The path to the TXT file.
         
     Returns:
-        list: A list of formatted strings indicating where matches were found.
+        bool: Whether the file contains carriage returns (lines not only ending in b"\n").
+        
+    Raises:
+        UnicodeDecodeError: If the file is not valid UTF-8.
     """
-    results = []              # Initialize an empty list to store search results
-    count = 1                 # Initialize a counter for numbering results
-    keywords, operator, is_regex = parse_keywords(keyword)  # Parse the keyword string
+    signature = file_signature(file_path)
+    with _valid_large_txt_lock:
+        checked = _valid_large_txt.get(file_path)
+    if checked is not None and checked[0] == signature:
+        return checked[1]
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    token = current_token()
+    carriage_returns = False
+    with open(file_path, 'rb') as file:
+        while True:
+            chunk = file.read(ENCODING_CHECK_CHUNK)
+            if not chunk:
+                break
+            token.check()
+            # ASCII chunks are valid, unless they complete a character cut at the previous chunk
+            if not chunk.isascii() or decoder.getstate()[0]:
+                decoder.decode(chunk)
+            carriage_returns = carriage_returns or b"\r" in chunk
+    decoder.decode(b"", final=True)
+    with _valid_large_txt_lock:
+        _valid_large_txt[file_path] = (signature, carriage_returns)
+    return carriage_returns
 
-    try:
+def literal_anchor(plan):
+    """
+    Compiles the bytes pattern locating the candidate text of a literal query in UTF-8 data
+    (UTF-8 keeps substrings intact, so every match of the query contains a match of the anchor).
+    
+    Args:
+        plan (QueryPlan): The compiled query, with plan.literal set.
+        
+    Returns:
+        re.Pattern: A bytes pattern; the decoded text around each match still has to be checked.
+    """
+    if plan.operator == "AND":
+        # Anchor on the most selective keyword; the decoded text is checked against all of them
+        return re.compile(re.escape(plan.keywords[0].encode('utf-8')))
+    return re.compile(b"|".join(re.escape(kw.encode('utf-8')) for kw in plan.keywords))
+
+def scan_txt_mmap(file_path, plan):
+    """
+    Searches a large TXT file at the byte level without loading it into memory.
+    
+    Literal queries are searched with a bytes pattern directly in the memory-mapped file
+    (UTF-8 keeps substrings intact), and only the lines containing a hit are decoded and
+    numbered. Regex patterns can match differently on bytes than on text, so for them the
+    file is streamed line by line instead of being read all at once. Either way lines end
+    and are numbered as extract_txt_units reads them (universal newlines), and a file that
+    is not valid UTF-8 fails as its extraction would (see check_txt_encoding).
+    
+    Args:
+        file_path (str): The path to the TXT file.
+        plan (QueryPlan): The compiled query.
+        
+    Yields:
+        tuple: (location, text) for each matching line, with location = (line_num,).
+    """
+    token = current_token()  # Checked every CHECK_INTERVAL lines (or hits), so a cut request stops mid-file
+    carriage_returns = check_txt_encoding(file_path)
+    if not plan.literal:
         with open(file_path, 'r', encoding='utf-8') as file:
-            soup = BeautifulSoup(file, 'html.parser')  # Parse the HTML content
-            for tag in soup.find_all(text=True):       # Iterate through all text elements
-                tag_text = tag.strip()                 # Remove leading/trailing whitespace
-                if not tag_text:
-                    continue  # Skip empty text
-                if matches_with_operator(tag_text, keywords, operator, is_regex):
-                    # If the text matches the search criteria, add to results
-                    results.append(f"{count} - {os.path.basename(file_path)} - {tag_text}")
-                    count += 1
-    except Exception as e:
-        # Log any errors encountered while reading the HTML file
-        logging.error(f"Error reading HTML file {file_path}: {e}")
+            for line_num, line in enumerate(file, start=1):
+                if not line_num % CHECK_INTERVAL:
+                    token.check()
+                if plan.matches(line):
+                    yield (line_num,), line
+        return
 
-    return results  # Return the list of results
+    anchor = literal_anchor(plan)
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return  # Empty files cannot be mapped
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            size = len(buffer)
+            line_num = 1      # Line number at offset counted_to
+            counted_to = 0    # Offset up to which line breaks have been counted
+            position = 0
+            countdown = CHECK_INTERVAL
+            while position < size:
+                countdown -= 1
+                if not countdown:
+                    countdown = CHECK_INTERVAL
+                    token.check()
+                match = anchor.search(buffer, position)
+                if match is None:
+                    break
+                # The line starts after the last line break before the match (position is
+                # the start of a line, so the searches back stop there)
+                line_start = buffer.rfind(b"\n", position, match.start()) + 1
+                if carriage_returns:
+                    line_start = max(line_start, buffer.rfind(b"\r", position, match.start()) + 1)
+                line_start = max(position, line_start)
+                line_break = LINE_BREAK_RE.search(buffer, match.end())
+                line_end = size if line_break is None else line_break.end()
+                line = buffer[line_start:line_end].decode('utf-8')
+                if line_break is not None and line_break.group() != b"\n":
+                    line = line[:line_break.start() - line_end] + "\n"  # Translated like universal newlines
+                if plan.matches(line):
+                    line_num += count_newlines(buffer, counted_to, line_start, carriage_returns)
+                    counted_to = line_start
+                    yield (line_num,), line
+                position = line_end  # One result per line: continue on the next line
 
-def search_xlsx(file_path, keyword):
+def is_large_txt(file_path, extension):
     """
-    Searches for keywords within an Excel (XLSX) file.
+    Tells whether a file should go through the memory-mapped TXT scanner instead of being extracted.
     
     Args:
-        file_path (str): The path to the XLSX file.
-        keyword (str): The keyword or regex pattern to search for.
+        file_path (str): The path to the file.
+        extension (str): The file extension.
         
     Returns:
-        list: A list of formatted strings indicating where matches were found.
+        bool: True for TXT files of at least MMAP_THRESHOLD bytes.
     """
-    results = []              # Initialize an empty list to store search results
-    count = 1                 # Initialize a counter for numbering results
-    keywords, operator, is_regex = parse_keywords(keyword)  # Parse the keyword string
-
     try:
-        workbook = openpyxl.load_workbook(file_path, data_only=True)  # Load the Excel workbook
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]  # Select the current sheet
-            for row in sheet.iter_rows():
-                for cell in row:
-                    # Convert cell value to string if it's not None, else use empty string
-                    cell_value = str(cell.value) if cell.value else ""
-                    if matches_with_operator(cell_value, keywords, operator, is_regex):
-                        # If the cell matches the search criteria, add to results
-                        results.append(f"{count} - {os.path.basename(file_path)} - Sheet {sheet_name}, Cell ({cell.row}, {cell.column}): {cell_value}")
-                        count += 1
-    except Exception as e:
-        # Log any errors encountered while reading the Excel file
-        logging.error(f"Error reading Excel file {file_path}: {e}")
+        return extension == ".txt" and os.path.getsize(file_path) >= MMAP_THRESHOLD
+    except OSError:
+        return False
 
-    return results  # Return the list of results
+def extract_page_units(page, page_num):
+    """
+    Extracts the searchable text units (lines) of one PDF page.
+    
+    Args:
+        page (PyPDF2.PageObject): The page to extract.
+        page_num (int): The number of the page (1-based).
+        
+    Returns:
+        list: A list of (location, text) tuples, where location is (page_num, line_num).
+    """
+    text = page.extract_text()    # Extract text from the current page
+    if not text:
+        return []  # Skip if no text is found on the page
+    return [((page_num, line_num), line) for line_num, line in enumerate(text.split('\n'), start=1)]
 
-def search_all_files(folder, extension, keyword):
+def open_pdf(file):
     """
-    Searches for keywords within all files of a specific type in a given folder.
+    Creates a PDF reader. PyPDF2 is imported on the first call only: a server answering
+    from its snapshot or index never pays for the import.
     
     Args:
-        folder (str): The directory containing the files.
-        extension (str): The file extension to search for.
-        keyword (str): The keyword or regex pattern to search for.
-        
-    Returns:
-        list: A list of formatted strings indicating where matches were found or a message if no matches.
-    """
-    results = []  # Initialize an empty list to store search results
-    for file_path in glob.glob(os.path.join(folder, f"*{extension}")):
-        # Iterate through all files in the folder matching the extension
-        if extension == ".txt":
-            results.extend(search_txt(file_path, keyword))     # Search in TXT files
-        elif extension == ".pdf":
-            results.extend(search_pdf(file_path, keyword))     # Search in PDF files
-        elif extension == ".html":
-            results.extend(search_html(file_path, keyword))    # Search in HTML files
-        elif extension == ".xlsx":
-            results.extend(search_xlsx(file_path, keyword))    # Search in Excel files
-    return results if results else ["No matches found in any file."]  # Return results or a default message
+        file (file): The PDF file, opened in binary mode.
+        
+    Returns:
+        PyPDF2.PdfReader: The reader.
+    """
+    import PyPDF2  # To read and extract text from PDF files
+    return PyPDF2.PdfReader(file)
 
-def search_all_file_types(keyword):
+def extract_pdf_pages(file_path, page_numbers):
     """
-    Searches for keywords across all defined file types.
+    Extracts the text units of some pages of a PDF file, opening the document once.
     
     Args:
-        keyword (str): The keyword or regex pattern to search for.
+        file_path (str): The path to the PDF file.
+        page_numbers (list): The pages to extract (1-based).
         
     Returns:
-        list: A list of formatted strings indicating where matches were found or a message if no matches.
+        list: One (page_num, units) tuple per requested page, in the same order.
     """
-    results = []  # Initialize an empty list to store search results
-    for extension, folder in FOLDERS.items():
-        # Iterate through each file type and its corresponding folder
-        results.extend(search_all_files(folder, extension, keyword))  # Perform search
-    return results if results else ["No matches found in any file."]  # Return results or a default message
+    with open(file_path, 'rb') as file:
+        reader = open_pdf(file)  # Create a PDF reader object
+        return [(page_num, extract_page_units(reader.pages[page_num - 1], page_num)) for page_num in page_numbers]
 
-def handle_search(search_target, keyword, file_extension):
+def extract_pdf_units(file_path, first_page=1, last_page=None):
     """
-    Handles the search logic based on the target (ALL or specific file) and file extensions provided.
+    Extracts the searchable text units (page lines) of a PDF file.
     
     Args:
-        search_target (str): "ALL" to search all files or the name of a specific file.
-        keyword (str): The keyword or regex pattern to search for.
-        file_extension (str): Comma-separated file extensions to include in the search.
+        file_path (str): The path to the PDF file.
+        first_page (int): The first page to extract (1-based).
+        last_page (int): The last page to extract (inclusive), or None for the last page of the document.
         
     Returns:
-        list: A list of formatted strings indicating where matches were found or error messages.
+        list: A list of (location, text) tuples, where location is (page_num, line_num).
     """
-    # Split multiple extensions separated by commas and remove any extra whitespace
-    extensions = [ext.strip() for ext in file_extension.split(',') if ext.strip()] if file_extension else []
+    units = []  # Initialize an empty list to store the extracted units
+    with open(file_path, 'rb') as file:
+        reader = open_pdf(file)  # Create a PDF reader object
+        pages = reader.pages[first_page - 1:last_page]  # Only the requested page range
+        for page_num, page in enumerate(pages, start=first_page):
+            units.extend(extract_page_units(page, page_num))
+    return units
 
-    if search_target.upper() == "ALL":
-        # If the search target is "ALL", search across all or specified file types
-        if not extensions:
-            # If no specific extensions are provided, search across all defined file types
-            return search_all_file_types(keyword)
-        else:
-            # If specific extensions are provided, search only within those types
-            results = []
-            for ext in extensions:
-                folder = FOLDERS.get(ext)
-                if not folder:
-                    # If the file type is unsupported, add an error message to results
-                    results.append(f"Unsupported file type: {ext}")
-                else:
-                    # Perform search within the specified folder and extension
-                    res = search_all_files(folder, ext, keyword)
-                    if not res or (len(res) == 1 and res[0].startswith("No matches")):
-                        # If no results found for this extension, add a corresponding message
-                        res = [f"No matches found for file type: {ext}."]
-                    results.extend(res)
-            return results  # Return aggregated results
-    else:
-        # If the search target is a specific file
-        if len(extensions) > 1:
-            # If multiple extensions are provided for a single file search, return an error
-            return ["Error: Multiple extensions provided for a single file search."]
-        ext = extensions[0] if extensions else ""  # Get the single extension if available
-        folder = FOLDERS.get(ext)
-        if not folder:
-            # If the file type is unsupported, return an error message
-            return [f"Unsupported file type: {ext}"]
-        file_path = os.path.join(folder, search_target)  # Construct the full file path
-        if os.path.exists(file_path):
-            # If the file exists, perform the appropriate search based on its extension
-            if ext == ".txt":
-                return search_txt(file_path, keyword) or ["No matches found."]
-            elif ext == ".pdf":
-                return search_pdf(file_path, keyword) or ["No matches found."]
-            elif ext == ".html":
-                return search_html(file_path, keyword) or ["No matches found."]
-            elif ext == ".xlsx":
-                return search_xlsx(file_path, keyword) or ["No matches found."]
-        else:
-            # If the file does not exist, return an error message
-            return [f"File not found: {file_path}"]
+class HTMLTextParser(HTMLParser):
+    """
+    Event-driven HTML parser collecting the visible text nodes of a document.
+    
+    Unlike a BeautifulSoup tree, nothing but the current text node is kept: completed units
+    are handed out by take_units() while the document is still being fed in chunks.
+    The contents of script and style elements, comments and declarations are skipped.
+    """
 
-def handle_client(client_socket):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)  # Entities are decoded inside the text nodes
+        self.skipped_tag = None   # The script/style element being skipped, if any
+        self.pending = []         # Pieces of the current text node (it may span several chunks)
+        self.units = []           # Completed units not yet handed out
+
+    def take_units(self):
+        """
+        Hands out the units completed so far.
+        
+        Returns:
+            list: (location, text) tuples, where location is an empty tuple.
+        """
+        units, self.units = self.units, []
+        return units
+
+    def flush_text(self):
+        """
+        Ends the current text node; every tag, comment or declaration ends one.
+        """
+        if self.pending:
+            text = "".join(self.pending).strip()  # Remove leading/trailing whitespace
+            self.pending = []
+            if text:
+                self.units.append(((), text))
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_text()
+        if tag in HTML_SKIPPED_TAGS:
+            self.skipped_tag = tag
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush_text()  # A self-closing tag has no content to skip
+
+    def handle_endtag(self, tag):
+        self.flush_text()
+        if tag == self.skipped_tag:
+            self.skipped_tag = None
+
+    def handle_data(self, data):
+        if self.skipped_tag is None:
+            self.pending.append(data)
+
+    def handle_comment(self, data):
+        self.flush_text()
+
+    def handle_decl(self, decl):
+        self.flush_text()
+
+    def handle_pi(self, data):
+        self.flush_text()
+
+    def unknown_decl(self, data):
+        self.flush_text()  # CDATA sections and other unknown declarations
+
+    def close(self):
+        super().close()
+        self.flush_text()  # The document may end with a text node
+
+def iter_html_units(file_path):
     """
-    Handles communication with a connected client.
+    Streams the searchable text units (non-empty text nodes) of an HTML file.
+    The file is read in chunks of HTML_CHUNK_SIZE characters, so memory use is bounded by the
+    chunk size and the longest text node, not by the size of the document.
     
     Args:
-        client_socket (socket.socket): The client's socket connection.
+        file_path (str): The path to the HTML file.
+        
+    Yields:
+        tuple: (location, text), where location is an empty tuple.
     """
-    try:
+    parser = HTMLTextParser()
+    token = current_token()
+    with open(file_path, 'r', encoding='utf-8') as file:
         while True:
-            # Receive message from the client (max 1024 bytes)
-            client_msg = client_socket.recv(1024).decode('utf-8')
-            logging.debug(f"Received message: {client_msg}")
-            if client_msg == ENDING_MSG:
-                # If the client sends the termination message, break the loop to close connection
-                logging.debug("Termination message received. Closing connection.")
+            token.check()  # Between chunks
+            chunk = file.read(HTML_CHUNK_SIZE)
+            if not chunk:
                 break
-            try:
-                # Parse the received message assuming format: <search_target>|<keyword>|<file_extension>
-                search_target, keyword, file_extension = client_msg.split("|")
-                # Strip any leading/trailing whitespace from each component
-                search_target = search_target.strip()
-                keyword = keyword.strip()
-                file_extension = file_extension.strip()
-                logging.debug(f"Parsed: search_target={search_target}, keyword={keyword}, file_extension={file_extension}")
-                # Handle the search based on parsed components
-                results = handle_search(search_target, keyword, file_extension)
-                # Join the list of results into a single string separated by newlines
-                response = "\n".join(results)
-            except ValueError:
-                # If message format is incorrect, prepare an error message
-                response = "Invalid format. Use: <search_target>|<keyword>|<file_extension>"
-            # Send the response back to the client encoded in UTF-8
-            client_socket.send(response.encode('utf-8'))
-    except Exception as e:
-        # Log any unexpected errors while handling the client
-        logging.error(f"Error handling client: {e}")
+            parser.feed(chunk)
+            yield from parser.take_units()  # Text nodes completed by this chunk
+    parser.close()
+    yield from parser.take_units()
+
+def extract_html_units(file_path):
+    """
+    Extracts the searchable text units (non-empty text nodes outside script/style) of an HTML file.
+    
+    Args:
+        file_path (str): The path to the HTML file.
+        
+    Returns:
+        list: A list of (location, text) tuples, where location is an empty tuple.
+    """
+    return list(iter_html_units(file_path))
+
+def iter_xlsx_units(file_path, sheets=None, columns=None):
+    """
+    Streams the searchable text units (non-empty cells) of an Excel (XLSX) file.
+    The workbook is opened in read-only mode and read row by row as plain values, so no
+    cell objects are built and memory use does not grow with the size of the workbook.
+    
+    Args:
+        file_path (str): The path to the XLSX file.
+        sheets (set): The sheet names to read, or None for every sheet.
+        columns (set): The column numbers (from 1) to read, or None for every column.
+        
+    Yields:
+        tuple: (location, text), where location is (sheet_name, row, column).
+    """
+    import openpyxl  # Imported on first use, like PyPDF2 (see open_pdf)
+    token = current_token()
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)  # Stream the workbook
+    try:
+        max_col = max(columns) if columns else None  # Columns after the last wanted one are not read
+        for sheet_name in workbook.sheetnames:
+            if sheets is not None and sheet_name not in sheets:
+                continue  # Filtered sheets are skipped without reading their rows
+            sheet = workbook[sheet_name]  # Select the current sheet
+            # Stored dimensions can be missing or wrong; without them rows are read as stored
+            sheet.reset_dimensions()
+            for row_number, row in enumerate(sheet.iter_rows(max_col=max_col, values_only=True), start=1):
+                token.check()  # Between rows: reading a row costs more than the check
+                for column_number, value in enumerate(row, start=1):
+                    # Empty cells (None, "", 0) are skipped before any conversion, as before
+                    if not value:
+                        continue
+                    if columns is not None and column_number not in columns:
+                        continue
+                    yield (sheet_name, row_number, column_number), str(value)
     finally:
-        # Ensure the client socket is closed when done
-        client_socket.close()
-        logging.debug("Client connection closed.")
+        workbook.close()  # Read-only workbooks keep the file open until closed
 
-def main():
+def extract_xlsx_units(file_path):
     """
-    The main function to start the server, listen for incoming connections,
-    and handle client requests.
+    Extracts the searchable text units (non-empty cells) of an Excel (XLSX) file.
+    
+    Args:
+        file_path (str): The path to the XLSX file.
+        
+    Returns:
+        list: A list of (location, text) tuples, where location is (sheet_name, row, column).
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
-        try:
-            server.bind((HOST, PORT))      # Bind the server to the specified host and port
-            server.listen(5)               # Listen for incoming connections with a backlog of 5
-            print(f"[Server] Running on {HOST}:{PORT}. Press 'q' to stop.")
-            logging.info(f"Server started on {HOST}:{PORT}")
+    return list(iter_xlsx_units(file_path))
 
-            def stop_server():
-                """
-                Function to stop the server when the user inputs 'q'.
-                Runs in a separate daemon thread.
-                """
-                while True:
-                    if input().strip().lower() == 'q':
-                        print("[Server] Shutting down.")
-                        logging.info("Server shutdown initiated by user.")
-                        os._exit(0)  # Forcefully exit the program
+# Mapping of file extensions to their text unit extractors (shared by the scanners and the index)
+EXTRACTORS = {
+    ".txt": extract_txt_units,
+    ".pdf": extract_pdf_units,
+    ".html": extract_html_units,
+    ".xlsx": extract_xlsx_units
+}
 
-            # Start the stop_server function in a separate daemon thread
-            threading.Thread(target=stop_server, daemon=True).start()
+# The server-wide extraction cache, shared by every request and by the index
+EXTRACTION_CACHE = ExtractionCache(EXTRACTION_CACHE_BYTES, EXTRACTION_SPILL_DIR)
 
-            while True:
-                # Accept an incoming client connection
-                client_socket, addr = server.accept()
-                logging.info(f"Accepted connection from {addr}")
-                # Start a new thread to handle the connected client
-                threading.Thread(target=handle_client, args=(client_socket,)).start()
+# The mapped corpus snapshot (None when there is none or it is disabled)
+SNAPSHOT = None
+
+def open_snapshot(path=SNAPSHOT_FILE):
+    """
+    Maps the corpus snapshot written by pack.py. A missing or invalid snapshot is logged and
+    ignored: the files are then extracted as usual.
+    
+    Args:
+        path (str): The snapshot file.
+        
+    Returns:
+        Snapshot: The mapped snapshot, or None.
+    """
+    global SNAPSHOT
+    SNAPSHOT = None  # A previous snapshot stays mapped until the searches using its units are done
+    if not os.path.exists(path):
+        logging.info(f"No snapshot at {path}, files are extracted from the documents")
+        return None
+    try:
+        SNAPSHOT = Snapshot(path)
+    except (OSError, ValueError) as e:
+        logging.error(f"Ignoring snapshot {path}: {e}")
+        return None
+    stats = SNAPSHOT.stats()
+    logging.info(f"Mapped snapshot {path}: {stats['files']} files, {stats['units']} units, {stats['bytes']} bytes")
+    return SNAPSHOT
+
+def snapshot_units(file_path, signature):
+    """
+    Returns the packed units of a file when the snapshot holds its current version.
+    
+    Args:
+        file_path (str): The path to the file.
+        signature (tuple): The current signature of the file.
+        
+    Returns:
+        SnapshotUnits: The units, decoded from the mapping on access, or None if the file
+            has to be extracted (not packed, changed since, or no snapshot).
+    """
+    snapshot = SNAPSHOT
+    if snapshot is None:
+        return None
+    units = snapshot.get(file_path, signature)
+    if units is not None:
+        current_metrics().count(os.path.splitext(file_path)[1], "snapshot")
+    return units
+
+def get_units(file_path, extension):
+    """
+    Returns the text units of a file, extracting them only if the file changed since last time.
+    
+    Args:
+        file_path (str): The path to the file.
+        extension (str): The file extension, used to pick the extractor.
+        
+    Returns:
+        list: A list of (location, text) tuples (a SnapshotUnits sequence for packed files).
+    """
+    units = snapshot_units(file_path, file_signature(file_path))
+    if units is not None:
+        return units
+    if extension == ".pdf":
+        # PDFs are cached page by page, so a partially read document is not extracted twice
+        return [unit for page_num, units in iter_pdf_pages(file_path) for unit in units]
+    return EXTRACTION_CACHE.get_units(file_path, lambda path: timed_extract(path, extension))
+
+def timed_extract(file_path, extension):
+    """
+    Extracts the units of a file, counting the time in the "extract" stage of the current request.
+    
+    Args:
+        file_path (str): The path to the file.
+        extension (str): The file extension, used to pick the extractor.
+        
+    Returns:
+        list: A list of (location, text) tuples.
+    """
+    metrics = current_metrics()
+    with metrics.stage("extract"):
+        units = EXTRACTORS[extension](file_path)
+    metrics.count(extension, "extracted")
+    return units
+
+_scan_pool = None                   # Lazily created pool of scan worker processes
+_scan_pool_lock = threading.Lock()  # Protects the creation and replacement of the pool
+
+def get_scan_pool():
+    """
+    Returns the pool of scan worker processes, creating it on first use.
+    
+    Returns:
+        ProcessPoolExecutor: The pool, or None if SCAN_WORKERS is 1 (serial extraction).
+    """
+    global _scan_pool
+    with _scan_pool_lock:
+        if _scan_pool is None and SCAN_WORKERS > 1:
+            # 'spawn' avoids forking a process that already runs client threads
+            _scan_pool = ProcessPoolExecutor(max_workers=SCAN_WORKERS,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return _scan_pool
+
+def pooled_extensions(pending):
+    """
+    Picks the file types worth extracting on the scan workers: those with at least
+    SCAN_POOL_MIN_BYTES of files left to extract. Below that, starting the tasks and sending
+    the units back costs more than the parallel extraction saves.
+    
+    Args:
+        pending (list): (slot, file_path, extension, signature) tuples of the files to extract.
+        
+    Returns:
+        set: The extensions to extract on the workers (empty when SCAN_WORKERS is 1).
+    """
+    if SCAN_WORKERS <= 1:
+        return set()
+    pending_bytes = {}
+    for slot, file_path, extension, signature in pending:
+        pending_bytes[extension] = pending_bytes.get(extension, 0) + signature[1]
+    return {extension for extension, size in pending_bytes.items()
+            if extension in SCAN_POOL_MIN_BYTES and size >= SCAN_POOL_MIN_BYTES[extension]}
+
+def set_scan_workers(workers):
+    """
+    Changes the number of scan worker processes, replacing the current pool.
+    
+    Args:
+        workers (int): The number of worker processes (1 disables the pool).
+    """
+    global SCAN_WORKERS, _scan_pool
+    with _scan_pool_lock:
+        if _scan_pool is not None:
+            _scan_pool.shutdown()
+            _scan_pool = None
+        SCAN_WORKERS = max(1, workers)
+
+def extract_task(file_path, extension):
+    """
+    Extraction work done in a scan worker process.
+    
+    Args:
+        file_path (str): The path to the file.
+        extension (str): The file extension, used to pick the extractor.
+        
+    Returns:
+        list: A list of (location, text) tuples.
+    """
+    return EXTRACTORS[extension](file_path)
+
+_pdf_page_counts = {}                   # Path -> (signature, number of pages)
+_pdf_page_counts_lock = threading.Lock()  # Protects the page counts
+
+def get_pdf_page_count(file_path, signature):
+    """
+    Returns the number of pages of a PDF, reading its page tree only when the file changed.
+    
+    Args:
+        file_path (str): The path to the PDF file.
+        signature (tuple): The current signature of the file.
+        
+    Returns:
+        int: The number of pages.
+    """
+    with _pdf_page_counts_lock:
+        cached = _pdf_page_counts.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(file_path, 'rb') as file:
+        page_count = len(open_pdf(file).pages)  # Reads the page tree only, no text
+    with _pdf_page_counts_lock:
+        _pdf_page_counts[file_path] = (signature, page_count)
+    return page_count
+
+def submit_pdf_pages(pool, file_path, signature, page_numbers):
+    """
+    Looks up PDF pages in the extraction cache and submits the missing ones to the scan workers,
+    in tasks of at most PDF_PAGES_PER_TASK pages.
+    
+    Args:
+        pool (ProcessPoolExecutor): The scan worker pool.
+        file_path (str): The path to the PDF file.
+        signature (tuple): The current signature of the file.
+        page_numbers (list): The pages needed.
+        
+    Returns:
+        tuple: (page_num -> units of the cached pages, futures of the missing pages).
+    """
+    found = {}
+    missing = []
+    for page_num in page_numbers:
+        units = EXTRACTION_CACHE.lookup((file_path, page_num), signature)
+        if units is None:
+            missing.append(page_num)
+        else:
+            found[page_num] = units
+    # Spread the missing pages over every worker, without making tasks larger than PDF_PAGES_PER_TASK
+    per_task = min(PDF_PAGES_PER_TASK, max(1, -(-len(missing) // SCAN_WORKERS)))
+    futures = [pool.submit(extract_pdf_pages, file_path, missing[start:start + per_task])
+               for start in range(0, len(missing), per_task)]
+    return found, futures
+
+def collect_pdf_pages(file_path, signature, found, futures):
+    """
+    Waits for the pages submitted by submit_pdf_pages and caches each of them.
+    
+    Returns:
+        dict: page_num -> units of every requested page.
+    """
+    metrics = current_metrics()
+    with metrics.stage("extract"):  # Waiting for the workers is the extraction time seen by the request
+        for future in futures:
+            for page_num, units in future.result():
+                EXTRACTION_CACHE.put((file_path, page_num), signature, units)
+                found[page_num] = units
+                metrics.count(".pdf", "extracted")
+    return found
+
+def iter_pdf_pages(file_path, page_numbers=None):
+    """
+    Yields the text units of a PDF page by page, extracting pages only when they are reached.
+    Every page is cached on its own (key (file_path, page_num)). With scan workers, the
+    missing pages of a window of SCAN_WORKERS * PDF_PAGES_PER_TASK pages are extracted in
+    parallel (for documents of at least SCAN_POOL_MIN_BYTES).
+    
+    Args:
+        file_path (str): The path to the PDF file.
+        page_numbers (list): The pages to read (1-based, in order), or None for every page.
+        
+    Yields:
+        tuple: (page_num, units), where units is a list of ((page_num, line_num), text) tuples.
+    """
+    signature = file_signature(file_path)
+    if page_numbers is None:
+        page_numbers = range(1, get_pdf_page_count(file_path, signature) + 1)
+    pool = get_scan_pool() if pooled_extensions([(0, file_path, ".pdf", signature)]) else None
+    token = current_token()
+    if pool is not None:
+        window = SCAN_WORKERS * PDF_PAGES_PER_TASK
+        for start in range(0, len(page_numbers), window):
+            token.check()  # Between windows; the pages already submitted are cached by the workers anyway
+            batch = page_numbers[start:start + window]
+            found = collect_pdf_pages(file_path, signature, *submit_pdf_pages(pool, file_path, signature, batch))
+            for page_num in batch:
+                yield page_num, found[page_num]
+        return
+
+    # Serial mode: open the document on the first cache miss and keep it open for the next pages
+    metrics = current_metrics()
+    file = None
+    reader = None
+    try:
+        for page_num in page_numbers:
+            token.check()  # Between pages
+            units = EXTRACTION_CACHE.lookup((file_path, page_num), signature)
+            if units is None:
+                with metrics.stage("extract"):
+                    if reader is None:
+                        file = open(file_path, 'rb')
+                        reader = open_pdf(file)
+                    units = extract_page_units(reader.pages[page_num - 1], page_num)
+                EXTRACTION_CACHE.put((file_path, page_num), signature, units)
+                metrics.count(".pdf", "extracted")
+            yield page_num, units
+    finally:
+        if file is not None:
+            file.close()
+
+def get_units_many(files):
+    """
+    Returns the text units of several files, extracting the uncached ones in parallel
+    (see pooled_extensions).
+    
+    Args:
+        files (list): A list of (file_path, extension) tuples.
+        
+    Returns:
+        list: One (units, error) tuple per file, in the same order; error is None on success.
+    """
+    results = [None] * len(files)  # One slot per file, so the input order is kept
+    pending = []                   # Files that are not in the extraction cache
+    for slot, (file_path, extension) in enumerate(files):
+        try:
+            signature = file_signature(file_path)
+        except OSError as e:
+            results[slot] = ([], e)
+            continue
+        units = snapshot_units(file_path, signature)
+        if units is not None:
+            results[slot] = (units, None)  # Packed and unchanged: nothing to extract
+            continue
+        if extension == ".pdf":
+            pending.append((slot, file_path, extension, signature))  # Cached page by page
+            continue
+        units = EXTRACTION_CACHE.lookup(file_path, signature)
+        if units is not None:
+            results[slot] = (units, None)
+        else:
+            pending.append((slot, file_path, extension, signature))
+
+    token = current_token()
+    pooled = pooled_extensions(pending)
+    pool = get_scan_pool() if pooled else None
+    if pool is None:
+        pooled = set()  # The workers were just stopped
+
+    # Submit every pooled file (or group of missing PDF pages) first, so the workers run while
+    # the other files are extracted in the current thread
+    submitted = []
+    for slot, file_path, extension, signature in pending:
+        if extension not in pooled:
+            continue
+        try:
+            if extension == ".pdf":
+                page_numbers = range(1, get_pdf_page_count(file_path, signature) + 1)
+                submitted.append((slot, file_path, extension, signature,
+                                  (page_numbers,) + submit_pdf_pages(pool, file_path, signature, page_numbers)))
+            else:
+                submitted.append((slot, file_path, extension, signature, pool.submit(extract_task, file_path, extension)))
+        except Exception as e:
+            results[slot] = ([], e)
+    for slot, file_path, extension, signature in pending:
+        if extension in pooled:
+            continue
+        token.check()  # Between files
+        try:
+            if extension == ".pdf":
+                units = get_units(file_path, extension)  # Reads and fills the page cache
+            else:
+                units = timed_extract(file_path, extension)
+                EXTRACTION_CACHE.put(file_path, signature, units)
+            results[slot] = (units, None)
+        except Exception as e:
+            results[slot] = ([], e)
+    for slot, file_path, extension, signature, work in submitted:
+        token.check()  # Between files; tasks already submitted still finish in the workers
+        try:
+            if extension == ".pdf":
+                page_numbers, found, futures = work
+                found = collect_pdf_pages(file_path, signature, found, futures)
+                units = [unit for page_num in page_numbers for unit in found[page_num]]
+            else:
+                with current_metrics().stage("extract"):
+                    units = work.result()
+                current_metrics().count(extension, "extracted")
+                EXTRACTION_CACHE.put(file_path, signature, units)
+            results[slot] = (units, None)
+        except Exception as e:
+            results[slot] = ([], e)
+    return results
+
+def owns_file(file_path, extension):
+    """
+    Tells whether this server searches a file: always, unless it is one shard of a
+    coordinator, in which case the other shards search the files it does not own.
+    
+    Args:
+        file_path (str): The path to the file.
+        extension (str): The file extension.
+        
+    Returns:
+        bool: True if the file belongs to this server.
+    """
+    if SHARD is None:
+        return True
+    index, count = SHARD
+    return shard_of(file_path, extension, count, SHARD_BY, list(FOLDERS)) == index
+
+# The server-wide inverted index (loaded from INDEX_FILE and refreshed incrementally);
+# large TXT files are not stored in it but memory-mapped and scanned at query time
+SEARCH_INDEX = InvertedIndex(FOLDERS, get_units_many, INDEX_FILE,
+                             max_file_size=MMAP_THRESHOLD, large_file_scanners={".txt": scan_txt_mmap},
+                             use_trigrams=TRIGRAM_INDEX, accept=owns_file)
+
+def set_shard(index, count, by=SHARD_BY):
+    """
+    Makes this server one shard of a coordinator, searching only the files it owns.
+    Each shard persists its own index, so several shards can share the data folders.
+    
+    Args:
+        index (int): The index of this shard (0 to count - 1).
+        count (int): The number of shards.
+        by (str): "hash" or "format" (see sharding.shard_of).
+    """
+    global SHARD, SHARD_BY
+    SHARD = (index, count)
+    SHARD_BY = by
+    root, ext = os.path.splitext(INDEX_FILE)
+    SEARCH_INDEX.index_path = f"{root}.shard{index}of{count}{ext}"
+    logging.info(f"Serving shard {index}/{count} (split by {by})")
+
+def ingest_file(file_path, extension):
+    """
+    Re-extracts a new or modified file reported by the folder watcher, so that the next
+    queries find it in the index (or the extraction cache) without extracting it themselves.
+    
+    Args:
+        file_path (str): The path to the file.
+        extension (str): The file extension.
+    """
+    if not owns_file(file_path, extension):
+        updated = False  # Another shard searches it
+    elif USE_INDEX:
+        updated = SEARCH_INDEX.update_file(file_path, extension)
+    elif not is_large_txt(file_path, extension):  # Large text files are scanned in place anyway
+        units, error = get_units_many([(file_path, extension)])[0]
+        if error is not None:
+            raise error
+        updated = True
+    else:
+        updated = False
+    if updated:
+        logging.info(f"Watcher ingested {file_path}")
+
+def forget_file(file_path, extension):
+    """
+    Drops a file deleted from the searched folders from the index and the extraction cache
+    (its PDF pages included).
+    """
+    if USE_INDEX and SEARCH_INDEX.remove_file(file_path):
+        logging.info(f"Watcher removed {file_path} from the index")
+    EXTRACTION_CACHE.invalidate_file(file_path)
+    with _pdf_page_counts_lock:
+        _pdf_page_counts.pop(file_path, None)
+
+# The running folder watcher (None when the folders are checked on every query instead)
+WATCHER = None
+
+def start_watcher(backend=WATCH_BACKEND, rate=WATCH_RATE):
+    """
+    Starts the background folder watcher.
+    
+    Args:
+        backend (str): "inotify", "poll" or "auto".
+        rate (float): Changed files re-extracted per second at most.
+    """
+    global WATCHER
+    watcher = FolderWatcher(FOLDERS, ingest_file, forget_file,
+                            on_idle=SEARCH_INDEX.save if USE_INDEX else None,  # Persist once a burst of changes is indexed
+                            rate=rate, settle=WATCH_SETTLE, poll_interval=WATCH_POLL_INTERVAL, backend=backend)
+    watcher.start()
+    WATCHER = watcher
+
+def stop_watcher():
+    """
+    Stops the folder watcher, if it is running.
+    """
+    global WATCHER
+    if WATCHER is not None:
+        WATCHER.stop()
+        WATCHER = None
+
+# Human-readable file type names, used in error messages
+FILE_TYPE_NAMES = {
+    ".txt": "TXT",
+    ".pdf": "PDF",
+    ".html": "HTML",
+    ".xlsx": "Excel"
+}
+
+def format_location(location):
+    """
+    Formats the location of a text unit the way it is displayed to the client.
+    
+    Args:
+        location (tuple): (line,), (page, line), (sheet, row, column) or an empty tuple.
+        
+    Returns:
+        str: The formatted location, or None if the unit has no location (HTML).
+    """
+    if len(location) == 1:
+        return f"Line {location[0]}"
+    elif len(location) == 2:
+        return f"Page {location[0]}, Line {location[1]}"
+    elif len(location) == 3:
+        return f"Sheet {location[0]}, Cell ({location[1]}, {location[2]})"
+    return None
+
+class Hit(namedtuple("Hit", ["number", "file_path", "location", "text"])):
+    """
+    A single match. Search functions return Hit objects next to plain message strings;
+    str(hit) gives the result line of the legacy protocol.
+    
+    Fields:
+        number (int): The number of the match within its file.
+        file_path (str): The path to the file containing the match.
+        location (tuple): The location of the matching unit (see format_location).
+        text (str): The text of the matching unit.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        """
+        Formats the match as a result line.
+        """
+        where = format_location(self.location)
+        if where is None:
+            return f"{self.number} - {os.path.basename(self.file_path)} - {self.text.strip()}"
+        return f"{self.number} - {os.path.basename(self.file_path)} - {where}: {self.text.strip()}"
+
+    def to_dict(self):
+        """
+        Converts the match to the structured form sent by the framed protocol.
+        
+        Returns:
+            dict: The number, file name, formatted location, raw position and text of the match.
+        """
+        return {
+            "number": self.number,
+            "file": os.path.basename(self.file_path),
+            "location": format_location(self.location) or "",
+            "position": list(self.location),
+            "text": self.text.strip()
+        }
+
+class ScoredHit(namedtuple("ScoredHit", ["hit", "score"])):
+    """
+    A match of a ranked search, with its relevance score.
+    
+    Fields:
+        hit (Hit): The match.
+        score (float): The BM25 score of the matching unit (higher is more relevant).
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        """
+        Formats the match as a result line followed by its score.
+        """
+        return f"{self.hit} (score {self.score:.3f})"
+
+    def to_dict(self):
+        """
+        Converts the match to its structured form, with a "score" field.
+        """
+        return dict(self.hit.to_dict(), score=round(self.score, 4))
+
+def result_to_dict(result):
+    """
+    Converts a search result (a Hit, a ScoredHit or a message string) to its structured form.
+    
+    Args:
+        result (Hit, ScoredHit or str): The result to convert.
+        
+    Returns:
+        dict: The structured result.
+    """
+    if isinstance(result, (Hit, ScoredHit)):
+        return result.to_dict()
+    return {"message": str(result)}
+
+def iter_file_hits(file_path, extension, keyword):
+    """
+    Searches for keywords within a single file, yielding matches as they are found.
+    
+    Args:
+        file_path (str): The path to the file.
+        extension (str): The file extension, used to pick the extractor.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Yields:
+        Hit: Each match, in file order.
+    """
+    plan = get_plan(keyword)  # Compile the keyword string unless the caller already did
+
+    logging.debug(f"Searching in file: {file_path} with keywords={plan.keywords}, operator={plan.operator}, is_regex={plan.is_regex}")
+    if is_large_txt(file_path, extension):
+        yield from iter_large_txt_hits(file_path, plan)
+        return
+    try:
+        units = snapshot_units(file_path, file_signature(file_path))
+    except OSError:
+        units = None  # Reported by the extractors below
+    if units is not None:
+        yield from iter_snapshot_hits(file_path, units, plan)
+        return
+    if extension == ".pdf":
+        yield from iter_pdf_hits(file_path, plan)
+        return
+    try:
+        if extension == ".xlsx" and plan.has_filters() and not EXTRACTION_CACHE.contains(file_path, file_signature(file_path)):
+            # Only part of the workbook is wanted: stream the selected cells instead of extracting it all
+            with current_metrics().stage("extract"):
+                units = list(iter_xlsx_units(file_path, plan.sheets, plan.columns))
+        else:
+            units = get_units(file_path, extension)
+    except Exception as e:
+        # Log any errors encountered while reading the file
+        logging.error(f"Error reading {FILE_TYPE_NAMES[extension]} file {file_path}: {e}")
+        units = []
+    yield from iter_unit_hits(file_path, units, plan)
+
+def iter_unit_hits(file_path, units, plan):
+    """
+    Matches the extracted units of a file against a compiled query.
+    
+    Args:
+        file_path (str): The path to the file the units come from.
+        units (list): The (location, text) units of the file.
+        plan (QueryPlan): The compiled query.
+        
+    Yields:
+        Hit: Each matching unit, numbered from 1 within the file.
+    """
+    count = 1                 # Initialize a counter for numbering results
+    first = None              # Location of the first match, kept for the file summary
+    metrics = current_metrics()
+    token = current_token()
+    countdown = CHECK_INTERVAL  # Units left before the next deadline/cancellation check
+    metrics.enter("match")    # Paused while the consumer handles each hit
+    try:
+        for location, text in units:
+            countdown -= 1
+            if not countdown:
+                countdown = CHECK_INTERVAL
+                token.check()
+            if plan.accepts(location) and plan.matches(text):
+                # If the unit matches the search criteria, yield it (no per-match log: it slows down large scans)
+                if first is None:
+                    first = location
+                metrics.leave()
+                try:
+                    yield Hit(count, file_path, location, text)
+                finally:
+                    metrics.enter("match")
+                count += 1
+    finally:
+        metrics.leave()
+        extension = os.path.splitext(file_path)[1]
+        metrics.count(extension, "files")
+        metrics.count(extension, "matches", count - 1)
+        # One aggregated record per file instead of one per match
+        if count == 1:
+            logging.debug(f"No matches found in file: {file_path}")
+        else:
+            logging.debug(f"{count - 1} match(es) found in {file_path}, first at {first}")
+
+def iter_snapshot_hits(file_path, units, plan):
+    """
+    Searches the packed units of a file. Literal queries are first searched in the mapped
+    bytes of the file, so only the units around a match are decoded.
+    
+    Args:
+        file_path (str): The path to the file the units come from.
+        units (SnapshotUnits): The units of the file in the snapshot.
+        plan (QueryPlan): The compiled query.
+        
+    Yields:
+        Hit: Each matching unit, numbered from 1 within the file.
+    """
+    if plan.literal:
+        units = units.matching(literal_anchor(plan))
+    try:
+        yield from iter_unit_hits(file_path, units, plan)
+    except (ValueError, IndexError) as e:
+        # Log a damaged snapshot like an unreadable file
+        logging.error(f"Error reading {file_path} from the snapshot: {e}")
+
+def iter_large_txt_hits(file_path, plan):
+    """
+    Searches a large TXT file through the memory-mapped scanner.
+    
+    Args:
+        file_path (str): The path to the TXT file.
+        plan (QueryPlan): The compiled query.
+        
+    Yields:
+        Hit: Each matching line, numbered from 1 within the file.
+    """
+    metrics = current_metrics()
+    count = 0
+    try:
+        matches = scan_txt_mmap(file_path, plan)
+        while True:
+            with metrics.stage("match"):  # Scanning the mapped file up to the next matching line
+                unit = next(matches, None)
+            if unit is None:
+                break
+            count += 1
+            yield Hit(count, file_path, unit[0], unit[1])
+    except Exception as e:
+        # Log any errors encountered while reading the TXT file
+        logging.error(f"Error reading TXT file {file_path}: {e}")
+    finally:
+        metrics.count(".txt", "files")
+        metrics.count(".txt", "matches", count)
+
+def iter_pdf_hits(file_path, plan):
+    """
+    Searches a PDF page by page, so pages after the last result a consumer needs are never
+    extracted. When the index knows the file, only the pages it reports as candidates are read.
+    
+    Args:
+        file_path (str): The path to the PDF file.
+        plan (QueryPlan): The compiled query.
+        
+    Yields:
+        Hit: Each matching line, numbered from 1 within the file.
+    """
+    page_numbers = SEARCH_INDEX.candidate_pages(file_path, plan) if USE_INDEX else None
+    units = (unit for page_num, page_units in iter_pdf_pages(file_path, page_numbers) for unit in page_units)
+    try:
+        yield from iter_unit_hits(file_path, units, plan)
+    except Exception as e:
+        # Log any errors encountered while reading the PDF file
+        logging.error(f"Error reading PDF file {file_path}: {e}")
+
+def search_file(file_path, extension, keyword):
+    """
+    Searches for keywords within a single file using the extractor registered for its type.
+    
+    Args:
+        file_path (str): The path to the file.
+        extension (str): The file extension, used to pick the extractor.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found.
+    """
+    return list(iter_file_hits(file_path, extension, keyword))
+
+def match_units(file_path, units, plan):
+    """
+    Matches the extracted units of a file against a compiled query.
+    
+    Args:
+        file_path (str): The path to the file the units come from.
+        units (list): The (location, text) units of the file.
+        plan (QueryPlan): The compiled query.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found.
+    """
+    return list(iter_unit_hits(file_path, units, plan))
+
+def search_txt(file_path, keyword):
+    """
+    Searches for keywords within a TXT file.
+    
+    Args:
+        file_path (str): The path to the TXT file.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found.
+    """
+    return search_file(file_path, ".txt", keyword)
+
+def search_pdf(file_path, keyword):
+    """
+    Searches for keywords within a PDF file.
+    
+    Args:
+        file_path (str): The path to the PDF file.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found.
+    """
+    return search_file(file_path, ".pdf", keyword)
+
+def search_html(file_path, keyword):
+    """
+    Searches for keywords within an HTML file.
+    
+    Args:
+        file_path (str): The path to the HTML file.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found.
+    """
+    return search_file(file_path, ".html", keyword)
+
+def search_xlsx(file_path, keyword):
+    """
+    Searches for keywords within an Excel (XLSX) file.
+    
+    Args:
+        file_path (str): The path to the XLSX file.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found.
+    """
+    return search_file(file_path, ".xlsx", keyword)
+
+def iter_index_hits(extension, keyword):
+    """
+    Answers a search over one file type from the inverted index instead of re-reading the files.
+    
+    Args:
+        extension (str): The file extension to search for.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Yields:
+        Hit: Each match, in scan order.
+    """
+    counts = {}    # Per-file counters, so numbering restarts for every file like the scanners do
+    plan = get_plan(keyword)  # Compile the keyword string unless the caller already did
+
+    metrics = current_metrics()
+    if WATCHER is None:
+        with metrics.stage("glob"):
+            SEARCH_INDEX.refresh([extension])  # Re-extract only the files whose mtime or size changed
+    # Otherwise the watcher updates the index in the background and queries never extract
+    matches = SEARCH_INDEX.iter_search(extension, plan)
+    try:
+        while True:
+            with metrics.stage("match"):  # Looking up and confirming the next candidate unit
+                found = next(matches, None)
+            if found is None:
+                break
+            file_path, location, text = found
+            count = counts.get(file_path, 1)
+            yield Hit(count, file_path, location, text)
+            counts[file_path] = count + 1
+    finally:
+        metrics.count(extension, "files", len(counts))
+        metrics.count(extension, "matches", sum(counts.values()) - len(counts))
+
+def search_index(extension, keyword):
+    """
+    Answers a search over one file type from the inverted index instead of re-reading the files.
+    
+    Args:
+        extension (str): The file extension to search for.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found.
+    """
+    return list(iter_index_hits(extension, keyword))
+
+def iter_folder_hits(folder, extension, keyword):
+    """
+    Searches for keywords within all files of a specific type in a given folder, yielding
+    matches as they are found. Files are extracted in batches (in parallel when
+    SCAN_WORKERS > 1), so a consumer that stops early also stops the scan.
+    
+    Args:
+        folder (str): The directory containing the files.
+        extension (str): The file extension to search for.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Yields:
+        Hit: Each match, in scan order.
+    """
+    plan = get_plan(keyword)  # Compile once for all the files of the folder
+    if USE_INDEX and FOLDERS.get(extension) == folder:
+        # The index covers the configured folders, so answer from its postings
+        yield from iter_index_hits(extension, plan)
+        return
+    for file_path, units in iter_folder_units(folder, extension):
+        if units is None:
+            yield from iter_large_txt_hits(file_path, plan)
+        elif isinstance(units, SnapshotUnits):
+            yield from iter_snapshot_hits(file_path, units, plan)
+        else:
+            yield from iter_unit_hits(file_path, units, plan)
+
+def iter_folder_units(folder, extension):
+    """
+    Extracts the files of one type in a folder, in scan order. Files are extracted in
+    batches (in parallel when SCAN_WORKERS > 1), as the consumer asks for them.
+    
+    Args:
+        folder (str): The directory containing the files.
+        extension (str): The file extension.
+        
+    Yields:
+        tuple: (file_path, units), where units is None for large TXT files (to be scanned in
+            place) and empty for files that could not be read.
+    """
+    if extension not in EXTRACTORS:
+        return
+
+    with current_metrics().stage("glob"):
+        file_paths = [path for path in glob.glob(os.path.join(folder, f"*{extension}")) if owns_file(path, extension)]
+    batch_size = SCAN_WORKERS * 2  # Enough files to keep every worker busy
+    token = current_token()
+    for start in range(0, len(file_paths), batch_size):
+        batch = file_paths[start:start + batch_size]
+        large = [is_large_txt(path, extension) for path in batch]
+        extracted = iter(get_units_many([(path, extension) for path, is_large in zip(batch, large) if not is_large]))
+        for file_path, is_large in zip(batch, large):
+            token.check()  # Between files
+            if is_large:
+                yield file_path, None
+                continue
+            units, error = next(extracted)
+            if error is not None:
+                # Log any errors encountered while reading the file
+                logging.error(f"Error reading {FILE_TYPE_NAMES[extension]} file {file_path}: {error}")
+            yield file_path, units
+
+def search_all_files(folder, extension, keyword):
+    """
+    Searches for keywords within all files of a specific type in a given folder.
+    
+    Args:
+        folder (str): The directory containing the files.
+        extension (str): The file extension to search for.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found or a message if no matches.
+    """
+    results = list(iter_folder_hits(folder, extension, keyword))
+    return results if results else ["No matches found in any file."]  # Return results or a default message
+
+def search_all_file_types(keyword):
+    """
+    Searches for keywords across all defined file types.
+    
+    Args:
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found or a message if no matches.
+    """
+    return list(iter_search("ALL", keyword, ""))
+
+def iter_search(search_target, keyword, file_extension):
+    """
+    Handles the search logic based on the target (ALL or specific file) and file extensions
+    provided, yielding results as soon as they are found.
+    
+    Args:
+        search_target (str): "ALL" to search all files or the name of a specific file.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        file_extension (str): Comma-separated file extensions to include in the search.
+        
+    Yields:
+        Hit or str: Each match, or an error/notice message.
+    """
+    # Compile the query once; the same plan is shared by every file and file type below
+    plan = get_plan(keyword)
+    # Split multiple extensions separated by commas and remove any extra whitespace
+    extensions = [ext.strip() for ext in file_extension.split(',') if ext.strip()] if file_extension else []
+
+    if search_target.upper() == "ALL":
+        # If the search target is "ALL", search across all or specified file types
+        if not extensions:
+            # If no specific extensions are provided, search across all defined file types
+            for ext, folder in FOLDERS.items():
+                found = False
+                for hit in iter_folder_hits(folder, ext, plan):
+                    found = True
+                    yield hit
+                if not found:
+                    yield "No matches found in any file."
+            return
+        # If specific extensions are provided, search only within those types
+        for ext in extensions:
+            folder = FOLDERS.get(ext)
+            if not folder:
+                # If the file type is unsupported, add an error message to results
+                yield f"Unsupported file type: {ext}"
+                continue
+            found = False
+            for hit in iter_folder_hits(folder, ext, plan):
+                found = True
+                yield hit
+            if not found:
+                # If no results found for this extension, add a corresponding message
+                yield f"No matches found for file type: {ext}."
+        return
+
+    # If the search target is a specific file
+    if len(extensions) > 1:
+        # If multiple extensions are provided for a single file search, return an error
+        yield "Error: Multiple extensions provided for a single file search."
+        return
+    ext = extensions[0] if extensions else ""  # Get the single extension if available
+    folder = FOLDERS.get(ext)
+    if not folder:
+        # If the file type is unsupported, return an error message
+        yield f"Unsupported file type: {ext}"
+        return
+    file_path = os.path.join(folder, search_target)  # Construct the full file path
+    if not os.path.exists(file_path):
+        # If the file does not exist, return an error message
+        yield f"File not found: {file_path}"
+        return
+    found = False
+    for hit in iter_file_hits(file_path, ext, plan):
+        found = True
+        yield hit
+    if not found:
+        yield "No matches found."
+
+# The server-wide cache of complete result lists
+RESULT_CACHE = ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_TTL, RESULT_CACHE_MAX_RESULTS)
+
+def result_cache_key(search_target, plan, file_extension):
+    """
+    Computes the result cache key of a search and the current version of what it reads.
+    
+    Args:
+        search_target (str): "ALL" to search all files or the name of a specific file.
+        plan (QueryPlan): The compiled query.
+        file_extension (str): Comma-separated file extensions to include in the search.
+        
+    Returns:
+        tuple: (key, version), as expected by RESULT_CACHE.
+    """
+    extensions = tuple(ext.strip() for ext in file_extension.split(',') if ext.strip()) if file_extension else ()
+    is_all = search_target.upper() == "ALL"
+    # Extension order is kept in the key because it decides the order of the results
+    key = ("ALL" if is_all else search_target, plan.cache_key(), extensions)
+    # The version covers every folder the query reads, computed before scanning so that a
+    # change during the scan leaves a stale (and therefore rejected) entry. With a watcher,
+    # queries do not refresh the index and it may lag behind the folders, so the changes the
+    # watcher makes to it are part of the version too.
+    read_extensions = (extensions or tuple(FOLDERS)) if is_all else extensions[:1]
+    watched = USE_INDEX and WATCHER is not None
+    version = tuple((ext, folder_version(FOLDERS[ext], ext), SEARCH_INDEX.generation(ext) if watched else None)
+                    for ext in read_extensions if ext in FOLDERS)
+    return key, version
+
+def iter_search_cached(search_target, keyword, file_extension):
+    """
+    Same as iter_search, but answers repeated queries from the result cache.
+    A search read only partly (a page of results) stores the results read so far: the next
+    pages of the same query are answered from this prefix. Reading past it runs the search
+    again from where the prefix ends, and reads as many results again before yielding
+    them, so that paging through n results runs the search O(log n) times instead of once
+    per page. This read-ahead is part of the request that needs it (its deadline and
+    cancels apply), never of the one that closes the generator.
+    
+    Args:
+        search_target (str): "ALL" to search all files or the name of a specific file.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        file_extension (str): Comma-separated file extensions to include in the search.
+        
+    Yields:
+        Hit or str: Each match, or an error/notice message.
+    """
+    plan = get_plan(keyword)
+    key, version = result_cache_key(search_target, plan, file_extension)
+    cached = RESULT_CACHE.get(key, version, time.monotonic())
+    prefix, complete = cached if cached is not None else ([], False)
+    yield from prefix
+    if complete:
+        return
+    # Results are found in the same order every time, so the search resumes after the prefix
+    results = list(prefix)  # The cached list may be read by other requests
+    searched = itertools.islice(iter_search(search_target, plan, file_extension), len(results), None)
+    overflow = False  # Whether results stopped growing at RESULT_CACHE_MAX_RESULTS
+    try:
+        if prefix:
+            # Paging past the cached prefix: read as many results again before yielding
+            wanted = min(2 * len(results), RESULT_CACHE_MAX_RESULTS)
+            try:
+                while len(results) < wanted:
+                    results.append(next(searched))
+            except StopIteration:
+                complete = True
+            except RequestCancelled:
+                # The results read so far may still hold the whole page
+                yield from results[len(prefix):]
+                raise
+            yield from results[len(prefix):]
+            if complete:
+                return
+        for result in searched:
+            if len(results) < RESULT_CACHE_MAX_RESULTS:
+                results.append(result)
+            else:
+                overflow = True
+            yield result
+        complete = not overflow
+    finally:
+        RESULT_CACHE.put(key, version, results, time.monotonic(), complete)
+
+def iter_ranked(results, plan, k):
+    """
+    Ranks the matches of a search by relevance, keeping only the k best ones in a heap while
+    the search runs, so memory does not grow with the number of matching units.
+    
+    Args:
+        results (iterable): The results of the search (Hit objects and message strings).
+        plan (QueryPlan): The compiled query.
+        k (int): The number of matches returned.
+        
+    Yields:
+        ScoredHit or str: The k best matches, most relevant first, then the messages
+            (errors and "No matches" notices) of the search. If the search is cut short,
+            the best matches found until then are yielded before RequestCancelled is re-raised.
+    """
+    metrics = current_metrics()
+    with metrics.stage("match"):
+        # BM25 statistics of the indexed corpus (unit count, average length, keyword frequencies)
+        scorer = Scorer(plan, SEARCH_INDEX.corpus_stats(plan) if USE_INDEX else None)
+    messages = []  # At most one per file type searched
+    stopped = []   # RequestCancelled raised by the search, re-raised once the partial ranking is out
+
+    def hits():
+        try:
+            for result in results:
+                if isinstance(result, Hit):
+                    yield result
+                else:
+                    messages.append(result)
+        except RequestCancelled as e:
+            stopped.append(e)
+
+    def score(hit):
+        with metrics.stage("match"):
+            return scorer.score(hit.text)
+
+    ranked = top_k(hits(), k, score)
+    for hit_score, hit in ranked:
+        yield ScoredHit(hit, hit_score)
+    if ranked:
+        # Matches were found after all: drop the notices of the file types without matches
+        messages = [message for message in messages if not message.startswith("No matches found")]
+    yield from messages
+    if stopped:
+        raise stopped[0]
+
+def iter_ranked_cached(search_target, plan, file_extension, k):
+    """
+    Ranks the matches of a search (see iter_ranked), answering repeated requests from the
+    result cache. Only the final ranking is cached, under a key that includes k: the
+    matches themselves are never kept, so memory stays bounded by k.
+    
+    Args:
+        search_target (str): "ALL" to search all files or the name of a specific file.
+        plan (QueryPlan): The compiled query.
+        file_extension (str): Comma-separated file extensions to include in the search.
+        k (int): The number of matches returned.
+        
+    Yields:
+        ScoredHit or str: Same as iter_ranked.
+    """
+    key, version = result_cache_key(search_target, plan, file_extension)
+    key = key + (("rank", k),)
+    cached = RESULT_CACHE.get(key, version, time.monotonic())
+    if cached is not None:
+        yield from cached[0]
+        return
+    ranked = []
+    try:
+        for result in iter_ranked(iter_search(search_target, plan, file_extension), plan, k):
+            ranked.append(result)  # Nothing is yielded before the search ends anyway
+    except RequestCancelled:
+        yield from ranked  # The best matches found until then, not cached
+        raise
+    RESULT_CACHE.put(key, version, ranked, time.monotonic())
+    yield from ranked
+
+def match_units_batch(file_path, units, unit_ids, plans, results, limits, plan_unit_ids=None):
+    """
+    Matches the units of one file against several compiled queries in a single pass.
+    
+    Args:
+        file_path (str): The path to the file the units come from.
+        units (list): The (location, text) units of the file.
+        unit_ids (iterable): The ids of the units to check, in order.
+        plans (list): The compiled queries.
+        plan_unit_ids (list): Per query, the set of unit ids it may match (None for every
+            unit), or None when every query is checked on every unit.
+        results (list): One list of results per query, extended in place.
+        limits (list): The largest number of results kept per query (None for no limit).
+        
+    Returns:
+        list: The number of matches of each query in the file (including those beyond its limit).
+    """
+    counts = [0] * len(plans)
+    token = current_token()
+    token.check()  # Between files
+    with current_metrics().stage("match"):
+        for number, unit_id in enumerate(unit_ids, start=1):
+            if not number % CHECK_INTERVAL:
+                token.check()
+            location, text = units[unit_id]
+            for i, plan in enumerate(plans):
+                if plan_unit_ids is not None and plan_unit_ids[i] is not None and unit_id not in plan_unit_ids[i]:
+                    continue  # The index rules this unit out for this query
+                if plan.accepts(location) and plan.matches(text):
+                    counts[i] += 1
+                    if limits[i] is None or len(results[i]) < limits[i]:
+                        results[i].append(Hit(counts[i], file_path, location, text))
+    extension = os.path.splitext(file_path)[1]
+    current_metrics().count(extension, "files")
+    current_metrics().count(extension, "matches", sum(counts))
+    return counts
+
+def iter_batch_files(extension, plans):
+    """
+    Lists the files of one type with their units, for a search of several queries at once.
+    
+    Args:
+        extension (str): The file extension.
+        plans (list): The compiled queries, used to skip the units none of them can match.
+        
+    Yields:
+        tuple: (file_path, units, unit_ids, plan_unit_ids), where units is None for large TXT
+            files, unit_ids the ids of the units to check (None for all of them) and
+            plan_unit_ids the candidate ids of each query (None when unknown).
+    """
+    if USE_INDEX:
+        if WATCHER is None:
+            with current_metrics().stage("glob"):
+                SEARCH_INDEX.refresh([extension])
+        yield from SEARCH_INDEX.iter_files(extension, plans)
+    else:
+        for file_path, units in iter_folder_units(FOLDERS[extension], extension):
+            yield file_path, units, None, None
+
+def search_batch(search_target, plans, file_extension, limits=None):
+    """
+    Evaluates several queries with one pass over the files: each file is listed, extracted
+    (or read from the index) and walked once, and every unit is tested against every query.
+    
+    Args:
+        search_target (str): "ALL" to search all files or the name of a specific file.
+        plans (list): The compiled queries.
+        file_extension (str): Comma-separated file extensions to include in the search.
+        limits (list): The largest number of results kept per query (None entries for no
+            limit), or None to keep every result.
+        
+    Returns:
+        tuple: (results, totals, stopped): per query, the list of results (Hit objects and
+            messages, as iter_search would return them, up to its limit) and the total number
+            of matches, then why the search was cut short ("deadline", "cancelled", ...) or
+            None when it completed; a cut search returns what it found until then.
+    """
+    limits = limits or [None] * len(plans)
+    results = [[] for _ in plans]   # Results of each query
+    totals = [0] * len(plans)       # Matches of each query, including those beyond its limit
+    extensions = [ext.strip() for ext in file_extension.split(',') if ext.strip()] if file_extension else []
+
+    def add_message(i, message):
+        if limits[i] is None or len(results[i]) < limits[i]:
+            results[i].append(message)
+
+    def scan(files, no_match_message):
+        """
+        Matches every query against the given (file_path, units) pairs.
+        """
+        found = [0] * len(plans)
+        for file_path, units, unit_ids, plan_unit_ids in files:
+            if units is None:
+                # Large text files are scanned in place, once per query
+                for i, plan in enumerate(plans):
+                    for hit in iter_large_txt_hits(file_path, plan):
+                        found[i] += 1
+                        totals[i] += 1
+                        if limits[i] is None or len(results[i]) < limits[i]:
+                            results[i].append(hit)
+                continue
+            if unit_ids is None:
+                unit_ids = range(len(units))
+            counts = match_units_batch(file_path, units, unit_ids, plans, results, limits, plan_unit_ids)
+            for i, count in enumerate(counts):
+                found[i] += count
+                totals[i] += count  # Kept up to date so a cut search reports what it found
+        for i in range(len(plans)):
+            if not found[i]:
+                add_message(i, no_match_message)
+
+    def scan_file(file_path, ext):
+        """
+        Matches every query against one specific file.
+        """
+        if is_large_txt(file_path, ext):
+            units = None
+        else:
+            try:
+                units = get_units(file_path, ext)
+            except Exception as e:
+                logging.error(f"Error reading {FILE_TYPE_NAMES[ext]} file {file_path}: {e}")
+                units = []
+        scan([(file_path, units, None, None)], "No matches found.")
+
+    try:
+        if search_target.upper() == "ALL":
+            for ext in extensions or list(FOLDERS):
+                if ext not in FOLDERS:
+                    for i in range(len(plans)):
+                        add_message(i, f"Unsupported file type: {ext}")
+                    continue
+                scan(iter_batch_files(ext, plans), "No matches found in any file." if not extensions
+                     else f"No matches found for file type: {ext}.")
+            return results, totals, None
+
+        # A specific file: the same checks as iter_search
+        ext = extensions[0] if len(extensions) == 1 else ""
+        file_path = os.path.join(FOLDERS[ext], search_target) if ext in FOLDERS else None
+        if len(extensions) > 1:
+            message = "Error: Multiple extensions provided for a single file search."
+        elif file_path is None:
+            message = f"Unsupported file type: {ext}"
+        elif not os.path.exists(file_path):
+            message = f"File not found: {file_path}"
+        else:
+            message = None
+        if message is not None:
+            for i in range(len(plans)):
+                add_message(i, message)
+        else:
+            scan_file(file_path, ext)
+        return results, totals, None
+    except RequestCancelled as e:
+        return results, totals, e.reason
+
+def handle_search(search_target, keyword, file_extension):
+    """
+    Handles the search logic based on the target (ALL or specific file) and file extensions provided.
+    
+    Args:
+        search_target (str): "ALL" to search all files or the name of a specific file.
+        keyword (str or QueryPlan): The keyword or regex pattern to search for, or its compiled plan.
+        file_extension (str): Comma-separated file extensions to include in the search.
+        
+    Returns:
+        list: A list of Hit objects indicating where matches were found or error messages (str).
+    """
+    return list(iter_search_cached(search_target, keyword, file_extension))
+
+# The server-wide request metrics
+METRICS = MetricsRegistry()
+
+def get_stats():
+    """
+    Collects the server statistics returned by the STATS command.
+    
+    Returns:
+        dict: The statistics of the server components and the aggregated request metrics.
+    """
+    watcher = WATCHER
+    return {"metrics": METRICS.snapshot(), "extraction_cache": EXTRACTION_CACHE.stats(),
+            "result_cache": RESULT_CACHE.stats(), "watcher": watcher.stats() if watcher else None,
+            "shard": {"index": SHARD[0], "count": SHARD[1], "by": SHARD_BY} if SHARD else None,
+            "snapshot": SNAPSHOT.stats() if SNAPSHOT else None}
+
+def get_rank_size(message):
+    """
+    Reads and validates the number of results of a ranked search request.
+    
+    Args:
+        message (dict): The decoded request.
+        
+    Returns:
+        int: The number of best matches to return, or None when the request is not ranked.
+    """
+    if not message.get("rank"):
+        return None
+    k = message.get("k", RANK_TOP_K)
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= RANK_MAX_K:
+        raise ValueError(f"k must be an integer between 1 and {RANK_MAX_K}")
+    return k
+
+def get_timeout(message):
+    """
+    Reads and validates the time budget of a framed search or batch request.
+    
+    Args:
+        message (dict): The decoded request.
+        
+    Returns:
+        float: Seconds the search may run, or None for no limit.
+    """
+    timeout = message.get("timeout")
+    if timeout is None:
+        return REQUEST_TIMEOUT or None
+    if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or not 0 < timeout <= REQUEST_MAX_TIMEOUT:
+        raise ValueError(f"timeout must be a number of seconds between 0 and {REQUEST_MAX_TIMEOUT:g}")
+    return timeout
+
+def get_filter(message, field):
+    """
+    Reads an optional list filter of a framed search request.
+    
+    Args:
+        message (dict): The decoded request.
+        field (str): The name of the filter ("sheets" or "columns").
+        
+    Returns:
+        list: The filter values, or None when the field is absent.
+    """
+    values = message.get(field)
+    if values is None:
+        return None
+    if isinstance(values, (str, int)):
+        values = [values]  # A single sheet or column
+    if not isinstance(values, list):
+        raise ValueError(f"{field} must be a list")
+    return values
+
+def get_batch_queries(message):
+    """
+    Reads and compiles the queries of a batch request.
+    
+    Args:
+        message (dict): The decoded request. "queries" lists keyword strings or objects with a
+            "keyword" and optional "limit", "sheets" and "columns"; a top-level "limit"
+            applies to the queries without their own.
+        
+    Returns:
+        tuple: (keywords, plans, limits), one entry per query.
+    """
+    queries = message.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise ValueError("queries must be a non-empty list")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise ValueError(f"A batch holds at most {BATCH_MAX_QUERIES} queries")
+    default_limit = get_page_bounds(message)[1]  # Only the limit applies to batches
+    keywords, plans, limits = [], [], []
+    for number, query in enumerate(queries, start=1):
+        if isinstance(query, str):
+            query = {"keyword": query}
+        if not isinstance(query, dict):
+            raise ValueError(f"Query {number} must be a keyword or an object")
+        keyword = str(query.get("keyword", "")).strip()
+        if not keyword:
+            raise ValueError(f"Missing keyword in query {number}")
+        limit = get_page_bounds(query)[1]
+        keywords.append(keyword)
+        plans.append(compile_query(keyword, get_filter(query, "sheets"), get_filter(query, "columns")))
+        limits.append(default_limit if limit is None else limit)
+    return keywords, plans, limits
+
+def process_batch(message, response, send_frame, metrics):
+    """
+    Answers a batch request: every query is evaluated in one shared pass over the files,
+    and the results are returned grouped per query in a single "batch_results" frame.
+    
+    Args:
+        message (dict): The decoded request (see get_batch_queries for the queries).
+        response (dict): The fields shared by every frame of the response (id).
+        send_frame (callable): Sends one frame and records its metrics.
+        metrics (RequestMetrics): The metrics of the request.
+    """
+    with metrics.stage("parse"):
+        try:
+            keywords, plans, limits = get_batch_queries(message)
+            timeout = get_timeout(message)
+            error = None
+        except ValueError as e:
+            error = str(e)
+        search_target, extensions = get_target(message)
+    if error is not None:
+        send_frame(dict(response, type="error", status="error", error=error))
+        return
+    logging.debug(f"Batch search: search_target={search_target}, {len(plans)} queries, extensions={extensions}")
+
+    current_token().set_timeout(timeout)  # The deadline counts from the end of parsing
+    results, totals, stopped = search_batch(search_target, plans, ",".join(extensions), limits)
+    if stopped is not None:
+        logging.info(f"Batch search stopped ({stopped}) after {sum(map(len, results))} result(s)")
+        if stopped == "disconnected":
+            return  # Nobody is left to answer
+    answers = []
+    with metrics.stage("serialize"):
+        for keyword, query_results, total, limit in zip(keywords, results, totals, limits):
+            hits = sum(1 for result in query_results if isinstance(result, Hit))
+            answers.append({"keyword": keyword, "count": len(query_results), "total": total,
+                            "more": limit is not None and total > hits,
+                            "results": [result_to_dict(result) for result in query_results]})
+    metrics.results = sum(answer["count"] for answer in answers)
+    if stopped is not None:
+        response = dict(response, truncated=True, reason=stopped)
+    send_frame(dict(response, type="batch_results", status="ok", queries=answers))
+
+def iter_until_stopped(results, outcome):
+    """
+    Passes the results of a search through until its request is cut short by its deadline,
+    a CANCEL or a disconnection; the results found until then are kept.
+    
+    Args:
+        results (iterable): The results of the search.
+        outcome (dict): Receives "stopped" (the reason) if the search was cut short.
+        
+    Yields:
+        Hit or str: The results, up to the point where the search was stopped.
+    """
+    try:
+        yield from results
+    except RequestCancelled as e:
+        outcome["stopped"] = e.reason
+
+def stream_results(results, response, send):
+    """
+    Sends results in batch frames as they are found.
+    The first result is sent on its own, then batches of up to STREAM_BATCH_SIZE results,
+    flushed at least every STREAM_BATCH_DELAY seconds while results keep coming.
+    
+    Args:
+        results (iterable): The results to send (Hit objects or message strings).
+        response (dict): The fields shared by every frame of the response (type, id).
+        send (callable): send(dict) writes one frame to the client.
+        
+    Returns:
+        int: The number of results sent.
+    """
+    batch = []                        # Results waiting to be sent
+    count = 0                         # Results sent so far
+    last_flush = time.monotonic()     # When the previous batch was sent
+    metrics = current_metrics()
+    for result in results:
+        with metrics.stage("serialize"):
+            batch.append(result_to_dict(result))
+        count += 1
+        now = time.monotonic()
+        if count == 1 or len(batch) >= STREAM_BATCH_SIZE or now - last_flush >= STREAM_BATCH_DELAY:
+            send(dict(response, type="batch", results=batch))
+            batch = []
+            last_flush = now
+    if batch:
+        send(dict(response, type="batch", results=batch))
+    return count
+
+def handle_message(message, send, token=None):
+    """
+    Handles a framed request.
+    
+    Args:
+        message (dict): The decoded request. Searches look like
+            {"type": "search", "target": "ALL", "keyword": "...", "extensions": [".txt"]}
+            with optional "offset"/"limit" pagination, "stream": true to receive the results
+            in "batch" frames followed by an "end" frame, and "sheets"/"columns" lists
+            restricting the Excel cells searched. "rank": true returns the "k" most relevant
+            matches instead, best first, each with a "score". Batch requests
+            {"type": "batch", "queries": [...], "target": ..., "extensions": [...]} evaluate
+            several queries in one pass (see process_batch). Searches and batches may set a
+            "timeout" in seconds (REQUEST_TIMEOUT otherwise); a search cut short by its
+            deadline or by a CANCEL returns the results found so far, its last frame carrying
+            "truncated": true and the "reason" ("deadline" or "cancelled").
+        send (callable): send(dict) writes one response frame to the client and returns the
+            number of bytes written.
+        token (CancelToken): The token the connection uses to stop the request, or None.
+        
+    Returns:
+        bool: False if the client asked to close the connection (or is gone).
+    """
+    request_type = message.get("type", "search")
+    metrics = METRICS.begin(str(request_type))  # Stage timings and counters of this request
+    token = token or CancelToken()
+    token.set_timeout(REQUEST_TIMEOUT)  # Replaced by the "timeout" of the request once parsed
+    activate_token(token)
+    try:
+        return process_message(message, request_type, send, metrics)
+    finally:
+        activate_token(None)
+        METRICS.finish(metrics)
+
+def process_message(message, request_type, send, metrics):
+    """
+    Answers a framed request (see handle_message) while recording its metrics.
+    
+    Args:
+        message (dict): The decoded request.
+        request_type (str): The request type.
+        send (callable): send(dict) writes one response frame to the client.
+        metrics (RequestMetrics): The metrics of the request.
+        
+    Returns:
+        bool: False if the client asked to close the connection.
+    """
+    def send_frame(frame):
+        """
+        Sends a frame, counting its encoding and writing as serialization time.
+        """
+        with metrics.stage("serialize"):
+            metrics.bytes_sent += send(frame) or 0
+        if frame.get("type") == "error":
+            metrics.error = True
+
+    response = {}
+    if "id" in message:
+        response["id"] = message["id"]  # Lets the client match responses to requests
+    if request_type == "quit":
+        return False
+    if request_type == "stats":
+        send_frame(dict(response, type="stats", status="ok", stats=get_stats()))
+        return True
+    if request_type == "batch":
+        process_batch(message, response, send_frame, metrics)
+        return True
+    if request_type != "search":
+        send_frame(dict(response, type="error", status="error", error=f"Unknown request type: {request_type}"))
+        return True
+
+    with metrics.stage("parse"):
+        keyword = str(message.get("keyword", "")).strip()
+        try:
+            if not keyword:
+                raise ValueError("Missing keyword")
+            offset, limit = get_page_bounds(message)
+            rank_size = get_rank_size(message)
+            timeout = get_timeout(message)
+            plan = compile_query(keyword, get_filter(message, "sheets"), get_filter(message, "columns"))
+            error = None
+        except ValueError as e:
+            error = str(e)
+        search_target, extensions = get_target(message)
+    if error is not None:
+        send_frame(dict(response, type="error", status="error", error=error))
+        return True
+    logging.debug(f"Framed search: search_target={search_target}, keyword={keyword}, extensions={extensions}, offset={offset}, limit={limit}, sheets={plan.sheets}, columns={plan.columns}, rank={rank_size}, timeout={timeout}")
+
+    current_token().set_timeout(timeout)  # The deadline counts from the end of parsing
+    outcome = {}  # Receives "stopped" if the search is cut short
+    if rank_size is not None:
+        results = iter_ranked_cached(search_target, plan, ",".join(extensions), rank_size)
+    else:
+        results = iter_search_cached(search_target, plan, ",".join(extensions))
+    results = iter_until_stopped(results, outcome)
+    # Only the requested page is pulled from the generators, so scanning stops once it is full
+    page = itertools.islice(results, offset, None if limit is None else offset + limit)
+    if message.get("stream"):
+        count = stream_results(page, response, send_frame)
+    else:
+        with metrics.stage("serialize"):
+            page = [result_to_dict(result) for result in page]
+        count = len(page)
+    # Peek at one more result to tell the client whether another page exists
+    more = limit is not None and next(results, None) is not None
+    metrics.results = count
+    stopped = outcome.get("stopped")
+    if stopped is not None:
+        logging.info(f"Search for {keyword!r} stopped ({stopped}) after {count} result(s)")
+        if stopped == "disconnected":
+            return False  # Nobody is left to answer
+        # Partial results: say so, and why, in the last frame
+        response = dict(response, truncated=True, reason=stopped)
+    if message.get("stream"):
+        send_frame(dict(response, type="end", status="ok", count=count, offset=offset, more=more))
+    else:
+        send_frame(dict(response, type="results", status="ok", count=count, offset=offset, more=more, results=page))
+    return True
+
+def handle_legacy_message(client_msg, token=None):
+    """
+    Handles an unframed "<search_target>|<keyword>|<file_extension>" request.
+    The search runs under REQUEST_TIMEOUT; a search cut short returns the results found so
+    far followed by a line saying why they are incomplete.
+    
+    Args:
+        client_msg (str): The request text (None if it was not valid UTF-8).
+        token (CancelToken): The token the connection uses to stop the request, or None.
+        
+    Returns:
+        str: The response text.
+    """
+    metrics = METRICS.begin("legacy")
+    token = token or CancelToken()
+    token.set_timeout(REQUEST_TIMEOUT)
+    activate_token(token)
+    try:
+        response = process_legacy_message(client_msg, metrics)
+        with metrics.stage("serialize"):
+            metrics.bytes_sent = len(response.encode('utf-8'))
+        return response
+    finally:
+        activate_token(None)
+        METRICS.finish(metrics)
+
+def process_legacy_message(client_msg, metrics):
+    """
+    Answers an unframed request (see handle_legacy_message) while recording its metrics.
+    
+    Args:
+        client_msg (str): The request text.
+        metrics (RequestMetrics): The metrics of the request.
+        
+    Returns:
+        str: The response text.
+    """
+    if client_msg is None:
+        metrics.error = True
+        return LEGACY_ENCODING_ERROR
+    if client_msg.strip() == STATS_MSG:
+        # If the client asks for statistics, send them as JSON
+        metrics.kind = "stats"
+        return json.dumps(get_stats(), indent=2)
+    try:
+        with metrics.stage("parse"):
+            # Parse the received message assuming format: <search_target>|<keyword>|<file_extension>
+            search_target, keyword, file_extension = parse_legacy(client_msg)
+            plan = compile_query(keyword)
+        logging.debug(f"Parsed: search_target={search_target}, keyword={keyword}, file_extension={file_extension}")
+        # Handle the search based on parsed components
+        outcome = {}  # Receives "stopped" if the search is cut short
+        results = list(iter_until_stopped(iter_search_cached(search_target, plan, file_extension), outcome))
+        metrics.results = len(results)
+        if "stopped" in outcome:
+            logging.info(f"Search for {keyword!r} stopped ({outcome['stopped']}) after {len(results)} result(s)")
+            results.append(truncation_message(outcome["stopped"]))
+        # Join the list of results into a single string separated by newlines
+        with metrics.stage("serialize"):
+            return "\n".join(str(result) for result in results)
+    except ValueError:
+        # If message format is incorrect, prepare an error message
+        metrics.error = True
+        return LEGACY_FORMAT_ERROR
+
+def apply_cancel(request_id, tracker):
+    """
+    Applies a CANCEL read from a connection: it stops the request with that id (the running
+    one when request_id is None), which answers with the results found so far.
+    
+    Args:
+        request_id: The id the CANCEL names, or None.
+        tracker (RequestTracker): The requests of the connection.
+    """
+    stopped = tracker.cancel(request_id)
+    logging.debug(f"Cancel received for request {request_id}: {'stopping it' if stopped else 'not running'}")
+
+def cancel_request(request, tracker):
+    """
+    Applies a request if it is a CANCEL: {"type": "cancel", "id": ...}, or the legacy text "CANCEL".
+    
+    Args:
+        request (tuple): (framed, message) as returned by recv_request.
+        tracker (RequestTracker): The requests of the connection.
+        
+    Returns:
+        bool: True if the request was a CANCEL (it gets no response of its own).
+    """
+    is_cancel, request_id = parse_cancel(request)
+    if is_cancel:
+        apply_cancel(request_id, tracker)
+    return is_cancel
+
+def handle_client(client_socket):
+    """
+    Handles communication with a connected client.
+    Requests are read by a second thread while the current one is answered, so a CANCEL
+    or the client closing the connection stops the search in progress.
+    
+    Args:
+        client_socket (socket.socket): The client's socket connection.
+    """
+    requests = queue.Queue()            # Requests read ahead, then None (or a ProtocolError) at the end
+    tracker = RequestTracker()          # The request being answered, for CANCEL and disconnections
+    disconnected = threading.Event()    # Set when the client is gone: queued requests are dropped
+
+    def read_requests():
+        """
+        Reads the requests of the connection, applying CANCEL requests at once.
+        """
+        try:
+            while True:
+                # Receive the next request, framed or in the legacy text form
+                request = recv_request(client_socket)
+                if request is None:
+                    break
+                if not cancel_request(request, tracker):
+                    requests.put(request)
+        except ProtocolError as e:
+            requests.put(e)
+        except OSError:
+            pass  # The socket was closed by the handler
+        finally:
+            disconnected.set()
+            tracker.cancel(reason="disconnected")  # Nobody will read the answer of the running request
+            requests.put(None)
+
+    reader = threading.Thread(target=read_requests, daemon=True)
+    reader.start()
+    try:
+        while True:
+            request = requests.get()
+            if isinstance(request, ProtocolError):
+                raise request
+            if request is None or disconnected.is_set():
+                logging.debug("Client closed the connection.")
+                break
+            framed, client_msg = request
+            logging.debug(f"Received message: {client_msg}")
+            if framed:
+                token = tracker.start(client_msg.get("id"))
+                try:
+                    keep_open = handle_message(client_msg, lambda response: send_message(client_socket, response), token)
+                finally:
+                    tracker.finish()
+                if not keep_open:
+                    logging.debug("Termination message received. Closing connection.")
+                    break
+                continue
+            if client_msg == ENDING_MSG:
+                # If the client sends the termination message, break the loop to close connection
+                logging.debug("Termination message received. Closing connection.")
+                break
+            token = tracker.start()
+            try:
+                response = handle_legacy_message(client_msg, token)
+            finally:
+                tracker.finish()
+            # Send the response back to the client encoded in UTF-8
+            client_socket.sendall(response.encode('utf-8'))
+    except ProtocolError as e:
+        # Log malformed frames; the connection cannot be resynchronized, so it is closed
+        logging.error(f"Protocol error from client: {e}")
+    except Exception as e:
+        # Log any unexpected errors while handling the client
+        logging.error(f"Error handling client: {e}")
+    finally:
+        # Ensure the client socket is closed when done; shutting it down first wakes up the reader thread
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Already disconnected
+        client_socket.close()
+        logging.debug("Client connection closed.")
+
+def shutdown_services():
+    """
+    Releases the shared resources (folder watcher, worker processes, index) when the server stops.
+    """
+    stop_watcher()
+    set_scan_workers(1)  # Stops the scan worker processes, if any
+    if USE_INDEX:
+        SEARCH_INDEX.save()
+
+def watch_stdin(stop, stopped):
+    """
+    Calls stop() when the user types 'q' on the server console.
+    Runs in a separate daemon thread, which returns once stopped is set.
+    
+    Args:
+        stop (callable): Function that initiates the shutdown.
+        stopped (threading.Event): Set when the server has stopped for any reason.
+    """
+    while not stopped.is_set():
+        try:
+            if os.name != "nt":
+                # Poll, so the thread is not stuck inside a read when the interpreter exits
+                readable, _, _ = select.select([sys.stdin], [], [], 0.5)
+                if not readable:
+                    continue
+            line = sys.stdin.readline()
+        except (OSError, ValueError):
+            return  # No usable console: use signals to stop the server
+        if not line:
+            return  # End of input (e.g. started in the background)
+        if line.strip().lower() == 'q':
+            print("[Server] Shutting down.")
+            logging.info("Server shutdown initiated by user.")
+            stop()
+            return
+
+def install_signal_handlers(stop):
+    """
+    Calls stop() on SIGINT/SIGTERM, where the platform allows it.
+    
+    Args:
+        stop (callable): Function that initiates the shutdown.
+    """
+    for sig_name in ("SIGINT", "SIGTERM"):
+        if hasattr(signal, sig_name):
+            signal.signal(getattr(signal, sig_name), lambda signum, frame: stop())
+
+def serve_threaded(host, port, backlog):
+    """
+    Runs the server with one thread per connection.
+    
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        backlog (int): The accept backlog.
+    """
+    stopping = threading.Event()  # Set when the server is asked to stop
+    console = None                # Thread watching the console for 'q'
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        try:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))      # Bind the server to the specified host and port
+            server.listen(backlog)         # Listen for incoming connections
+            server.settimeout(0.5)         # Wake up regularly to notice a shutdown request
+            print(f"[Server] Running on {host}:{port}. Press 'q' to stop.")
+            logging.info(f"Server started on {host}:{port} (threaded mode)")
+
+            def stop_server():
+                """
+                Asks the accept loop to stop.
+                """
+                stopping.set()
+
+            # Watch the console for 'q' in a separate daemon thread, and stop on signals too
+            console = threading.Thread(target=watch_stdin, args=(stop_server, stopping), daemon=True)
+            console.start()
+            install_signal_handlers(stop_server)
+
+            while not stopping.is_set():
+                # Accept an incoming client connection
+                try:
+                    client_socket, addr = server.accept()
+                except socket.timeout:
+                    continue  # No connection yet: check the stop flag again
+                logging.info(f"Accepted connection from {addr}")
+                # Start a new thread to handle the connected client
+                threading.Thread(target=handle_client, args=(client_socket,), daemon=True).start()
+        except Exception as e:
+            # Log any errors that occur during server setup or execution
+            logging.error(f"Server error: {e}")
+            print(f"[Server] Error: {e}")
+    stopping.set()
+    if console is not None:
+        console.join(1.0)
+    shutdown_services()
+
+async def handle_client_async(reader, writer, executor):
+    """
+    Handles communication with a connected client on the event loop.
+    Searches run on the bounded executor, so a slow search never blocks other clients.
+    While a search runs the connection keeps being read, so a CANCEL or the client closing
+    the connection stops it; other requests received meanwhile are answered afterwards.
+    
+    Args:
+        reader (asyncio.StreamReader): The client stream.
+        writer (asyncio.StreamWriter): The client stream writer.
+        executor (ThreadPoolExecutor): The executor running the searches.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def write_frame(response):
+        """
+        Writes one frame and waits until the client has room for more.
+        """
+        frame = encode_frame(response)
+        writer.write(frame)
+        await writer.drain()
+        return len(frame)
+
+    def send(response):
+        """
+        Sends a frame from the executor thread running the search (blocks while the client is slow).
+        """
+        return asyncio.run_coroutine_threadsafe(write_frame(response), loop).result()
+
+    tracker = RequestTracker()  # The request being answered, for CANCEL and disconnections
+
+    async def run(function, *args):
+        """
+        Runs a request handler on the executor. If the client goes away meanwhile, the
+        search is told to stop and is waited for, so the executor stays bounded.
+        """
+        work = loop.run_in_executor(executor, function, *args)
+        try:
+            return await asyncio.shield(work)
+        except asyncio.CancelledError:
+            tracker.cancel(reason="disconnected")  # Nobody will read the answer
+            await asyncio.wait([work])
+            raise
+
+    async def answer(framed, client_msg):
+        """
+        Answers one request on the executor and writes the response.
+        """
+        token = tracker.start(client_msg.get("id") if framed else None)
+        try:
+            if framed:
+                return await run(handle_message, client_msg, send, token)
+            response = await run(handle_legacy_message, client_msg, token)
+        finally:
+            tracker.finish()
+        writer.write(response.encode('utf-8'))
+        await writer.drain()  # Apply back-pressure when the client reads slowly
+        return True
+
+    await serve_connection(reader, writer, answer, lambda request_id: apply_cancel(request_id, tracker))
+
+async def serve_asyncio(host, port, backlog, max_connections, search_threads):
+    """
+    Runs the server on a single event loop.
+    
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        backlog (int): The accept backlog.
+        max_connections (int): Connections served at once; extra ones are closed immediately.
+        search_threads (int): Size of the executor running the searches.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()                                     # Set when the server is asked to stop
+    executor = ThreadPoolExecutor(max_workers=search_threads)  # Bounded pool for CPU-heavy searches
+    clients = set()                                            # Tasks of the connected clients
+
+    async def on_connect(reader, writer):
+        """
+        Accepts a connection if the connection limit allows it.
+        """
+        addr = writer.get_extra_info("peername")
+        if len(clients) >= max_connections:
+            logging.warning(f"Refused connection from {addr}: {max_connections} connections already open")
+            writer.close()
+            return
+        logging.info(f"Accepted connection from {addr}")
+        task = asyncio.current_task()
+        clients.add(task)
+        try:
+            await handle_client_async(reader, writer, executor)
+        finally:
+            clients.discard(task)
+
+    server = await asyncio.start_server(on_connect, host, port, backlog=backlog, reuse_address=True)
+    print(f"[Server] Running on {host}:{port}. Press 'q' to stop.")
+    logging.info(f"Server started on {host}:{port} (asyncio mode)")
+
+    # Stop on 'q' from the console and on SIGINT/SIGTERM
+    stopped = threading.Event()
+    console = threading.Thread(target=watch_stdin, args=(lambda: loop.call_soon_threadsafe(stop.set), stopped),
+                               daemon=True)
+    console.start()
+    install_signal_handlers(lambda: loop.call_soon_threadsafe(stop.set))
+
+    async with server:
+        await stop.wait()
+        server.close()  # Stop accepting new connections
+        if clients:
+            # Let in-flight requests finish, then drop whatever is left
+            done, pending = await asyncio.wait(set(clients), timeout=SHUTDOWN_GRACE)
+            for task in pending:
+                task.cancel()
+    executor.shutdown(wait=False, cancel_futures=True)
+    stopped.set()
+    console.join(1.0)
+    logging.info("Server stopped.")
+
+def main():
+    """
+    The main function to start the server, listen for incoming connections,
+    and handle client requests.
+    """
+    parser = argparse.ArgumentParser(description="Multi-format search server.")
+    parser.add_argument("--host", default=HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on")
+    parser.add_argument("--mode", choices=["asyncio", "threaded"], default=SERVER_MODE, help="Connection handling mode")
+    parser.add_argument("--backlog", type=int, default=ACCEPT_BACKLOG, help="Accept backlog")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS, help="Connections served at once (asyncio mode)")
+    parser.add_argument("--search-threads", type=int, default=SEARCH_THREADS, help="Searches running at once (asyncio mode)")
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS, help="Scan worker processes")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_DUMP_INTERVAL,
+                        help=f"Seconds between two statistics dumps to {METRICS_DUMP_FILE} (0 disables them)")
+    parser.add_argument("--no-watch", dest="watch", action="store_false", default=WATCH_FOLDERS,
+                        help="Check the folders on every query instead of watching them in the background")
+    parser.add_argument("--watch-backend", choices=["auto", "inotify", "poll"], default=WATCH_BACKEND,
+                        help="How the folder watcher detects changes")
+    parser.add_argument("--watch-rate", type=float, default=WATCH_RATE, help="Changed files re-extracted per second at most")
+    parser.add_argument("--shard", help="Search only share index/count of the files (e.g. 0/2), behind coordinator.py")
+    parser.add_argument("--shard-by", choices=SHARD_MODES, default=SHARD_BY, help="How the files are split between the shards")
+    parser.add_argument("--snapshot", default=SNAPSHOT_FILE, help="Corpus snapshot written by pack.py")
+    parser.add_argument("--no-snapshot", dest="use_snapshot", action="store_false", default=USE_SNAPSHOT,
+                        help="Extract every file from the documents, ignoring the snapshot")
+    args = parser.parse_args()
+
+    if args.shard:
+        try:
+            set_shard(*parse_shard(args.shard), args.shard_by)
+        except ValueError as e:
+            parser.error(str(e))
+    set_scan_workers(args.workers)
+    if args.use_snapshot:
+        # Mapped before the index refresh and the watcher, so unchanged files are never extracted
+        open_snapshot(args.snapshot)
+    stopped = threading.Event()  # Ends the metrics dumps when the server stops
+    if args.metrics_interval > 0:
+        start_dump_thread(get_stats, METRICS_DUMP_FILE, args.metrics_interval, stopped)
+    if args.watch:
+        # Started before the initial refresh so that no change made meanwhile is missed
+        start_watcher(args.watch_backend, args.watch_rate)
+    if USE_INDEX:
+        # Load the persisted index and re-extract only what changed while the server was down
+        SEARCH_INDEX.load()
+        SEARCH_INDEX.refresh()
+
+    if args.mode == "threaded":
+        serve_threaded(args.host, args.port, args.backlog)
+    else:
+        try:
+            asyncio.run(serve_asyncio(args.host, args.port, args.backlog, args.max_connections, args.search_threads))
         except Exception as e:
             # Log any errors that occur during server setup or execution
             logging.error(f"Server error: {e}")
             print(f"[Server] Error: {e}")
+        finally:
+            shutdown_services()
+    stopped.set()
+    print("[Server] Stopped.")
 
 if __name__ == "__main__":
     main()  # Execute the main function when the script is run directly
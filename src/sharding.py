@@ -0,0 +1,48 @@
+# sharding.py
+
+import os                   # For the file names
+import zlib                 # Stable hash of the file names (hash() is salted per process)
+
+SHARD_MODES = ("hash", "format")  # How the files are split between the shards
+
+def parse_shard(value):
+    """
+    Parses a shard specification such as "0/3" (first of three shards).
+
+    Args:
+        value (str): "index/count", with 0 <= index < count.
+
+    Returns:
+        tuple: (index, count).
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected index/count (e.g. 0/2)")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {value!r}: the index must be between 0 and count - 1")
+    return index, count
+
+def shard_of(file_path, extension, count, by="hash", extensions=()):
+    """
+    Tells which shard owns a file. The coordinator and the shard servers use the same
+    function, so a file is searched by exactly one shard and a search of one specific file
+    is sent to its owner only.
+
+    Args:
+        file_path (str): The path to the file (only its name is used, so every process
+            agrees whatever its data directory).
+        extension (str): The file extension.
+        count (int): The number of shards.
+        by (str): "hash" to spread the files of every type over all the shards, or "format"
+            to give each file type to one shard.
+        extensions (sequence): The file types in configuration order, for "format".
+
+    Returns:
+        int: The index of the owning shard.
+    """
+    if count <= 1:
+        return 0
+    if by == "format" and extension in extensions:
+        return list(extensions).index(extension) % count
+    return zlib.crc32(os.path.basename(file_path).encode('utf-8')) % count
@@ -0,0 +1,312 @@
+# snapshot.py
+
+import os                   # For the atomic replacement of the snapshot file
+import sys                  # To check the byte order of the offset tables
+import mmap                 # The snapshot is mapped into memory, not read
+import struct               # To pack and unpack the header
+import json                 # For the file table and the unit locations
+import array                # Offset tables of the writer
+import bisect               # To find the unit holding a byte offset
+import shutil               # To append the staged locations to the snapshot
+import tempfile             # Locations are staged in a temporary file while the texts are written
+from collections import namedtuple  # For the entries of the file table
+from collections.abc import Sequence  # The units of a file behave like the list an extractor returns
+
+# The snapshot starts with MAGIC, the format version, the number of units and the offset of
+# every section (little-endian): texts, locations, text end offsets, location end offsets and
+# the file table (with its length)
+MAGIC = b"SAESNAP"
+SNAPSHOT_VERSION = 2
+HEADER = struct.Struct("<7sBQQQQQQQ")
+TEXT_ENCODING = ("utf-8", "surrogatepass")  # Keeps every extracted string, even with lone surrogates
+DECODE_CHUNK = 4096         # Units decoded at once when the units of a file are iterated
+
+class SnapshotFile(namedtuple("SnapshotFile", ["ext", "mtime", "size", "first", "count"])):
+    """
+    Entry of the file table.
+
+    Fields:
+        ext (str): The file extension.
+        mtime (int): The modification time of the packed version, in nanoseconds.
+        size (int): The size of the packed version, in bytes.
+        first (int): The index of the first unit of the file.
+        count (int): The number of units of the file.
+    """
+    __slots__ = ()
+
+def write_snapshot(path, files, extract_many, batch_size=16):
+    """
+    Extracts files and packs all their text units into one snapshot file: the texts one
+    after the other, then their locations, then two offset tables giving where each unit
+    ends, and the file table. The file is written next to its destination and renamed, so
+    a running server keeps its mapping of the previous snapshot.
+
+    Args:
+        path (str): The snapshot file to write.
+        files (list): (file_path, extension) tuples, in the order they are packed.
+        extract_many (callable): extract_many([(path, extension), ...]) -> one (units, error)
+            tuple per file, as InvertedIndex takes it.
+        batch_size (int): Files extracted at once (in parallel when extract_many uses workers).
+
+    Returns:
+        tuple: (packed, errors): the number of files packed, and (file_path, error) for the
+            files that could not be extracted (they are left out and extracted by the server).
+    """
+    tmp_path = path + ".tmp"
+    text_ends = array.array("Q")        # End of every text, from the start of the texts
+    location_ends = array.array("Q")    # End of every location, from the start of the locations
+    table = []                          # [path, ext, mtime, size, first unit, unit count]
+    errors = []
+    text_size = location_size = 0
+    with open(tmp_path, 'wb') as out, tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as locations:
+        out.write(b"\0" * HEADER.size)  # Written last, once the offsets are known
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            signatures = []
+            for file_path, extension in batch:
+                try:
+                    stat = os.stat(file_path)  # Taken before extraction: a file changed meanwhile is re-extracted later
+                    signatures.append((stat.st_mtime_ns, stat.st_size))
+                except OSError as e:
+                    signatures.append(e)
+            for (file_path, extension), signature, (units, error) in zip(batch, signatures, extract_many(batch)):
+                if isinstance(signature, OSError) or error is not None:
+                    errors.append((file_path, error or signature))
+                    continue
+                first = len(text_ends)
+                for location, text in units:
+                    data = text.encode(*TEXT_ENCODING)
+                    out.write(data)
+                    text_size += len(data)
+                    text_ends.append(text_size)
+                    # Each location ends with a comma, so a run of them is decoded as one JSON array
+                    data = json.dumps(list(location), ensure_ascii=False, separators=(",", ":")).encode('utf-8') + b","
+                    locations.write(data)
+                    location_size += len(data)
+                    location_ends.append(location_size)
+                table.append([file_path, extension, signature[0], signature[1], first, len(text_ends) - first])
+
+        texts_offset = HEADER.size
+        locations_offset = texts_offset + text_size
+        locations.seek(0)
+        shutil.copyfileobj(locations, out)
+        out.write(b"\0" * (-out.tell() % 8))  # Align the offset tables
+        offsets = []
+        for table_data in (text_ends, location_ends):
+            offsets.append(out.tell())
+            if sys.byteorder != "little":
+                table_data = array.array("Q", table_data)
+                table_data.byteswap()
+            table_data.tofile(out)
+        files_offset = out.tell()
+        data = json.dumps(table, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+        out.write(data)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(text_ends), texts_offset, locations_offset,
+                              offsets[0], offsets[1], files_offset, len(data)))
+    os.replace(tmp_path, path)
+    return len(table), errors
+
+class Snapshot:
+    """
+    Read-only view of a snapshot written by write_snapshot. Opening it maps the file and
+    reads the header and the file table only: a text unit is decoded when a search reaches
+    it, and literal keywords are searched in the mapped bytes directly, so units without a
+    match are never copied out of the mapping.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The snapshot file.
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self.unit_count, self.texts_offset, self.locations_offset, text_ends_offset,
+             location_ends_offset, files_offset, files_length) = HEADER.unpack_from(self.buffer, 0)
+            if magic != MAGIC:
+                raise ValueError("not a corpus snapshot")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"unsupported version {version}")
+            self.view = memoryview(self.buffer)
+            self.text_ends = self._offsets(text_ends_offset)          # End of every text, from texts_offset
+            self.location_ends = self._offsets(location_ends_offset)  # End of every location, from locations_offset
+            table = json.loads(str(self.view[files_offset:files_offset + files_length], 'utf-8'))
+            self.files = {entry[0]: SnapshotFile(*entry[1:]) for entry in table}  # Path -> SnapshotFile
+        except (struct.error, ValueError, TypeError) as e:
+            self.close()
+            raise ValueError(f"Invalid snapshot {path}: {e}")
+
+    def _offsets(self, offset):
+        """
+        Returns an offset table, as a view of the mapping when the byte order allows it.
+        """
+        table = self.view[offset:offset + 8 * self.unit_count]
+        if len(table) != 8 * self.unit_count:
+            raise ValueError("truncated offset table")
+        if sys.byteorder == "little":
+            return table.cast("Q")
+        swapped = array.array("Q", table.tobytes())
+        swapped.byteswap()
+        return swapped
+
+    def close(self):
+        """
+        Unmaps the snapshot; its units must not be used afterwards.
+        """
+        for name in ("text_ends", "location_ends", "view"):
+            table = getattr(self, name, None)
+            if isinstance(table, memoryview):
+                table.release()
+        try:
+            self.buffer.close()
+        except BufferError:
+            pass  # A view is still referenced (e.g. by a traceback): the mapping goes with it
+
+    def stats(self):
+        """
+        Returns the size of the snapshot.
+
+        Returns:
+            dict: The path, number of files and units, and size in bytes.
+        """
+        return {"path": self.path, "files": len(self.files), "units": self.unit_count, "bytes": len(self.buffer)}
+
+    def get(self, file_path, signature):
+        """
+        Returns the units of a file, if the snapshot holds its current version.
+
+        Args:
+            file_path (str): The path to the file.
+            signature (tuple): The current (mtime in nanoseconds, size) of the file.
+
+        Returns:
+            SnapshotUnits: The units of the file, or None if it is missing or has changed since it was packed.
+        """
+        entry = self.files.get(file_path)
+        if entry is None or (entry.mtime, entry.size) != tuple(signature):
+            return None
+        return SnapshotUnits(self, entry.first, entry.count)
+
+    def text_start(self, index):
+        """
+        Returns the offset of the text of a unit in the mapping.
+        """
+        return self.texts_offset + (self.text_ends[index - 1] if index else 0)
+
+    def text_end(self, index):
+        """
+        Returns the offset just after the text of a unit in the mapping.
+        """
+        return self.texts_offset + self.text_ends[index]
+
+    def unit(self, index):
+        """
+        Decodes one unit.
+
+        Args:
+            index (int): The index of the unit in the snapshot.
+
+        Returns:
+            tuple: (location, text), as the extractors return it.
+        """
+        text = str(self.view[self.text_start(index):self.text_end(index)], *TEXT_ENCODING)
+        start = self.locations_offset + (self.location_ends[index - 1] if index else 0)
+        location = json.loads(str(self.view[start:self.locations_offset + self.location_ends[index] - 1], 'utf-8'))
+        return tuple(location), text
+
+    def units(self, start, stop):
+        """
+        Decodes consecutive units, parsing their locations at once.
+
+        Args:
+            start (int): The index of the first unit.
+            stop (int): The index after the last unit.
+
+        Returns:
+            list: The (location, text) tuples of the units.
+        """
+        if start >= stop:
+            return []
+        view = self.view
+        ends = self.text_ends
+        begin = self.locations_offset + (self.location_ends[start - 1] if start else 0)
+        locations = json.loads(b"[" + view[begin:self.locations_offset + self.location_ends[stop - 1] - 1] + b"]")
+        position = self.text_start(start)
+        offset = self.texts_offset
+        units = []
+        for index, location in zip(range(start, stop), locations):
+            end = offset + ends[index]
+            units.append((tuple(location), str(view[position:end], *TEXT_ENCODING)))
+            position = end
+        return units
+
+class SnapshotUnits(Sequence):
+    """
+    The units of one packed file, decoded from the mapping on access.
+    """
+
+    def __init__(self, snapshot, first, count):
+        """
+        Args:
+            snapshot (Snapshot): The snapshot holding the units.
+            first (int): The index of the first unit of the file.
+            count (int): The number of units of the file.
+        """
+        self.snapshot = snapshot
+        self.first = first
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step == 1:
+                return self.snapshot.units(self.first + start, self.first + max(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("unit index out of range")
+        return self.snapshot.unit(self.first + index)
+
+    def __iter__(self):
+        last = self.first + self.count
+        for start in range(self.first, last, DECODE_CHUNK):
+            yield from self.snapshot.units(start, min(start + DECODE_CHUNK, last))
+
+    def __reduce__(self):
+        # Pickled (e.g. to cross a process boundary) as the plain list it stands for
+        return list, (list(self),)
+
+    def matching(self, pattern):
+        """
+        Yields the units where a bytes pattern matches, searching the mapped texts of the
+        file directly. A match spanning two units yields the first one: callers check the
+        decoded text of every unit yielded.
+
+        Args:
+            pattern (re.Pattern): A compiled bytes pattern (e.g. the UTF-8 keywords of a literal query).
+
+        Yields:
+            tuple: (location, text) of each unit holding the start of a match, in file order.
+        """
+        if not self.count:
+            return
+        snapshot = self.snapshot
+        last = self.first + self.count
+        position = snapshot.text_start(self.first)
+        end = snapshot.text_end(last - 1)
+        while position < end:
+            match = pattern.search(snapshot.buffer, position, end)
+            if match is None:
+                return
+            index = bisect.bisect_right(snapshot.text_ends, match.start() - snapshot.texts_offset, self.first, last)
+            if index == last:
+                return  # Empty match at the very end
+            yield snapshot.unit(index)
+            position = snapshot.text_end(index)  # One result per unit: continue with the next one
@@ -0,0 +1,295 @@
+# watcher.py
+
+import os                   # For listing the watched folders and reading inotify events
+import sys                  # To detect the platform
+import time                 # For the settle delay and the rate limit
+import struct               # To decode inotify events
+import select               # To wait for inotify events with a timeout
+import threading            # The watcher runs in background threads
+import logging              # For logging watcher activities and errors
+import ctypes               # To call inotify from the C library
+import ctypes.util          # To locate the C library
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")    # wd, mask, cookie, name length
+
+class Inotify:
+    """
+    Minimal inotify binding (Linux only) watching a set of directories.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}   # Watch descriptor -> directory
+
+    def add_watch(self, directory):
+        """
+        Starts watching a directory.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+        self.watches[wd] = directory
+
+    def read_events(self, timeout):
+        """
+        Waits up to timeout seconds for events.
+
+        Returns:
+            list: (directory, mask, name) tuples; directory is None on a queue overflow.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((self.watches.get(wd), mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def scan_folder(folder, extension):
+    """
+    Lists the files of one type in a folder with their signatures.
+
+    Returns:
+        dict: Path -> (mtime in nanoseconds, size); empty if the folder cannot be read.
+    """
+    files = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(extension) and entry.is_file():
+                    stat = entry.stat()
+                    files[os.path.join(folder, entry.name)] = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        pass
+    return files
+
+class FolderWatcher:
+    """
+    Finds new, changed and deleted files in the searched folders and hands them to callbacks
+    from a background thread, so documents are extracted and indexed off the request path.
+
+    Changes come from inotify where available and from periodic mtime/size polling
+    otherwise. A file is processed once it has not changed for settle seconds (so a file
+    being copied is extracted once), and at most rate files are processed per second.
+    """
+
+    def __init__(self, folders, on_change, on_delete, on_idle=None, rate=5.0, settle=0.5,
+                 poll_interval=2.0, backend="auto"):
+        """
+        Args:
+            folders (dict): Mapping of file extensions to their directories.
+            on_change (callable): on_change(path, extension) for a new or modified file.
+            on_delete (callable): on_delete(path, extension) for a deleted file.
+            on_idle (callable): Called once the pending changes have all been processed, or None.
+            rate (float): Largest number of files processed per second.
+            settle (float): Seconds a file must stay unchanged before it is processed.
+            poll_interval (float): Seconds between two scans with the polling backend.
+            backend (str): "inotify", "poll" or "auto" (inotify when available).
+        """
+        self.folders = folders              # Extension -> watched folder
+        self.on_change = on_change          # Called for new or modified files
+        self.on_delete = on_delete          # Called for deleted files
+        self.on_idle = on_idle              # Called when the queue drains
+        self.rate = rate                    # Files processed per second at most
+        self.settle = settle                # Quiet time required before processing a file
+        self.poll_interval = poll_interval  # Scan period of the polling backend
+        self.backend = backend              # Requested backend, resolved by start()
+        self.pending = {}                   # Path -> (extension, time of the last event)
+        self.condition = threading.Condition()  # Protects pending and wakes the worker
+        self.stopping = threading.Event()   # Set by stop()
+        self.threads = []                   # Monitor and worker threads
+        self.events = 0                     # Changes detected
+        self.processed = 0                  # Files handed to the callbacks
+        self.errors = 0                     # Callback failures
+
+    def start(self):
+        """
+        Starts the monitor and worker threads.
+        """
+        monitor = self._poll
+        if self.backend in ("auto", "inotify"):
+            try:
+                inotify = self._open_inotify()
+                monitor = lambda: self._watch(inotify)
+                self.backend = "inotify"
+            except (OSError, AttributeError) as e:
+                # Not Linux, no inotify in the C library, or a folder cannot be watched
+                if self.backend == "inotify":
+                    raise
+                logging.info(f"inotify unavailable ({e}), polling the folders every {self.poll_interval}s")
+                self.backend = "poll"
+        else:
+            self.backend = "poll"
+        for target in (monitor, self._work):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logging.info(f"Folder watcher started ({self.backend})")
+
+    def stop(self):
+        """
+        Stops the threads; pending changes are left to the next refresh.
+        """
+        self.stopping.set()
+        with self.condition:
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(2.0)
+
+    def stats(self):
+        """
+        Returns the watcher counters.
+
+        Returns:
+            dict: Backend, changes detected, files processed, pending files and errors.
+        """
+        with self.condition:
+            return {"backend": self.backend, "events": self.events, "processed": self.processed,
+                    "pending": len(self.pending), "errors": self.errors}
+
+    def _open_inotify(self):
+        """
+        Creates an inotify instance watching every folder.
+        """
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        inotify = Inotify()
+        try:
+            for folder in set(self.folders.values()):
+                inotify.add_watch(folder)
+        except OSError:
+            inotify.close()
+            raise
+        return inotify
+
+    def _queue(self, path, extension):
+        """
+        Records a change; the worker processes it once the file has settled.
+        """
+        with self.condition:
+            self.pending[path] = (extension, time.monotonic())
+            self.events += 1
+            self.condition.notify()
+
+    def _rescan(self, known):
+        """
+        Compares the folders with the previous scan and queues the differences.
+
+        Args:
+            known (dict): Extension -> {path: signature} of the previous scan (updated in place).
+        """
+        for extension, folder in self.folders.items():
+            current = scan_folder(folder, extension)
+            previous = known.get(extension, {})
+            for path, signature in current.items():
+                if previous.get(path) != signature:
+                    self._queue(path, extension)
+            for path in previous.keys() - current.keys():
+                self._queue(path, extension)
+            known[extension] = current
+
+    def _poll(self):
+        """
+        Polling backend: scans every folder every poll_interval seconds.
+        """
+        known = {extension: scan_folder(folder, extension) for extension, folder in self.folders.items()}
+        while not self.stopping.wait(self.poll_interval):
+            self._rescan(known)
+
+    def _watch(self, inotify):
+        """
+        inotify backend: queues the files named by the events of the watched folders.
+        """
+        extensions = {}  # Folder -> extensions stored in it
+        for extension, folder in self.folders.items():
+            extensions.setdefault(folder, []).append(extension)
+        try:
+            while not self.stopping.is_set():
+                for directory, mask, name in inotify.read_events(0.5):
+                    if directory is None or mask & IN_Q_OVERFLOW:
+                        # Events were lost: compare every folder with the files on disk instead
+                        logging.warning("inotify queue overflow, rescanning the folders")
+                        self._rescan({})
+                        continue
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        logging.warning(f"Watched folder {directory} was removed or moved")
+                        continue
+                    for extension in extensions.get(directory, []):
+                        if name.endswith(extension):
+                            self._queue(os.path.join(directory, name), extension)
+        except OSError as e:
+            logging.error(f"inotify error: {e}")
+        finally:
+            inotify.close()
+
+    def _work(self):
+        """
+        Processes the settled changes, at most rate files per second.
+        """
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        next_slot = time.monotonic()    # Earliest time the next file may be processed
+        busy = False                    # Whether files were processed since the last on_idle call
+        while not self.stopping.is_set():
+            with self.condition:
+                now = time.monotonic()
+                ready = [path for path, (extension, changed) in self.pending.items() if now - changed >= self.settle]
+                if not ready:
+                    if busy and not self.pending and self.on_idle:
+                        busy = False
+                        self.condition.release()
+                        try:
+                            self.on_idle()
+                        except Exception as e:
+                            logging.error(f"Watcher idle callback failed: {e}")
+                        finally:
+                            self.condition.acquire()
+                        continue
+                    # Sleep until the oldest pending change settles (or a new change arrives)
+                    oldest = min((changed for extension, changed in self.pending.values()), default=None)
+                    self.condition.wait(self.settle if oldest is None else max(0.01, oldest + self.settle - now))
+                    continue
+                path = min(ready, key=lambda p: self.pending[p][1])  # Oldest change first
+                extension, changed = self.pending.pop(path)
+
+            # Rate limit: extraction competes with the searches for CPU
+            delay = next_slot - time.monotonic()
+            if delay > 0 and self.stopping.wait(delay):
+                return
+            next_slot = max(next_slot, time.monotonic()) + interval
+            try:
+                if os.path.exists(path):
+                    self.on_change(path, extension)
+                else:
+                    self.on_delete(path, extension)
+            except Exception as e:
+                logging.error(f"Error processing {path}: {e}")
+                with self.condition:
+                    self.errors += 1
+            with self.condition:
+                self.processed += 1
+            busy = True
@@ -0,0 +1,52 @@
+# conftest.py
+
+import os                   # For the path of the sources
+import sys                  # To import the server modules, which live in src/ as scripts
+import pytest               # Fixtures shared by the tests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+DATA_FOLDERS = ("txt", "pdf", "html", "excel")  # Subfolders of data/ searched by the server
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """
+    Empty data/ layout in a temporary directory, which becomes the working directory
+    (the server folders are relative paths).
+    """
+    for folder in DATA_FOLDERS:
+        (tmp_path / "data" / folder).mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def server(corpus, monkeypatch):
+    """
+    The server module with fresh caches and index over the temporary corpus, and no watcher.
+    """
+    import server
+    from cache import ExtractionCache, ResultCache
+    from index import InvertedIndex
+    monkeypatch.setattr(server, "EXTRACTION_CACHE", ExtractionCache(server.EXTRACTION_CACHE_BYTES))
+    monkeypatch.setattr(server, "RESULT_CACHE", ResultCache(server.RESULT_CACHE_ENTRIES, server.RESULT_CACHE_TTL,
+                                                            server.RESULT_CACHE_MAX_RESULTS))
+    monkeypatch.setattr(server, "SEARCH_INDEX", InvertedIndex(
+        server.FOLDERS, server.get_units_many, server.INDEX_FILE, max_file_size=server.MMAP_THRESHOLD,
+        large_file_scanners={".txt": server.scan_txt_mmap}, use_trigrams=server.TRIGRAM_INDEX,
+        accept=server.owns_file))
+    monkeypatch.setattr(server, "WATCHER", None)
+    monkeypatch.setattr(server, "SNAPSHOT", None)
+    return server
+
+@pytest.fixture
+def write_txt(corpus):
+    """
+    Returns write(name, lines), which writes a TXT file of the temporary corpus and returns
+    its path as the server names it.
+    """
+    def write(name, lines):
+        path = os.path.join("data", "txt", name)
+        with open(corpus / path, 'w', encoding='utf-8') as file:
+            file.write("".join(f"{line}\n" for line in lines))
+        return path
+    return write
@@ -0,0 +1,37 @@
+# test_extraction_cache.py
+
+import os                   # To list the spill directory
+from cache import ExtractionCache, estimate_units_size  # Code under test
+
+UNITS = [(("Line", 1), "some text of a line")] * 20  # Units of a document
+
+def test_spills_outside_the_lock(tmp_path, monkeypatch):
+    cache = ExtractionCache(estimate_units_size(UNITS) * 2, str(tmp_path))
+    spill = cache._spill
+    spilled = []
+    def checked(key, signature, units):
+        assert not cache.lock.locked()  # Other requests must not wait for the disk
+        spilled.append(key)
+        spill(key, signature, units)
+    monkeypatch.setattr(cache, "_spill", checked)
+    for name in ("a", "b", "c"):
+        cache.put(name, (1,), UNITS)
+    assert spilled == ["a"]
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+    assert cache.lookup("a", (1,)) == UNITS and cache.stats()["disk_hits"] == 1
+
+def test_forgotten_file_drops_its_pages(server, tmp_path, monkeypatch):
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    cache = ExtractionCache(estimate_units_size(UNITS) * 2, str(spill_dir))
+    monkeypatch.setattr(server, "EXTRACTION_CACHE", cache)
+    path = os.path.join("data", "pdf", "report.pdf")
+    for page in range(1, 5):
+        cache.put((path, page), (1,), UNITS)  # Pages 1 and 2 are spilled
+    cache.put("other.txt", (1,), UNITS)  # Spills page 3
+    assert len(os.listdir(spill_dir)) == 3
+    server.forget_file(path, ".pdf")
+    for page in range(1, 5):
+        assert cache.lookup((path, page), (1,)) is None
+    assert cache.lookup("other.txt", (1,)) == UNITS
+    assert os.listdir(spill_dir) == []
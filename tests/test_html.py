@@ -0,0 +1,32 @@
+# test_html.py
+
+import os                   # For the paths of the HTML files
+import pytest               # For the parametrized documents
+from benchmark import HTML_CASES, reference_html_units  # Edge cases and the BeautifulSoup reference
+from corpus import generate_corpus  # Synthetic HTML documents
+
+GENERATED_FILES = 3         # Generated HTML documents compared with the reference
+CHUNK_SIZES = (None, 7, 1)  # Chunk sizes fed to the extractor (None for the default)
+
+@pytest.fixture(params=CHUNK_SIZES, ids=lambda size: f"chunks-{size or 'default'}")
+def extractor(request, corpus, monkeypatch):
+    """
+    The server module, with the HTML extractor reading chunks of each tested size.
+    """
+    import server
+    if request.param is not None:
+        monkeypatch.setattr(server, "HTML_CHUNK_SIZE", request.param)
+    return server
+
+@pytest.mark.parametrize("number", range(GENERATED_FILES))
+def test_generated_documents_match_the_reference(extractor, number):
+    generate_corpus(GENERATED_FILES, 20000, 0.05, 0, extensions=[".html"])
+    path = os.path.join(extractor.FOLDERS[".html"], f"synthetic_{number:04d}.html")
+    expected = reference_html_units(path)
+    assert expected and extractor.extract_html_units(path) == expected
+
+@pytest.mark.parametrize("case", HTML_CASES, ids=range(len(HTML_CASES)))
+def test_edge_cases_match_the_reference(extractor, corpus, case):
+    path = corpus / "case.html"
+    path.write_text(case, encoding='utf-8')
+    assert extractor.extract_html_units(str(path)) == reference_html_units(str(path))
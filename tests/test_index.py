@@ -0,0 +1,114 @@
+# test_index.py
+
+import os                   # For the path of the sources
+import random               # For the generated corpus
+import re                   # To compile the regex queries
+import subprocess           # To import the index the way older Pythons do
+import sys                  # For the running interpreter
+import pytest               # For the parametrized queries
+from index import regex_clauses, trigrams  # Code under test
+
+WORDS = ["data", "database", "metadata", "update", "dated", "validation", "value", "valid", "in", "invalid",
+         "error", "errors", "terror", "mirror", "a", "at", "ta", "x_1", "café", "cafés"]
+
+@pytest.fixture
+def indexed(server, write_txt):
+    """
+    An indexed corpus of random lines, and scan(plan) listing the units a full scan matches.
+    """
+    chooser = random.Random(3)
+    files = {}
+    for number in range(6):
+        lines = [" ".join(chooser.choice(WORDS) for _ in range(chooser.randint(0, 6))) + chooser.choice(["", ".", "-v2"])
+                 for _ in range(40)]
+        files[write_txt(f"file{number}.txt", lines)] = lines
+    server.SEARCH_INDEX.refresh()
+
+    def scan(plan):
+        return [(path, (line_number,), f"{line}\n") for path in server.SEARCH_INDEX.order[".txt"]
+                for line_number, line in enumerate(files[path], 1) if plan.matches(f"{line}\n")]
+    return scan
+
+KEYWORDS = ["data", "dat", "ata", "at", "a", "valid", "alid", "in", "rror", "err", "x_", "_1", "café", "fé",
+            "data base", "value v", "e e", "ted.", "-v2", "s-v", ".", "missing", "data AND valid",
+            "in OR err", "error AND -v2", "caf OR ata"]
+
+@pytest.mark.parametrize("keyword", KEYWORDS)
+def test_literal_queries_match_a_full_scan(server, indexed, keyword):
+    plan = server.compile_query(keyword)
+    assert server.SEARCH_INDEX.search(".txt", plan) == indexed(plan)
+
+def test_index_keeps_no_text(server, indexed):
+    for entry in server.SEARCH_INDEX.files.values():
+        assert "units" not in entry and entry["count"] == 40
+
+def test_term_lookups_follow_updates(server, indexed, write_txt):
+    index = server.SEARCH_INDEX
+    assert index.search(".txt", server.compile_query("zeb")) == []  # Sorts the terms for prefix lookups
+    path = write_txt("file0.txt", ["a zebra crossing"])
+    assert index.update_file(path, ".txt")
+    expected = [(path, (1,), "a zebra crossing\n")]
+    for keyword in ("zebra", "zeb", "ebra", "ebr", "ossing"):
+        assert index.search(".txt", server.compile_query(keyword)) == expected
+    assert index.remove_file(path)
+    assert index.search(".txt", server.compile_query("ebr")) == []
+    assert "zebra" not in index.postings and "ebr" not in index.trigrams.postings
+
+# Regex patterns with literal parts, narrowed by the trigram index, and patterns without any
+NARROWED_REGEXES = [r"dat(a|e)", r"valid|error", r"^data", r"(r){2}o", r"caf[ée]s?", r"mi.ror", r"data\b", r"(?:dat|met)a", r"[a-d]ata", r"val(ue|id) (in|at)",
+                    r"(?=dated)date", r"(data|value)+ e", r"u[p]d.te", r"error$", r"[^v]alid"]
+SCANNED_REGEXES = [r"\d+", r"a.", r"^$", r"(?i)DATA", r"e\w*s", r"[^a-z ]", r"(a|ta)", r"in(valid)?", r"x_\d",
+                   r"err+or"]
+
+@pytest.mark.parametrize("pattern", NARROWED_REGEXES + SCANNED_REGEXES)
+def test_regex_queries_match_a_full_scan(server, indexed, pattern):
+    plan = server.compile_query(pattern)
+    assert not plan.literal
+    assert server.SEARCH_INDEX.search(".txt", plan) == indexed(plan)
+
+@pytest.mark.parametrize("pattern", NARROWED_REGEXES)
+def test_regex_queries_are_narrowed(server, indexed, pattern):
+    candidates = server.SEARCH_INDEX.trigrams.regex_candidates(server.compile_query(pattern).pattern)
+    assert candidates is not None
+    assert sum(len(unit_ids) for unit_ids in candidates.values()) < server.SEARCH_INDEX.unit_count
+
+@pytest.mark.parametrize("pattern", SCANNED_REGEXES)
+def test_regexes_without_literals_are_scanned(server, indexed, pattern):
+    assert server.SEARCH_INDEX.trigrams.regex_candidates(server.compile_query(pattern).pattern) is None
+
+@pytest.mark.parametrize("pattern", NARROWED_REGEXES + SCANNED_REGEXES)
+def test_regex_requirements_hold_for_every_match(pattern):
+    # Every text a regex matches must contain a trigram of each requirement derived from it
+    chooser = random.Random(pattern)
+    compiled = re.compile(pattern)
+    clauses = regex_clauses(compiled)
+    matched = 0
+    for _ in range(3000):
+        text = " ".join(chooser.choice(WORDS)[chooser.randint(0, 2):] for _ in range(chooser.randint(0, 4)))
+        if compiled.search(text):
+            matched += 1
+            found = trigrams(text)
+            assert all(clause & found for clause in clauses), text
+    assert matched
+
+# Imports the index without re._parser (as on Python 3.8-3.10), then without any regex parser
+WITHOUT_PARSER = """
+import re, sys, warnings
+warnings.simplefilter("ignore", DeprecationWarning)
+if sys.argv[1] == "sre_parse":
+    import sre_parse    # Loaded while re._parser is still there (it wraps it from 3.11)
+else:
+    sys.modules["sre_parse"] = None
+del re._parser
+sys.modules["re._parser"] = None
+import index
+print(sorted(map(sorted, index.regex_clauses(re.compile("dat(a|e)")))))
+"""
+
+@pytest.mark.parametrize("fallback, clauses", [("sre_parse", "[['ata', 'ate'], ['dat']]"),
+                                                       ("none", "[]")])
+def test_index_imports_without_the_private_regex_parser(fallback, clauses):
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    output = subprocess.run([sys.executable, "-c", WITHOUT_PARSER, fallback], cwd=src, capture_output=True,
+                            text=True, check=True).stdout
+    assert output.strip() == clauses
@@ -0,0 +1,76 @@
+# test_protocol.py
+
+import asyncio              # To drive the asyncio request reader
+import socket               # Socket pairs stand in for client connections
+import threading            # The server handles its side of the pair in a thread
+from protocol import (encode_frame, recv_request, recv_message, AsyncRequestReader,  # Code under test
+                      MAGIC, HEADER)
+
+def read_async(data):
+    """
+    Feeds data to an AsyncRequestReader and returns every request it reads.
+    """
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        requests = AsyncRequestReader(reader)
+        found = []
+        while (request := await requests.read_request()) is not None:
+            found.append(request)
+        return found
+    return asyncio.run(read())
+
+def read_sync(data):
+    """
+    Sends data over a socket pair and returns the first request recv_request reads.
+    """
+    client, peer = socket.socketpair()
+    with client, peer:
+        client.sendall(data)
+        client.shutdown(socket.SHUT_WR)
+        return recv_request(peer)
+
+def test_frame_round_trip():
+    message = {"type": "search", "keyword": "données", "limit": 10}
+    frame = encode_frame(message)
+    assert frame.startswith(MAGIC)
+    assert HEADER.unpack(frame[:HEADER.size])[2] == len(frame) - HEADER.size
+    assert read_sync(frame) == (True, message)
+    assert read_async(frame) == [(True, message)]
+
+def test_pipelined_frames_are_kept():
+    frames = [{"type": "search", "keyword": str(i)} for i in range(3)]
+    assert read_async(b"".join(encode_frame(frame) for frame in frames)) == [(True, frame) for frame in frames]
+
+def test_legacy_request_starting_like_the_old_magic():
+    request = "SAE_notes.txt|test|.txt"
+    assert read_sync(request.encode('utf-8')) == (False, request)
+    assert read_async(request.encode('utf-8')) == [(False, request)]
+
+def test_magic_cannot_start_utf8_text():
+    # Any legacy request is UTF-8 text, so it never starts with the frame magic
+    for text in ("S", "SAE", "\xff", "ÿSAE", "\U0001f600|x|.txt"):
+        assert not text.encode('utf-8').startswith(MAGIC[:1])
+
+def test_invalid_utf8_legacy_request():
+    assert read_sync(b"caf\xe9|test|.txt") == (False, None)
+    assert read_async(b"caf\xe9|test|.txt") == [(False, None)]
+
+def test_server_answers_legacy_requests(server, write_txt):
+    write_txt("SAE_notes.txt", ["a test line", "other"])
+    client, peer = socket.socketpair()
+    handler = threading.Thread(target=server.handle_client, args=(peer,), daemon=True)
+    handler.start()
+    with client:
+        client.settimeout(10)
+        client.sendall(b"SAE_notes.txt|test|.txt")
+        assert client.recv(65536).decode('utf-8') == "1 - SAE_notes.txt - Line 1: a test line"
+        client.sendall(b"caf\xe9|test|.txt")
+        assert client.recv(65536).decode('utf-8') == "Invalid request: the text must be encoded in UTF-8."
+        # The connection is still usable, for frames as well
+        client.sendall(encode_frame({"type": "stats"}))
+        assert recv_message(client)["type"] == "stats"
+        client.sendall(b"q")
+    handler.join(10)
+    assert not handler.is_alive()
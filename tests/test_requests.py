@@ -0,0 +1,40 @@
+# test_requests.py
+
+import pytest               # For the parametrized cases
+from connection import get_page_bounds, get_target, parse_legacy, parse_cancel, truncation_message  # Code under test
+
+VALID_BOUNDS = [({}, (0, None)), ({"offset": None, "limit": None}, (0, None)), ({"offset": 5, "limit": 0}, (5, 0))]
+INVALID_BOUNDS = [{"offset": True}, {"offset": False}, {"limit": True}, {"offset": -1}, {"limit": "10"}, {"offset": 1.5}]
+
+@pytest.mark.parametrize("message, bounds", VALID_BOUNDS)
+def test_page_bounds(message, bounds):
+    assert get_page_bounds(message) == bounds
+
+@pytest.mark.parametrize("message", INVALID_BOUNDS)
+def test_page_bounds_rejected(message):
+    with pytest.raises(ValueError):
+        get_page_bounds(message)
+
+def test_target():
+    assert get_target({}) == ("ALL", [])
+    assert get_target({"target": " a.txt ", "extensions": ".txt, .pdf"}) == ("a.txt", [".txt", ".pdf"])
+    assert get_target({"target": "", "extensions": [" .html", ""]}) == ("ALL", [".html"])
+
+def test_legacy_requests():
+    assert parse_legacy(" ALL | data AND x |.txt,.pdf ") == ("ALL", "data AND x", ".txt,.pdf")
+    for message in ("ALL|data", "a|b|c|d", ""):
+        with pytest.raises(ValueError):
+            parse_legacy(message)
+
+def test_cancel_requests():
+    assert parse_cancel((True, {"type": "cancel", "id": 3})) == (True, 3)
+    assert parse_cancel((True, {"type": "search", "id": 3})) == (False, None)
+    assert parse_cancel((False, " CANCEL\n")) == (True, None)
+    assert parse_cancel((False, "ALL|CANCEL|.txt")) == (False, None)
+    assert parse_cancel((False, None)) == (False, None)
+
+def test_truncation_messages():
+    messages = {reason: truncation_message(reason) for reason in ("deadline", "cancelled", "shards")}
+    assert "time limit" in messages["deadline"] and "cancelled" in messages["cancelled"]
+    assert "servers did not answer" in messages["shards"]
+    assert truncation_message(None) == "Search stopped: results are incomplete."
@@ -0,0 +1,117 @@
+# test_result_cache.py
+
+import pytest               # For the fixtures
+
+def search(server, **request):
+    """
+    Sends a framed search to the server and returns its response frame.
+    """
+    frames = []
+    server.handle_message(dict({"type": "search", "keyword": "word", "extensions": [".txt"]}, **request),
+                          lambda frame: frames.append(frame) or 0)
+    assert len(frames) == 1
+    return frames[0]
+
+@pytest.fixture
+def searches(server, monkeypatch):
+    """
+    Counts the searches actually run (those not answered from the result cache).
+    """
+    count = {"searches": 0}
+    iter_search = server.iter_search
+    def counted(*args):
+        count["searches"] += 1
+        yield from iter_search(*args)
+    monkeypatch.setattr(server, "iter_search", counted)
+    return count
+
+def texts(response):
+    """
+    Returns the text of the hits of a response.
+    """
+    return [result["text"] for result in response["results"]]
+
+def test_repeated_page_is_a_cache_hit(server, write_txt, searches):
+    write_txt("notes.txt", [f"word {i}" for i in range(50)])
+    first = search(server, offset=0, limit=10)
+    assert first["more"] and texts(first) == [f"word {i}" for i in range(10)]
+    hits = server.RESULT_CACHE.stats()["hits"]
+    assert search(server, offset=0, limit=10) == first
+    assert server.RESULT_CACHE.stats()["hits"] == hits + 1
+    assert searches["searches"] == 1
+
+def test_paging_reuses_the_cached_prefix(server, write_txt, searches):
+    write_txt("notes.txt", [f"word {i}" for i in range(100)])
+    found = []
+    offset = 0
+    while True:
+        response = search(server, offset=offset, limit=5)
+        found += texts(response)
+        offset += response["count"]
+        if not response["more"]:
+            break
+    assert found == [f"word {i}" for i in range(100)]
+    # The cached prefix doubles every time the search runs (6, 12, 24, 48, 96, then all
+    # 100 results), instead of once per page
+    assert searches["searches"] <= 6
+    assert search(server)["count"] == 100
+    assert searches["searches"] <= 6
+
+def test_closing_a_page_does_no_extra_search_work(server, write_txt, monkeypatch):
+    write_txt("notes.txt", [f"word {i}" for i in range(1000)])
+    pulled = {"hits": 0}
+    iter_search = server.iter_search
+    def counted(*args):
+        for result in iter_search(*args):
+            pulled["hits"] += 1
+            yield result
+    monkeypatch.setattr(server, "iter_search", counted)
+    search(server, offset=0, limit=10)
+    assert pulled["hits"] == 11  # The page, and one more to tell whether another exists
+    pulled["hits"] = 0
+    assert texts(search(server, offset=10, limit=10)) == [f"word {i}" for i in range(10, 20)]
+    assert pulled["hits"] == 11 + 11  # Runs up to the end of the prefix again, then reads as many more
+
+def test_changed_file_invalidates_cached_pages(server, write_txt):
+    write_txt("notes.txt", [f"word {i}" for i in range(20)])
+    assert search(server, offset=0, limit=5)["more"]
+    write_txt("notes.txt", ["word"])
+    response = search(server, offset=0, limit=5)
+    assert (response["count"], response["more"]) == (1, False)
+
+def test_watcher_update_invalidates_cached_results(server, write_txt, monkeypatch):
+    path = write_txt("notes.txt", ["old word", "a", "b", "c"])
+    server.SEARCH_INDEX.refresh()
+    monkeypatch.setattr(server, "WATCHER", object())  # Queries leave the index to the watcher
+    assert texts(search(server)) == ["old word"]
+    write_txt("notes.txt", ["other", "new word", "b", "c"])
+    # The watcher has not caught up yet: the index still points at the first line
+    assert search(server)["results"] == [{"message": "No matches found for file type: .txt."}]
+    server.ingest_file(path, ".txt")
+    assert texts(search(server)) == ["new word"]
+    server.forget_file(path, ".txt")
+    assert search(server)["results"] == [{"message": "No matches found for file type: .txt."}]
+
+def test_scrolling_through_pages_and_back(server, write_txt, searches):
+    # The page requests of the client's result view (client.ResultView): down to the end,
+    # then back up to pages it dropped
+    write_txt("notes.txt", [f"word {i}" for i in range(4000)])
+    page_size = 200
+    offsets = list(range(0, 4000, page_size))
+    for offset in offsets + offsets[::-1]:
+        response = search(server, offset=offset, limit=page_size)
+        assert texts(response) == [f"word {i}" for i in range(offset, offset + page_size)]
+        assert response["more"] == (offset + page_size < 4000)
+    # Each search at least doubles the cached prefix: 201, 402, 804, ... 4000 results
+    assert searches["searches"] <= 6
+
+def test_ranked_search_caches_only_the_ranking(server, write_txt, searches):
+    write_txt("notes.txt", [f"word {i}" for i in range(500)] + ["word word word"])
+    first = search(server, rank=True, k=3)
+    assert first["count"] == 3 and texts(first)[0] == "word word word"
+    assert search(server, rank=True, k=3) == first
+    assert searches["searches"] == 1
+    # The cache holds the 3 ranked hits, not the 501 matches
+    assert [len(entry[2]) for entry in server.RESULT_CACHE.entries.values()] == [3]
+    assert search(server, rank=True, k=5)["count"] == 5  # Another k is another ranking
+    assert searches["searches"] == 2
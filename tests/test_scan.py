@@ -0,0 +1,28 @@
+# test_scan.py
+
+def pending(*files):
+    """
+    Builds the pending list of get_units_many from (extension, size) pairs.
+    """
+    return [(slot, f"file{slot}{extension}", extension, (0, size)) for slot, (extension, size) in enumerate(files)]
+
+def test_small_batches_stay_in_the_request_thread(server, monkeypatch):
+    monkeypatch.setattr(server, "SCAN_WORKERS", 4)
+    assert server.pooled_extensions(pending((".pdf", 10000), (".html", 100000), (".txt", 10 ** 9))) == set()
+    assert server.pooled_extensions(pending((".pdf", 10000), (".pdf", 10000), (".html", 300000))) == {".pdf", ".html"}
+    monkeypatch.setattr(server, "SCAN_WORKERS", 1)
+    assert server.pooled_extensions(pending((".pdf", 10 ** 9))) == set()
+
+def test_pooled_and_serial_files_keep_their_order(server, corpus, write_txt, monkeypatch):
+    monkeypatch.setattr(server, "SCAN_WORKERS", 2)
+    monkeypatch.setattr(server, "SCAN_POOL_MIN_BYTES", {".txt": 1})  # TXT files go to the workers, HTML files do not
+    files = [(write_txt(f"notes{number}.txt", [f"line {number}"]), ".txt") for number in range(3)]
+    (corpus / "data" / "html" / "page.html").write_text("<p>paragraph</p>", encoding='utf-8')
+    files.insert(1, ("data/html/page.html", ".html"))
+    try:
+        found = server.get_units_many(files + [("missing.txt", ".txt")])
+    finally:
+        server.set_scan_workers(1)
+    assert [units for units, error in found[:4]] == [[((1,), "line 0\n")], [((), "paragraph")],
+                                                     [((1,), "line 1\n")], [((1,), "line 2\n")]]
+    assert isinstance(found[4][1], OSError)
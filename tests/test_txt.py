@@ -0,0 +1,42 @@
+# test_txt.py
+
+import pytest               # For the parametrized files
+
+# Raw contents of TXT files, with every kind of line ending
+FILES = {
+    "lf": b"a word\nother\nword again\n",
+    "crlf": b"a word\r\nother\r\nword again\r\n",
+    "cr": b"a word\rother\rword again",
+    "mixed": b"word\r\n\rother\n\nword\r\r\nlast word",
+    "utf8": "café word\r\nété\rword 中文\n".encode('utf-8'),
+}
+INVALID = b"a word\nbad \xe9 byte\nword again\n"  # Latin-1, not UTF-8
+QUERIES = ["word", "other", "word AND again", "word OR other", r"^word", r"word$", r"\w+ \w+"]
+
+@pytest.mark.parametrize("chunk", [None, 1, 2, 3])
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("name", FILES)
+def test_scanned_lines_match_extracted_lines(server, corpus, monkeypatch, name, query, chunk):
+    if chunk is not None:
+        monkeypatch.setattr(server, "NEWLINE_COUNT_CHUNK", chunk)  # Splits the b"\r\n" between chunks
+    path = corpus / "data" / "txt" / "file.txt"
+    path.write_bytes(FILES[name])
+    plan = server.compile_query(query)
+    expected = [(location, text) for location, text in server.extract_txt_units(str(path)) if plan.matches(text)]
+    assert list(server.scan_txt_mmap(str(path), plan)) == expected
+
+@pytest.mark.parametrize("query", ["word", r"^word"])
+def test_invalid_utf8_fails_like_extraction(server, corpus, query):
+    path = corpus / "data" / "txt" / "file.txt"
+    path.write_bytes(INVALID)
+    with pytest.raises(UnicodeDecodeError):
+        server.extract_txt_units(str(path))
+    with pytest.raises(UnicodeDecodeError):
+        next(server.scan_txt_mmap(str(path), server.compile_query(query)))
+
+def test_search_does_not_depend_on_the_file_size(server, corpus, monkeypatch):
+    for name, content in dict(FILES, invalid=INVALID).items():
+        (corpus / "data" / "txt" / f"{name}.txt").write_bytes(content)
+    extracted = list(server.iter_search("ALL", "word", ".txt"))
+    monkeypatch.setattr(server, "MMAP_THRESHOLD", 1)  # Every file is scanned in place
+    assert list(server.iter_search("ALL", "word", ".txt")) == extracted